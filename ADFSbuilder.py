@@ -0,0 +1,644 @@
+"""
+ADFSbuilder.py, support for creating ADFS disc images from lists of files and
+directories, such as the directory trees written by ADFSdisc.extract_files().
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno, os, string, struct
+
+import ADFSlib, ADFSwriter
+from ADFSwriter import owner_read, owner_write, locked, directory_flag, \
+                       old_attribute_bits, object_attributes
+
+# Old format discs: the size of the disc, the addresses of the root directory
+# and of the first space after it, the size of each directory, the number of
+# entries a directory can hold, and whether the tracks of the two sides of
+# the disc are interleaved in the image file.
+old_formats = {
+    "S": (163840, 0x200, 0x700, 0x500, 47, False),
+    "M": (327680, 0x200, 0x700, 0x500, 47, False),
+    "L": (655360, 0x200, 0x700, 0x500, 47, True),
+    "D": (819200, 0x400, 0xc00, 0x800, 77, False),
+    }
+
+# New format discs: the size of the disc, the number of sectors per track,
+# density, number of map zones, zone spare bits and the base two logarithm
+# of the number of bytes described by each map bit.
+new_formats = {
+    "E": (819200, 5, 2, 1, 0x520, 7),
+    "F": (1638400, 10, 4, 4, 0x640, 6),
+    }
+
+# Space on old format discs is allocated in 256 byte units.
+old_map_unit = 256
+
+# Names with a three digit hexadecimal suffix following a comma are given the
+# filetype that the suffix describes, and files with the same name as another
+# file followed by an ",inf" or ".inf" suffix describe that file.
+filetype_separator = ","
+inf_suffixes = (",inf", ".inf")
+
+
+def riscos_name(host_name):
+
+    """Returns the RISC OS name that corresponds to the name of a file or
+    directory on the host, where the roles of "." and "/" are reversed. An
+    IOError is raised if the name cannot be used on RISC OS."""
+    
+    name = host_name.replace(".", "/")
+    
+    if not name or len(name) > 10:
+        raise IOError(errno.ENAMETOOLONG, "Invalid name: %s" % host_name)
+    
+    for c in name:
+    
+        if c in ADFSwriter.invalid_name_chars or ord(c) <= 32 or \
+            ord(c) >= 127:
+            
+            raise IOError(errno.EINVAL, "Invalid name: %s" % host_name)
+    
+    return name
+
+
+def read_inf(path):
+
+    """Returns a tuple containing the load and execution addresses given in
+    the .inf file at the specified path. These follow the name of the file,
+    separated by spaces or tabs, and are given in hexadecimal."""
+    
+    f = open(path)
+    try:
+        fields = f.readline().split()
+    finally:
+        f.close()
+    
+    try:
+        return int(fields[1], 16), int(fields[2], 16)
+    except (IndexError, ValueError):
+        raise IOError(errno.EINVAL, "Invalid .inf file: %s" % path)
+
+
+def read_host_tree(path):
+
+    """Returns a list of ADFSfile and ADFSdirectory instances describing the
+    files and directories in the directory on the host at the given path,
+    including those in its subdirectories. The path of each file on the host
+    is stored in its path attribute.
+    
+    The load and execution addresses of each file are read from its .inf
+    file, if it has one. Otherwise, any filetype given as a suffix is used,
+    or the Data filetype if there is none, and the file is time stamped
+    with its modification time.
+    """
+    
+    names = os.listdir(path)
+    present = dict([(name, None) for name in names])
+    names.sort()
+    
+    objects = []
+    used = {}
+    
+    for host_name in names:
+    
+        host_path = os.path.join(path, host_name)
+        
+        if host_name[-4:] in inf_suffixes and host_name[:-4] in present:
+            continue
+        
+        mtime = os.path.getmtime(host_path)
+        
+        if os.path.isdir(host_path):
+        
+            obj = ADFSlib.ADFSdirectory(riscos_name(host_name),
+                                        read_host_tree(host_path))
+            obj.load_address, obj.execution_address = \
+                ADFSlib.riscos_time_stamp(0xfffffd00, mtime)
+            obj.attributes = directory_flag
+        
+        else:
+        
+            for suffix in inf_suffixes:
+            
+                if os.path.isfile(host_path + suffix):
+                
+                    name = host_name
+                    load, exe = read_inf(host_path + suffix)
+                    break
+            
+            else:
+            
+                name, filetype = host_name, 0xffd
+                base, suffix = host_name[:-4], host_name[-4:]
+                
+                if base and suffix[:1] == filetype_separator and \
+                    not suffix[1:].strip(string.hexdigits):
+                    
+                    name, filetype = base, int(suffix[1:], 16)
+                
+                load, exe = ADFSlib.riscos_time_stamp(
+                    0xfff00000 | (filetype << 8), mtime)
+            
+            obj = ADFSlib.ADFSfile(riscos_name(name), None, load, exe,
+                                   os.path.getsize(host_path))
+            obj.path = host_path
+            obj.attributes = owner_read | owner_write
+        
+        key = obj.name.lower()
+        if key in used:
+            raise IOError(errno.EEXIST, "Object exists: %s" % host_path)
+        
+        used[key] = None
+        objects.append(obj)
+    
+    return objects
+
+
+def track_order(tracks):
+
+    """Returns a list of the numbers of the tracks of a disc in the order in
+    which they are stored in an interleaved image file, where the tracks of
+    the two sides are stored alternately (0 80 1 81 2 82 ... 79 159)."""
+    
+    half = tracks // 2
+    order = []
+    
+    for i in range(half):
+        order = order + [i, half + i]
+    
+    return order
+
+
+def old_directory_block(entries, name, parent, title, sequence):
+
+    """Returns a string containing a directory for an S, M or L format disc
+    holding the list of entries given. Each entry is a (name, load address,
+    execution address, length, sector, attributes) tuple, where the
+    attributes are stored in the top bits of the characters of the name.
+    The directory's own name, the sector of its parent, its title and its
+    sequence number are stored in its tail. The names and the title are
+    given as strings of bytes."""
+    
+    if len(entries) > old_formats["S"][4]:
+        raise IOError(errno.ENOSPC, "Directory is full")
+    
+    entries = sorted(entries, key = lambda entry: entry[0].lower())
+    
+    pieces = [struct.pack("<B", sequence), b"Hugo"]
+    
+    for entry_name, load, exe, length, sector, attributes in entries:
+    
+        chars = bytearray(entry_name[:10].ljust(10, b"\r"))
+        
+        for i in range(len(old_attribute_bits)):
+            if attributes & old_attribute_bits[i]:
+                chars[i] = chars[i] | 0x80
+        
+        pieces.append(bytes(chars))
+        pieces.append(struct.pack("<III", load, exe, length))
+        pieces.append(struct.pack("<I", sector)[:3] + b"\x00")
+    
+    block = b"".join(pieces)
+    
+    tail = (name[:10].ljust(10, b"\r") + struct.pack("<I", parent)[:3] +
+            title[:19].ljust(19, b"\r") + (b"\x00" * 14) +
+            struct.pack("<B", sequence) + b"Hugo" + b"\x00")
+    
+    size = old_formats["S"][3]
+    return block + (b"\x00" * (size - len(block) - len(tail))) + tail
+
+
+def old_map_block(free, disc_size, disc_name, disc_id = 0, boot_option = 0):
+
+    """Returns a string containing the two sectors of the free space map of an
+    old format disc, describing the list of (start, end) offsets of free
+    space. The disc name, given as a string of bytes, is stored in alternate
+    characters of the two sectors."""
+    
+    starts = bytearray(256)
+    lengths = bytearray(256)
+    
+    for i in range(len(free)):
+    
+        start, end = free[i]
+        starts[i * 3:i * 3 + 3] = struct.pack("<I", start // old_map_unit)[:3]
+        lengths[i * 3:i * 3 + 3] = struct.pack(
+            "<I", (end - start) // old_map_unit)[:3]
+    
+    disc_name = disc_name[:10].ljust(10, b" ")
+    starts[0xf7:0xfc] = disc_name[0::2]
+    lengths[0xf6:0xfb] = disc_name[1::2]
+    
+    starts[0xfc:0xff] = struct.pack("<I", disc_size // old_map_unit)[:3]
+    lengths[0xfb:0xfd] = struct.pack("<H", disc_id)
+    lengths[0xfd] = boot_option
+    lengths[0xfe] = len(free) * 3
+    
+    starts, lengths = bytes(starts[:255]), bytes(lengths[:255])
+    return starts + struct.pack("<B", ADFSlib.old_map_check(starts)) + \
+           lengths + struct.pack("<B", ADFSlib.old_map_check(lengths))
+
+
+def disc_record(disc_format, disc_name, disc_id = 0):
+
+    """Returns a string containing the disc record for a new format disc of
+    the given format, with the disc name given as a string of bytes."""
+    
+    size, sectors, density, zones, zone_spare, log2_bpmb = \
+        new_formats[disc_format]
+    
+    record = struct.pack("<BBBBBBBBBBHIIH10sIIBBB",
+                         10, sectors, 2, density, 15, log2_bpmb, 1, 0, 0,
+                         zones & 0xff, zone_spare, root_sin(disc_format),
+                         size & 0xffffffff, disc_id,
+                         disc_name[:10].ljust(10, b" "), 0, size >> 32, 0, 0,
+                         zones >> 8)
+    
+    return record.ljust(60, b"\x00")
+
+
+def root_sin(disc_format):
+
+    """Returns the SIN of the root directory of a new format disc, which is
+    stored after the two copies of the map in the object with an ID of 2."""
+    
+    zones = new_formats[disc_format][3]
+    return 0x200 | (2 * zones + 1)
+
+
+class ImageBuilder:
+
+    """builder = ImageBuilder(disc_format, title = "", interleaved = None)
+    
+    Creates a disc image of the given format, which is one of "S", "M", "L",
+    "D", "E" or "F", with the title given. The tracks of L format images are
+    interleaved unless interleaved is False. Files and directories are added
+    to the list held in the files attribute, usually with the add_tree()
+    method, and the image is obtained by calling the build() method.
+    
+    Files are either ADFSfile instances whose data is held in memory or, as
+    returned by read_host_tree(), instances with a path attribute naming a
+    file on the host to read. Objects are placed on the disc in catalogue
+    order without gaps between them, with each directory placed before the
+    objects it contains, so that each object is stored in a single piece
+    unless it crosses a boundary between two zones of the map or the map
+    itself. An IOError is raised if the objects do not fit on the disc.
+    """
+    
+    def __init__(self, disc_format, title = "", interleaved = None):
+    
+        if disc_format not in old_formats and disc_format not in new_formats:
+        
+            raise ADFSlib.ADFS_exception(
+                "Unknown disc format: %s" % disc_format)
+        
+        if interleaved and disc_format != "L":
+        
+            raise ADFSlib.ADFS_exception(
+                "Only L format images can be interleaved")
+        
+        self.disc_format = disc_format
+        self.title = title
+        self.interleaved = interleaved
+        self.files = []
+    
+    def add_tree(self, path):
+    
+        """Adds the files and directories in the directory on the host at the
+        given path to the root directory of the disc."""
+        
+        self.files = self.files + read_host_tree(path)
+    
+    def walk(self, files = None):
+    
+        """Returns a generator that yields each object in the catalogue, with
+        each directory yielded before the objects it contains."""
+        
+        if files is None:
+            files = self.files
+        
+        for obj in files:
+        
+            yield obj
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+            
+                for item in self.walk(obj.files):
+                    yield item
+    
+    def _read(self, obj):
+    
+        if not hasattr(obj, "path"):
+            return obj.data
+        
+        f = open(obj.path, "rb")
+        try:
+            data = f.read(obj.length + 1)
+        finally:
+            f.close()
+        
+        if len(data) != obj.length:
+            raise IOError(errno.EIO, "File changed: %s" % obj.path)
+        
+        return data
+    
+    def build(self):
+    
+        """Returns a string containing the disc image."""
+        
+        if self.disc_format in old_formats:
+            return self._build_old()
+        else:
+            return self._build_new()
+    
+    def write(self, f):
+    
+        """Writes the disc image to the file object, f, with a single write."""
+        
+        f.write(self.build())
+    
+    def _build_old(self):
+    
+        size, root, first, directory_size, max_entries, interleaved = \
+            old_formats[self.disc_format]
+        
+        # Give each object the address that follows the previous one.
+        self.addresses = {}
+        position = first
+        
+        for obj in self.walk():
+        
+            self.addresses[obj] = position
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+                position = position + directory_size
+            else:
+                position = position + obj.length
+            
+            position = position + (-position % old_map_unit)
+        
+        if position > size:
+            raise IOError(errno.ENOSPC, "Not enough space on the disc")
+        
+        image = bytearray(size)
+        self._write_old_directory(image, b"$", self.files, root, root,
+                                  ADFSlib.to_bytes(self.title) or b"$")
+        
+        if position < size:
+            free = [(position, size)]
+        else:
+            free = []
+        
+        image[:0x200] = old_map_block(free, size, ADFSlib.to_bytes(self.title))
+        
+        if self.interleaved is not None:
+            interleaved = self.interleaved
+        
+        if interleaved:
+        
+            track_size = 16 * 256
+            image = bytearray().join(
+                [image[track * track_size:(track + 1) * track_size]
+                 for track in track_order(size // track_size)]
+                )
+        
+        return bytes(image)
+    
+    def _write_old_directory(self, image, name, files, address, parent,
+                             title):
+        
+        directory_size = old_formats[self.disc_format][3]
+        entries = []
+        
+        for obj in files:
+        
+            child = self.addresses[obj]
+            obj_name = ADFSlib.to_bytes(obj.name)
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+            
+                entries.append((obj_name, 0, 0, directory_size,
+                                child // old_map_unit,
+                                owner_read | locked | directory_flag))
+                
+                self._write_old_directory(image, obj_name, obj.files, child,
+                                          address, obj_name)
+            else:
+            
+                entries.append((obj_name, obj.load_address,
+                                obj.execution_address, obj.length,
+                                child // old_map_unit, object_attributes(obj)))
+                
+                image[child:child + obj.length] = self._read(obj)
+        
+        if self.disc_format == "D":
+        
+            block = ADFSwriter.new_directory_block(
+                entries, name, parent // old_map_unit, title, 0,
+                marker = b"Hugo")
+        else:
+        
+            block = old_directory_block(entries, name, parent // old_map_unit,
+                                        title, 0)
+        
+        image[address:address + directory_size] = block
+    
+    def _new_map(self):
+    
+        # Returns an ADFSnewMap instance describing a map without any
+        # fragments, with the disc record stored in the first zone.
+        size, sectors, density, zones, zone_spare, log2_bpmb = \
+            new_formats[self.disc_format]
+        
+        sector_size = 1024
+        record = {"zone spare": zone_spare, "id length": 15,
+                  "bytes per bit": 1 << log2_bpmb, "zones": zones,
+                  "disc size": size, "root SIN": root_sin(self.disc_format)}
+        
+        template = bytearray(zones * sector_size)
+        template[4:64] = disc_record(self.disc_format,
+                                     ADFSlib.to_bytes(self.title))
+        
+        # The cross check bytes of the zones combine to give 0xff.
+        template[(zones - 1) * sector_size + 3] = 0xff
+        
+        disc_map = ADFSlib.ADFSnewMap(0, 0x40, zones * sector_size,
+                                      bytes(template), sector_size, record)
+        
+        # The bits after the end of each zone are set.
+        for offset, start, end, first in disc_map.layout:
+        
+            for bit in range(end, 8 * sector_size):
+                template[offset + bit // 8] |= 1 << (bit % 8)
+        
+        disc_map.sectors = bytes(template)
+        return disc_map
+    
+    def _build_new(self):
+    
+        disc_map = self._new_map()
+        editor = ADFSwriter.MapEditor(disc_map)
+        bytes_per_bit = editor.bytes_per_bit
+        sector_size = disc_map.sector_size
+        zones = len(disc_map.layout)
+        
+        # The two copies of the map and the root directory occupy the object
+        # with an ID of 2 at the start of the middle zone.
+        map_zone = zones // 2
+        map_length = zones * sector_size
+        map_bits = editor._round((2 * map_length +
+                                  ADFSwriter.new_directory_size) //
+                                 bytes_per_bit)
+        
+        fragments = [[] for zone in range(zones)]
+        space = []
+        
+        for zone in range(zones):
+        
+            offset, start, end, first = disc_map.layout[zone]
+            
+            if zone == map_zone:
+                fragments[zone].append([start, map_bits, 2])
+                start = start + map_bits
+            
+            space.append([zone, start, end])
+        
+        # Place each object in the space that follows the previous one. As in
+        # MapEditor.allocate(), space that is too small to form a fragment of
+        # its own is given to the object placed before it. Each object is
+        # given an ID belonging to the zone in which it begins, so that its
+        # fragments are found in order when the map is read.
+        next_ids = [max(3, zone * disc_map.ids_per_zone)
+                    for zone in range(zones)]
+        self.addresses = {}
+        self.pieces = {}
+        i = 0
+        
+        for obj in self.walk():
+        
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+                length = ADFSwriter.new_directory_size
+            elif obj.length == 0:
+                self.addresses[obj] = 0
+                continue
+            else:
+                length = obj.length
+            
+            needed = editor._round((length + bytes_per_bit - 1) //
+                                   bytes_per_bit)
+            placed = self.pieces[obj] = []
+            
+            while needed > 0:
+            
+                if i == len(space):
+                    raise IOError(errno.ENOSPC, "Not enough space on the disc")
+                
+                zone, start, end = space[i]
+                size = end - start
+                take = min(size, max(needed, editor.minimum))
+                
+                if size - take < editor.minimum:
+                    take = size
+                
+                placed.append((zone, start, take))
+                space[i][1] = start + take
+                needed = needed - take
+                
+                if take == size:
+                    i = i + 1
+            
+            zone = placed[0][0]
+            file_no = next_ids[zone]
+            
+            if file_no >= min(1 << editor.id_length,
+                              (zone + 1) * disc_map.ids_per_zone):
+                
+                raise IOError(errno.ENOSPC, "Too many objects on the disc")
+            
+            next_ids[zone] = file_no + 1
+            self.addresses[obj] = file_no << 8
+            
+            for zone, start, length in placed:
+                fragments[zone].append([start, length, file_no])
+        
+        for zone, start, end in space:
+        
+            if end > start:
+                fragments[zone].append([start, end - start, None])
+        
+        for zone_fragments in fragments:
+            zone_fragments.sort()
+        
+        editor.zones = fragments
+        new_map = editor.encode()
+        
+        image = bytearray(disc_map.record["disc size"])
+        map_address = disc_map.fragment_address(
+            map_zone, disc_map.layout[map_zone][1])
+        image[map_address:map_address + 2 * map_length] = new_map + new_map
+        
+        sin = root_sin(self.disc_format)
+        self._write_new_directory(image, disc_map, b"$", self.files,
+                                  map_address + 2 * map_length, sin, sin,
+                                  ADFSlib.to_bytes(self.title) or b"$")
+        
+        return bytes(image)
+    
+    def _write_new_directory(self, image, disc_map, name, files, address,
+                             sin, parent, title):
+        
+        entries = []
+        
+        for obj in files:
+        
+            child = self.addresses[obj]
+            obj_name = ADFSlib.to_bytes(obj.name)
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+                length = ADFSwriter.new_directory_size
+            else:
+                length = obj.length
+            
+            # Directories read from old format discs have no addresses.
+            entries.append((obj_name, getattr(obj, "load_address", 0),
+                            getattr(obj, "execution_address", 0), length,
+                            child, object_attributes(obj)))
+            
+            if obj not in self.pieces:
+                continue
+            
+            placed = self.pieces[obj]
+            start = disc_map.fragment_address(placed[0][0], placed[0][1])
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+            
+                self._write_new_directory(image, disc_map, obj_name,
+                                          obj.files, start, child, sin,
+                                          obj_name)
+                continue
+            
+            data = self._read(obj)
+            
+            for zone, bit, length in placed:
+            
+                start = disc_map.fragment_address(zone, bit)
+                length = min(length * disc_map.record["bytes per bit"],
+                             len(data))
+                image[start:start + length] = data[:length]
+                data = data[length:]
+        
+        block = ADFSwriter.new_directory_block(entries, name, parent, title, 0)
+        image[address:address + len(block)] = block
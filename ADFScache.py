@@ -0,0 +1,274 @@
+"""
+ADFScache.py, a cache of parsed ADFS disc images and file data for
+long-running processes.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+from collections import OrderedDict
+
+import ADFSlib
+
+
+def load_image(path, recover = 0, use_mmap = 0):
+
+    """Returns an ADFSdisc instance for the disc image at the given path.
+    File data is not copied from the image so that it can be cached
+    separately. If recover is True, directories that are not part of the
+    catalogue are recovered, and if use_mmap is True, the image is mapped
+    into memory, as described for ADFSdisc."""
+    
+    return ADFSlib.ADFSdisc(open(path, "rb"), copy_data = 0,
+                            use_mmap = use_mmap, recover = recover)
+
+
+def estimate_size(disc):
+
+    """Returns an estimate of the number of bytes of memory used by the
+    contents of the ADFSdisc instance, disc. Only the image data and any file
+    data copied from it are counted since these dominate the total."""
+    
+    size = len(disc.sectors)
+    
+    if disc.copy_data:
+    
+        for path, obj in disc.walk():
+        
+            if isinstance(obj, ADFSlib.ADFSfile):
+            
+                size = size + obj.length
+    
+    return size
+
+
+class ImageCache:
+
+    """cache = ImageCache(budget, loader = load_image)
+    
+    Holds parsed disc images, keyed by the paths of the image files, and the
+    data of files within them, keyed by image path and file path, so that
+    they can be shared between requests. Images are parsed by calling the
+    loader function with the path of the image when they are first requested.
+    
+    When the estimated memory used by the cached images and file data exceeds
+    budget bytes, the least recently used entries are discarded until the
+    total is within the budget again. Discarded entries are read again when
+    they are next requested. The most recently requested entry is always kept,
+    even if it is larger than the budget on its own.
+    
+    The cache can be used from several threads at once.
+    """
+    
+    def __init__(self, budget, loader = load_image):
+    
+        self.budget = budget
+        self.loader = loader
+        
+        # Entries are kept in order of use, least recently used first.
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, path):
+    
+        """Returns the parsed image for the image file at path, loading it if
+        necessary. Any exception raised by the loader is passed on to the
+        caller."""
+        
+        return self._get(path, self._load_image, path)
+    
+    def get_data(self, path, file_path, obj = None):
+    
+        """Returns the data for the file with the given file_path in the image
+        at path. If the ADFSfile instance for the file is supplied as obj, its
+        data is read directly; otherwise, the file is found by looking up its
+        path in the image's catalogue."""
+        
+        return self._get((path, file_path), self._load_data, path, file_path,
+                         obj)
+    
+    def discard(self, path):
+    
+        """Removes the image for the image file at path, and the data of any
+        files in it, from the cache."""
+        
+        self.lock.acquire()
+        try:
+        
+            for key in list(self.entries.keys()):
+            
+                if key == path or (type(key) == tuple and key[0] == path):
+                
+                    value, size = self.entries.pop(key)
+                    self.size = self.size - size
+        
+        finally:
+            self.lock.release()
+    
+    def _get(self, key, loader, *args):
+    
+        self.lock.acquire()
+        try:
+        
+            entry = self.entries.pop(key, None)
+            
+            if entry is not None:
+            
+                # Move the entry to the most recently used end.
+                self.entries[key] = entry
+                self.hits = self.hits + 1
+                return entry[0]
+            
+            self.misses = self.misses + 1
+        
+        finally:
+            self.lock.release()
+        
+        # Read the value without holding the lock so that requests for other
+        # entries are not delayed.
+        value, size = loader(*args)
+        
+        self.lock.acquire()
+        try:
+        
+            entry = self.entries.pop(key, None)
+            
+            if entry is not None:
+            
+                # Another thread read the same value in the meantime.
+                self.entries[key] = entry
+                return entry[0]
+            
+            self.entries[key] = (value, size)
+            self.size = self.size + size
+            self._evict()
+        
+        finally:
+            self.lock.release()
+        
+        return value
+    
+    def _load_image(self, path):
+    
+        disc = self.loader(path)
+        return disc, estimate_size(disc)
+    
+    def _load_data(self, path, file_path, obj):
+    
+        if obj is None:
+        
+            obj = self.get(path).find(file_path)
+            
+            if not isinstance(obj, ADFSlib.ADFSfile):
+                raise KeyError(file_path)
+        
+        data = obj.read()
+        return data, len(data)
+    
+    def _evict(self):
+    
+        # Discard least recently used entries until the cache is within its
+        # budget, always leaving the most recently used entry in place.
+        
+        while self.size > self.budget and len(self.entries) > 1:
+        
+            key, (value, size) = self.entries.popitem(last = False)
+            self.size = self.size - size
+            self.evictions = self.evictions + 1
+
+
+class ReadAhead:
+
+    """reader = ReadAhead(disc, obj, window = 65536, max_window = 1048576)
+    
+    Reads the data of the ADFSfile, obj, in the ADFSdisc instance, disc, for
+    a single open file. Only the parts of the image holding the data that is
+    requested are read.
+    
+    When one read follows on from the previous one, the pieces of the image
+    holding the next window bytes of the file are requested in advance, in
+    the order that they are stored in the image rather than the order they
+    occur in the file, so that the pieces of fragmented files can be read
+    with as little seeking as possible. The window doubles in size each time
+    it is requested, up to max_window bytes, and returns to its original size
+    when a read is made elsewhere in the file.
+    
+    Each open file should have its own reader. Reads can be made from more
+    than one thread, since the state used to detect sequential reads is only
+    changed while the reader's lock is held.
+    """
+    
+    def __init__(self, disc, obj, window = 65536, max_window = 1048576):
+    
+        self.disc = disc
+        self.obj = obj
+        self.initial_window = self.window = window
+        self.max_window = max_window
+        
+        # The offset expected for the next sequential read and the offset
+        # up to which data has been requested in advance.
+        self.position = 0
+        self.prefetched = 0
+        self.lock = threading.Lock()
+    
+    def read(self, offset, length):
+    
+        """Returns up to length bytes of the file's data, beginning at the
+        given offset."""
+        
+        data = self.obj.read_range(offset, length)
+        
+        self.lock.acquire()
+        try:
+            self._advance(offset, offset + len(data))
+        finally:
+            self.lock.release()
+        
+        return data
+    
+    def _advance(self, offset, end):
+    
+        # Updates the state of the reader after a read of the data between
+        # offset and end, requesting the following data if reads are
+        # sequential.
+        if offset != self.position:
+        
+            # Random access, so only request data when reads are sequential
+            # again.
+            self.window = self.initial_window
+            self.prefetched = end
+        
+        elif self.prefetched - end < self.window // 2 and \
+            max(end, self.prefetched) < self.obj.length:
+            
+            # Less than half a window of data has been requested in advance,
+            # so request the next window.
+        
+            start = max(end, self.prefetched)
+            self.prefetched = end + self.window
+            
+            ranges = self.obj.image_ranges(start, self.prefetched - start)
+            ranges.sort()
+            self.disc.advise(ranges)
+            
+            self.window = min(self.window * 2, self.max_window)
+        
+        self.position = end
@@ -19,13 +19,19 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from __future__ import print_function
+
 __author__ = "David Boddie <david@boddie.org.uk>"
 __date__ = "Sun 29th August 2010"
 __version__ = "0.42"
 __license__ = "GNU General Public License (version 3)"
 
 
-import os, string, struct, time
+import binascii, bisect, mmap, os, re, string, struct, sys, time
+
+# The hashlib, json and ctypes modules are only imported when they are first
+# needed, since most programs that read images do not use them and they take
+# longer to import than the rest of this module.
 
 
 INFORM = 0
@@ -33,7 +39,231 @@ WARNING = 1
 ERROR = 2
 
 # Find the number of centiseconds between 1900 and 1970.
-between_epochs = ((365 * 70) + 17) * 24 * 360000L
+between_epochs = ((365 * 70) + 17) * 24 * 360000
+
+# The advice given to posix_fadvise() for parts of an image file that will
+# be read soon, and the function itself, which is found when it is first
+# needed. Python 2 provides neither this nor madvise() for mapped files, so
+# the C library's function is used instead.
+POSIX_FADV_WILLNEED = getattr(os, "POSIX_FADV_WILLNEED", 3)
+_fadvise = None
+
+# Precompiled structures for the little-endian numbers read from images, so
+# that their formats are not parsed each time a number is read.
+_signed_word_struct = struct.Struct("<i")
+_word_struct = struct.Struct("<I")
+_signed_byte_struct = struct.Struct("<b")
+_byte_struct = struct.Struct("<B")
+_half_word_struct = struct.Struct("<H")
+_signed_half_word_struct = struct.Struct("<h")
+
+# Images are read as strings of bytes. With Python 3, the names of objects
+# and discs are decoded from ISO 8859-1 once they have been read, so that
+# they can be used as text, while the data of files remains as bytes. With
+# Python 2, both are plain strings.
+if sys.version_info[0] >= 3:
+
+    def to_text(data):
+    
+        """Returns the bytes read from an image, such as a name, as text."""
+        return data.decode("latin-1")
+    
+    def to_bytes(text):
+    
+        """Returns text, such as a name, as bytes that can be stored in an
+        image or returned as the contents of a file."""
+        return text.encode("latin-1")
+    
+    _maketrans = bytes.maketrans
+    _text_maketrans = str.maketrans
+    
+    def _little_endian(data):
+    
+        # Returns the value of the little-endian number held in data.
+        return int.from_bytes(data, "little")
+
+else:
+
+    def to_text(data):
+    
+        """Returns the bytes read from an image, such as a name, as text."""
+        return data
+    
+    def to_bytes(text):
+    
+        """Returns text, such as a name, as bytes that can be stored in an
+        image or returned as the contents of a file."""
+        return text
+    
+    _maketrans = _text_maketrans = string.maketrans
+    
+    def _little_endian(data):
+    
+        # Returns the value of the little-endian number held in data.
+        # Numbers of up to four bytes, such as disc addresses, are padded and
+        # unpacked as words; longer ones, such as whole zones of the map, are
+        # converted from hexadecimal.
+        if len(data) <= 4:
+            return _word_struct.unpack(data + "\x00" * (4 - len(data)))[0]
+        
+        return int(binascii.hexlify(data[::-1]), 16)
+
+# Translation tables used when decoding names. The top bit of each character
+# is removed; characters that are then control characters or spaces are
+# deleted.
+_all_chars = bytes(bytearray(range(256)))
+_safe_table = _maketrans(
+    _all_chars, bytes(bytearray([i & 0x7f for i in range(256)]))
+    )
+_safe_deletions = _all_chars[128:161]
+
+# Directories begin with a sequence number followed by one of these markers.
+_directory_marker = re.compile(b"Hugo|Nick")
+
+# The name of the directory holding directories that are recovered from
+# damaged images.
+lost_and_found = "lost+found"
+
+# Names end at the first control character or space. Titles may contain
+# spaces.
+_name_end = re.compile(b"[\x00-\x20]")
+_title_end = re.compile(b"[\x00-\x1f]")
+
+# Marks the characters in a name that have the top bit set, which is used to
+# store attributes in the names of objects on old format discs.
+_top_bit_table = _maketrans(_all_chars, b"\x00" * 128 + b"\x80" * 128)
+
+# Converts RISC OS names to names that can be used on Unix filing systems,
+# where the roles of "." and "/" are reversed.
+_unix_table = _text_maketrans("/", ".")
+
+# Each entry in a 'Hugo' or 'Nick' directory contains a name, load address,
+# execution address, length, three byte disc address and a byte containing
+# attributes or a sequence number. The disc address is read as a half word
+# and a byte, then combined.
+_entry_format = "10sIIIHBB"
+_entry_size = 26
+_entry_structs = {}
+
+# Big directories start with a header containing a sequence number, version
+# and 'SBPr' marker, the lengths of the directory name, the directory and
+# the names of its objects, the number of entries and the parent's SIN. Each
+# entry contains the object's load and execution addresses, length, SIN,
+# attributes, and the length and offset of its name.
+_big_header_struct = struct.Struct("<B3x4sIIIII")
+_big_entry_format = "IIIIIII"
+_big_entry_struct = struct.Struct("<" + _big_entry_format)
+_big_entries_structs = {}
+
+# The disc record of an E or F format disc contains, in order, the log2 of
+# the sector size, sectors per track, heads, density, ID length, log2 of the
+# bytes per map bit, skew, the low byte of the number of zones, the zone
+# spare bits, the SIN of the root directory, the disc size, ID and name, the
+# high word of the disc size and the high byte of the number of zones. The
+# boot option, low sector, disc type and share size are not used.
+_disc_record_struct = struct.Struct("<7B2xBHIIH10s4xI2xB")
+
+
+def riscos_centiseconds(load, exec_):
+
+    """Returns the number of centiseconds since the Epoch described by the
+    time stamp in the load and execution addresses given.
+    
+    RISC OS time is given as a five byte value containing the number of
+    centiseconds since the start of 1900, with the low four bytes in the
+    execution address and the high byte in the low byte of the load address.
+    """
+    
+    return (((load & 0xff) << 32) | (exec_ & 0xffffffff)) - between_epochs
+
+
+def riscos_time(load, exec_):
+
+    """Returns the number of seconds since the Epoch described by the time
+    stamp in the load and execution addresses given."""
+    
+    return riscos_centiseconds(load, exec_) / 100.0
+
+
+def riscos_time_stamp(load, seconds):
+
+    """Returns a tuple containing the load and execution addresses obtained
+    by storing the time given in seconds since the Epoch in the load address
+    and execution address supplied. The filetype in the load address is
+    preserved."""
+    
+    value = int(seconds * 100) + between_epochs
+    return ((load & 0xffffff00) | ((value >> 32) & 0xff),
+            value & 0xffffffff)
+
+
+def old_map_check(data):
+
+    """Returns the check byte for the string, data, containing the first 255
+    bytes of one of the sectors of an old format free space map. The bytes
+    are added from the last to the first, with any carry added back in."""
+    
+    total = 255
+    
+    for c in bytearray(data)[::-1]:
+    
+        if total > 255:
+            total = (total + 1) & 0xff
+        
+        total = total + c
+    
+    return total & 0xff
+
+
+def compare_images(first, second):
+
+    """Returns a list of the paths of the objects in the catalogue of the
+    ADFSdisc instance, first, whose contents differ from those of the
+    objects with the same paths in the ADFSdisc instance, second, or that
+    are missing from it."""
+    
+    differences = []
+    
+    for path, obj in first.walk():
+    
+        other = second.find(path)
+        
+        if isinstance(obj, ADFSdirectory):
+        
+            if not isinstance(other, ADFSdirectory):
+                differences.append(path)
+        
+        elif not isinstance(other, ADFSfile) or \
+            obj.content_hash() != other.content_hash():
+            
+            differences.append(path)
+    
+    return differences
+
+
+def find_images(paths):
+
+    """Returns a list of image files, expanding any directories in the list
+    of paths supplied into the files they contain."""
+    
+    images = []
+    
+    for path in paths:
+    
+        if os.path.isdir(path):
+        
+            for dir_path, dir_names, file_names in os.walk(path):
+            
+                dir_names.sort()
+                
+                for file_name in sorted(file_names):
+                
+                    images.append(os.path.join(dir_path, file_name))
+        else:
+        
+            images.append(path)
+    
+    return images
 
 
 class Utilities:
@@ -42,38 +272,31 @@ class Utilities:
     
     def _read_signed_word(self, s):
     
-        return struct.unpack("<i", s)[0]
+        return _signed_word_struct.unpack(s)[0]
     
     def _read_unsigned_word(self, s):
     
-        return struct.unpack("<I", s)[0]
+        return _word_struct.unpack(s)[0]
     
     def _read_signed_byte(self, s):
     
-        return struct.unpack("<b", s)[0]
+        return _signed_byte_struct.unpack(s)[0]
     
     def _read_unsigned_byte(self, s):
     
-        return struct.unpack("<B", s)[0]
+        return _byte_struct.unpack(s)[0]
     
     def _read_unsigned_half_word(self, s):
     
-        return struct.unpack("<H", s)[0]
+        return _half_word_struct.unpack(s)[0]
     
     def _read_signed_half_word(self, s):
     
-        return struct.unpack("<h", s)[0]
+        return _signed_half_word_struct.unpack(s)[0]
     
     def _str2num(self, size, s):
     
-        i = 0
-        n = 0
-        while i < size:
-        
-            n = n | (ord(s[i]) << (i*8))
-            i = i + 1
-        
-        return n
+        return _little_endian(s[:size])
     
     def _binary(self, size, n):
     
@@ -95,25 +318,89 @@ class Utilities:
     
     def _safe(self, s, with_space = 0):
     
-        new = ""
         if with_space == 1:
-            lower = 31
+            end = _title_end.search(s)
         else:
-            lower = 32
+            end = _name_end.search(s)
         
-        for i in s:
+        if end is not None:
+            s = s[:end.start()]
         
-            if ord(i) <= lower:
-                break
-            
-            if ord(i) >= 128:
-                c = ord(i)^128
-                if c > 32:
-                    new = new + chr(c)
-            else:
-                new = new + i
+        return to_text(s.translate(_safe_table, _safe_deletions))
+    
+    def _read_entries(self, start, end):
+    
+        """Returns a list of (offset, name, load, exec, length, address,
+        attributes) tuples for the directory entries that start at the offset
+        given by start, stopping at the first entry that begins with a zero
+        byte or at the end offset.
         
-        return new
+        All the entries are decoded with a single call to a Struct instance
+        that is created the first time each number of entries is seen."""
+        
+        end = min(end, len(self.sectors))
+        
+        # Find the first entry that starts with a zero byte by examining the
+        # first byte of each entry.
+        number = self.sectors[start:end:_entry_size].find(b"\x00")
+        if number == -1:
+            number = (end - start) // _entry_size
+        
+        try:
+            entry_struct = _entry_structs[number]
+        except KeyError:
+            entry_struct = _entry_structs[number] = \
+                struct.Struct("<" + (_entry_format * number))
+        
+        values = entry_struct.unpack_from(self.sectors, start)
+        
+        entries = []
+        offset = start
+        
+        for i in range(0, len(values), 7):
+        
+            name, load, exe, length, low, high, atts = values[i:i+7]
+            entries.append(
+                (offset, name, load, exe, length, low | (high << 16), atts)
+                )
+            offset = offset + _entry_size
+        
+        return entries
+    
+    def _zone_check(self, zone):
+    
+        # Returns the check byte for the zone of a new format map held in
+        # the string, zone, which is stored in the first byte of the zone.
+        # See ADFS/EMaps.htm for a description of this calculation. The
+        # items of a bytearray are numbers with both Python 2 and 3.
+        zone = bytearray(zone)
+        v0 = v1 = v2 = v3 = 0
+        i = len(zone) - 4
+        
+        while i > 0:
+        
+            v0 = v0 + zone[i] + (v3 >> 8)
+            v3 = v3 & 0xff
+            v1 = v1 + zone[i + 1] + (v0 >> 8)
+            v0 = v0 & 0xff
+            v2 = v2 + zone[i + 2] + (v1 >> 8)
+            v1 = v1 & 0xff
+            v3 = v3 + zone[i + 3] + (v2 >> 8)
+            v2 = v2 & 0xff
+            i = i - 4
+        
+        v0 = v0 + (v3 >> 8)
+        v1 = v1 + zone[1] + (v0 >> 8)
+        v2 = v2 + zone[2] + (v1 >> 8)
+        v3 = v3 + zone[3] + (v2 >> 8)
+        
+        return (v0 ^ v1 ^ v2 ^ v3) & 0xff
+    
+    def _top_bit_set(self, s):
+    
+        # Returns the position, counting from 1, of the last character in s
+        # with its top bit set, or 0 if no characters have the top bit set.
+        return s.translate(_top_bit_table).rfind(b"\x80") + 1
     
     def _plural(self, msg, values, words):
     
@@ -167,7 +454,7 @@ class Utilities:
             elements.append(name)
         
         # Remove any empty list elements or those containing a $ character.
-        elements = filter(lambda x: x != '' and x != "$", elements)
+        elements = [x for x in elements if x != '' and x != "$"]
         
         try:
         
@@ -182,21 +469,21 @@ class Utilities:
                     # This element of the directory does not exist.
                     # Create a directory here.
                     os.mkdir(built)
-                    print 'Created directory:', built
+                    print('Created directory:', built)
                 
                 elif not os.path.isdir(built):
                 
                     # This element of the directory already exists
                     # but is not a directory.
-                    print 'A file exists which prevents a ' + \
-                        'directory from being created: %s' % built
+                    print('A file exists which prevents a ' + \
+                          'directory from being created: %s' % built)
                     
                     return ""
         
         except OSError:
         
-            print 'Directory could not be created: %s' % \
-                string.join(elements, os.sep)
+            print('Directory could not be created: %s' % \
+                  os.sep.join(elements))
             
             return ""
         
@@ -206,18 +493,40 @@ class Utilities:
     def _convert_name(self, old_name, convert_dict):
     
         # Use the conversion dictionary to convert any forbidden
-        # characters to accepted local substitutes.
-        name = ""
+        # characters to accepted local substitutes. A translation table is
+        # made the first time each dictionary is used if it only maps single
+        # characters to single characters.
+        
+        key = tuple(sorted(convert_dict.items()))
+        
+        if not hasattr(self, "_convert_tables"):
+            self._convert_tables = {}
+        
+        try:
+        
+            table = self._convert_tables[key]
         
-        for c in old_name:
+        except KeyError:
         
-            if c in convert_dict.keys():
+            if [k for k, v in key if len(k) != 1 or len(v) != 1]:
             
-                name = name + convert_dict[c]
+                table = None
             
             else:
             
-                name = name + c
+                table = _text_maketrans(
+                    "".join([k for k, v in key]), "".join([v for k, v in key])
+                    )
+            
+            self._convert_tables[key] = table
+        
+        if table is not None:
+        
+            name = old_name.translate(table)
+        
+        else:
+        
+            name = "".join(map(lambda c: convert_dict.get(c, c), old_name))
         
         if self.verify and old_name != name:
         
@@ -239,36 +548,198 @@ class ADFSdirectory:
     """directory = ADFSdirectory(name, files)
     
     The directory created contains name and files attributes containing the
-    directory name and the objects it contains.
+    directory name and the objects it contains. The unix_name attribute
+    contains the name in a form that can be used on Unix filing systems and,
+    for directories read from a disc catalogue, the raw_name attribute
+    contains the name as it was stored in the catalogue. The extents
+    attribute of these directories contains a list of (start, end) offsets
+    describing where the directory is stored.
     """
     
+    raw_name = None
+    
+    # Set for big directories on new format discs.
+    big = False
+    
+    _index = None
+    
     def __init__(self, name, files):
     
         self.name = name
+        self.unix_name = name.translate(_unix_table)
         self.files = files
+        self.extents = []
     
     def __repr__(self):
     
         return '<%s instance, "%s", at %x>' % (self.__class__, self.name, id(self))
+    
+    def lookup(self, name):
+    
+        """Returns the object in the directory with the given name, ignoring
+        case as RISC OS does, or None if there is no such object.
+        
+        The names of the objects are indexed the first time this method is
+        called, so later lookups do not need to examine every object. Call
+        the changed() method if the directory's contents are modified."""
+        
+        if self._index is None:
+        
+            index = {}
+            
+            # Where names only differ in case, the first object is found.
+            for obj in self.files[::-1]:
+            
+                index[obj.name.lower()] = obj
+            
+            self._index = index
+        
+        return self._index.get(name.lower())
+    
+    def changed(self):
+    
+        """Discards the index of names used by lookup()."""
+        
+        self._index = None
 
 
 class ADFSfile:
 
-    """file = ADFSfile(name, data, load_address, execution_address, length)
+    """file = ADFSfile(name, data, load_address, execution_address, length,
+                       extents = None, sectors = None)
+    
+    If data is None, the file's data is not held by the instance. Instead, it
+    is read from the sectors string each time the data attribute is used,
+    with the extents list of (start, end) offsets describing where the pieces
+    of the file are found.
+    
+    As for ADFSdirectory instances, the unix_name and raw_name attributes
+    contain the name in forms suitable for Unix filing systems and as stored
+    in the catalogue.
+    
+    Objects read from new format discs also have addr and attributes
+    attributes containing the System Internal Number (SIN) and attribute byte
+    from their catalogue entries. Directories on these discs also have the
+    load_address, execution_address and length attributes of their entries.
     """
     
-    def __init__(self, name, data, load_address, execution_address, length):
+    raw_name = None
+    
+    def __init__(self, name, data, load_address, execution_address, length,
+                 extents = None, sectors = None):
     
         self.name = name
-        self.data = data
+        self.unix_name = name.translate(_unix_table)
+        if data is not None:
+            self.data = data
         self.load_address = load_address
         self.execution_address = execution_address
         self.length = length
+        self.extents = extents or []
+        self.sectors = sectors
+        self._hashes = {}
     
     def __repr__(self):
     
         return '<%s instance, "%s", at %x>' % (self.__class__, self.name, id(self))
     
+    def __getattr__(self, name):
+    
+        # Only called for attributes that are not found in the usual way,
+        # so the data attribute is only read here if it was not copied when
+        # the catalogue was read.
+        if name == "data" and self.sectors is not None:
+            return self.read()
+        
+        raise AttributeError(name)
+    
+    def read(self):
+    
+        """Returns the file's data, reading it from the disc image if it was
+        not copied when the catalogue was read."""
+        
+        # Files being written may hold their data in a bytearray, so a copy
+        # is returned as bytes; bytes objects themselves are not copied.
+        if "data" in self.__dict__:
+            return bytes(self.data)
+        
+        pieces = []
+        remaining = self.length
+        
+        for start, end in self.extents:
+        
+            amount = min(remaining, end - start)
+            pieces.append(self.sectors[start:start + amount])
+            remaining = remaining - amount
+        
+        return b"".join(pieces)
+    
+    def image_ranges(self, offset, length):
+    
+        """Returns a list of (start, end) offsets in the disc image of the
+        pieces holding the length bytes of the file's data that begin at the
+        given offset in the file, in the order they occur in the file."""
+        
+        ranges = []
+        end = min(offset + length, self.length)
+        position = 0
+        
+        for start, finish in self.extents:
+        
+            if position >= end:
+                break
+            
+            size = finish - start
+            
+            first = max(offset - position, 0)
+            last = min(end - position, size)
+            
+            if first < last:
+                ranges.append((start + first, start + last))
+            
+            position = position + size
+        
+        return ranges
+    
+    def read_range(self, offset, length):
+    
+        """Returns length bytes of the file's data, beginning at the given
+        offset, reading only the parts of the disc image that hold them if
+        the data was not copied when the catalogue was read."""
+        
+        if "data" in self.__dict__:
+            return bytes(self.data[offset:offset + length])
+        
+        return b"".join(
+            [self.sectors[start:end]
+             for start, end in self.image_ranges(offset, length)]
+            )
+    
+    def content_hash(self, algorithm = "sha1", chunk_size = 65536):
+    
+        """Returns the digest of the file's data, as a string of bytes,
+        calculated with the named hashlib algorithm.
+        
+        The data is passed to the hash object in chunks of chunk_size bytes
+        and the result is cached, so the hash is only calculated the first
+        time it is requested for each algorithm."""
+        
+        try:
+            return self._hashes[algorithm]
+        except KeyError:
+            pass
+        
+        import hashlib
+        hasher = hashlib.new(algorithm)
+        data = memoryview(self.read())
+        
+        for i in range(0, len(data), chunk_size):
+        
+            hasher.update(data[i:i+chunk_size])
+        
+        digest = self._hashes[algorithm] = hasher.digest()
+        return digest
+    
     def has_filetype(self):
     
         """Returns True if the file's meta-data contains filetype information."""
@@ -289,21 +760,18 @@ class ADFSfile:
         """Returns the time stamp for the file as a tuple of values containing
         the local time, or an empty tuple if the file does not have a time stamp."""
         
-        # RISC OS time is given as a five byte block containing the
-        # number of centiseconds since 1900 (presumably 1st January 1900).
-        
-        # Convert the time to the time elapsed since the Epoch (assuming
-        # 1970 for this value).
-        date_num = struct.unpack("<Q",
-            struct.pack("<IBxxx", self.execution_address, self.load_address & 0xff))[0]
-        
-        centiseconds = date_num - between_epochs
-        
-        # Convert this to a value in seconds and return a time tuple.
         try:
-            return time.localtime(centiseconds / 100.0)
+            return time.localtime(self.seconds())
         except ValueError:
             return ()
+    
+    def seconds(self):
+    
+        """Returns the time stamp for the file as a number of seconds since
+        the Epoch. As with time_stamp(), the result is only meaningful if the
+        file has a filetype."""
+        
+        return riscos_time(self.load_address, self.execution_address)
 
 
 class ADFSmap(Utilities):
@@ -314,12 +782,16 @@ class ADFSmap(Utilities):
     
     def has_key(self, key):
     
-        return self.disc_map.has_key(key)
+        return key in self.disc_map
+    
+    def __contains__(self, key):
+    
+        return key in self.disc_map
 
 
 class ADFSnewMap(ADFSmap):
 
-    dir_markers = ('Hugo', 'Nick')
+    dir_markers = (b'Hugo', b'Nick')
     root_dir_address = 0x800
     
     def __init__(self, header, begin, end, sectors, sector_size, record):
@@ -331,275 +803,238 @@ class ADFSnewMap(ADFSmap):
         self.sector_size = sector_size
         self.record = record
         
-        self.free_space = self._read_free_space()
-        self.disc_map = self._read_disc_map()
-    
-    def _read_disc_map(self):
-    
-        # See ADFS/EMaps.htm, ADFS/EFormat.htm and ADFS/DiscMap.htm for details.
-        
-        ### TODO: This needs to take into account multiple zones.
+        # The number of IDs in each zone determines the zone in which the
+        # fragments of an object are first looked for.
+        zone_size = (8 * sector_size) - record["zone spare"]
+        self.ids_per_zone = max(1, zone_size // (record["id length"] + 1))
+        self.layout = self.zone_layout()
         
-        disc_map = {}
+        # The decoded fragments are kept so that the use of space on the disc
+        # can be examined without decoding the map again.
+        self.zones = self.read_fragments()
+        self.free_space = self._read_free_space(self.zones)
+        self.disc_map = self._read_disc_map(self.zones)
         
-        a = self.begin
+        # Find the root directory using the disc record.
+        root = self._read_new_address(record["root SIN"])
         
-        current_piece = None
-        current_start = 0
-        
-        next_zone = self.header + self.sector_size
+        if root != -1:
+            self.root_dir_address = root[0][0]
+    
+    def _read_disc_map(self, zones):
+    
+        # See ADFS/EMaps.htm, ADFS/EFormat.htm and ADFS/DiscMap.htm for details.
         
-        # Copy the free space map.
-        free_space = self.free_space[:]
+        # Build an index for each zone that maps the IDs of the fragments in
+        # the zone to the extents of those fragments, in the order in which
+        # they occur.
+        bytes_per_bit = self.record["bytes per bit"]
+        self.zone_index = []
         
-        while a < self.end:
+        for zone, fragments in enumerate(zones):
         
-            # The next entry to be read will occur one byte after this one
-            # unless one of the following checks override this behaviour.
-            next = a + 1
-            
-            if (a % self.sector_size) < 4:
-            
-                # In a zone header. Not the first zone header as this
-                # was already skipped when we started reading.
-                next = a + 4 - (a % self.sector_size)
-                
-                # Set the next zone offset.
-                next_zone = next_zone + self.sector_size
-                
-                # Reset the current piece and starting offset.
-                current_piece = None
-                current_start = 0
+            index = {}
             
-            elif free_space != [] and a >= free_space[0][0]:
+            for start, length, owner in fragments:
             
-                # In the next free space entry. Go to the entry following
-                # it and discard this free space entry.
-                next = free_space[0][1]
-                
-                free_space.pop(0)
-                
-                # Reset the current piece and starting offset.
-                current_piece = None
-                current_start = 0
-            
-            elif current_piece is None and (next_zone - a) >= 2:
-            
-                # If there is enough space left in this zone to allow
-                # further fragments then read the next two bytes.
-                value = self._read_unsigned_half_word(self.sectors[a:a+2])
-                
-                entry = value & 0x7fff
-                
-                # See ADFS/EAddrs.htm document for restriction on
-                # the disc address and hence the file number.
-                # i.e.the top bit of the file number cannot be set.
-                
-                if entry >= 1:
-                
-                    # Defects (1), files or directories (greater than 1)
-                    next = a + 2
-                    
-                    # Define a new entry.
-                    #print "Begin:", hex(entry), hex(a)
-                    
-                    if not disc_map.has_key(entry):
-                    
-                        # Create a new map entry if none exists.
-                        disc_map[entry] = []
-                    
-                    if (value & 0x8000) == 0:
-                    
-                        # Record the file number and start of this fragment.
-                        current_piece = entry
-                        current_start = a
-                    
-                    else:
-                    
-                        # For an immediately terminated fragment, add the
-                        # extents of the block to the list of pieces found
-                        # and implicitly finish reading this fragment
-                        # (current_piece remains None).
-                        
-                        start_addr = self.find_address_from_map(
-                            a, self.begin, entry
-                            )
-                        end_addr = self.find_address_from_map(
-                            next, self.begin, entry
-                            )
-                        
-                        if [start_addr, end_addr] not in disc_map[entry]:
-                        
-                            disc_map[entry].append((start_addr, end_addr))
-                
-                else:
+                if owner is not None:
                 
-                    # Search for a valid file number.
-                    # Should probably stop looking in this zone.
-                    next = a + 1
+                    begin = self.fragment_address(zone, start)
+                    index.setdefault(owner, []).append(
+                        (begin, begin + (length * bytes_per_bit))
+                        )
             
-            elif current_piece is not None:
+            self.zone_index.append(index)
+        
+        # Collect the extents of each object from all the zones.
+        disc_map = {}
+        
+        for index in self.zone_index:
+        
+            for file_no in index.keys():
             
-                # In a piece being read.
-                
-                value = ord(self.sectors[a])
-                
-                if value == 0:
-                
-                    # Still in the block.
-                    next = a + 1
-                
-                elif value == 0x80:
-                
-                    # At the end of the block.
-                    next = a + 1
-                    
-                    # For relevant entries add the block to the list of
-                    # pieces found.
-                    start_addr = self.find_address_from_map(
-                        current_start, self.begin, current_piece
-                        )
-                    end_addr = self.find_address_from_map(
-                        next, self.begin, current_piece
-                        )
-                    
-                    if [start_addr, end_addr] not in disc_map[current_piece]:
-                    
-                        disc_map[current_piece].append(
-                            (start_addr, end_addr)
-                            )
-                    
-                    # Look for a new fragment.
-                    current_piece = None
-                
-                else:
+                if file_no not in disc_map:
                 
-                    # The byte found was unexpected - backtrack to the
-                    # byte after the start of this block and try again.
-                    #print "Backtrack from %s to %s" % (hex(a), hex(current_start+1))
-                    
-                    next = current_start + 1
-                    current_piece = None
-            
-            # Move to the next relevant byte.
-            a = next
+                    disc_map[file_no] = self._find_in_zones(file_no)
         
         return disc_map
     
-    def _read_free_space(self):
+    def start_zone(self, file_no):
     
-        free_space = []
+        """Returns the zone in which the fragments of the object with the
+        given file number begin."""
         
-        a = self.header
+        zones = len(self.layout)
         
-        while a < self.end:
+        # The fragments holding the map and root directory begin in the
+        # middle of the disc. Other objects begin in the zone indicated by
+        # their IDs.
+        if file_no == 2:
+            return zones // 2
         
-            # The next zone starts a sector after this one.
-            next_zone = a + self.sector_size
-            
-            a = a + 1
-            
-            # Start by reading the offset in bits from the start of the header
-            # of the first item of free space in the map.
-            offset = self._read_unsigned_half_word(self.sectors[a:a+2])
+        return (file_no // self.ids_per_zone) % zones
+    
+    def zone_order(self, file_no):
+    
+        """Returns a list of the zones that contain the fragments of the
+        object with the given file number, in the order that they are
+        searched."""
+        
+        zones = len(self.layout)
+        first = self.start_zone(file_no)
+        
+        return list(range(first, zones)) + list(range(0, first))
+    
+    def _find_in_zones(self, file_no):
+    
+        pieces = []
+        
+        for zone in self.zone_order(file_no):
+        
+            pieces = pieces + self.zone_index[zone].get(file_no, [])
+        
+        return pieces
+    
+    def zone_layout(self):
+    
+        """Returns a list of (offset, start bit, end bit, first block) tuples
+        describing each zone of the map, using the values in the disc record.
+        
+        The offset is the position of the zone in the image. The start and
+        end bits delimit the part of the zone that describes the disc, in
+        bits from the start of the zone, and the first block is the number
+        of the map block described by the start bit. The disc address of a
+        map block is found by multiplying its number by the number of bytes
+        per map bit.
+        """
+        
+        # See the disc record description in ADFS/DiscRecord.htm and the map
+        # description in ADFS/EMaps.htm. Each zone starts with a four byte
+        # header and the first zone also contains the disc record.
+        record_bits = 60 * 8
+        zones = max(1, self.record["zones"])
+        zone_size = (8 * self.sector_size) - self.record["zone spare"]
+        
+        layout = [(self.header, 32 + record_bits, 32 + zone_size, 0)]
+        
+        for zone in range(1, zones):
+        
+            layout.append(
+                (self.header + (zone * self.sector_size), 32, 32 + zone_size,
+                 (zone * zone_size) - record_bits)
+                )
+        
+        # The last zone only describes the blocks up to the end of the disc.
+        offset, start, end, first = layout[-1]
+        blocks = self.record["disc size"] // self.record["bytes per bit"]
+        end = min(end, start + blocks - first)
+        layout[-1] = (offset, start, end, first)
+        
+        return layout
+    
+    def read_fragments(self):
+    
+        """Returns a list of fragment lists, one for each zone of the map.
+        Each fragment is described by a [start bit, length in bits, ID] list,
+        with an ID of None used for free space.
+        
+        Unlike the catalogue reader, this method decodes the map bit by bit,
+        so it is not limited to fragments that begin and end on byte
+        boundaries.
+        """
+        
+        idlen = self.record["id length"]
+        id_mask = (1 << idlen) - 1
+        zones = []
+        
+        for offset, start, end, first in self.layout:
+        
+            # Read the zone as a single number in which the first bit of the
+            # zone is the least significant bit.
+            zone_data = self.sectors[offset:offset + self.sector_size]
+            bits = _little_endian(zone_data)
             
-            # The top bit is apparently always set, so mask it off and convert
-            # the result into bytes. * Not sure if this is the case for
-            # entries in the map. *
-            next = ((offset & 0x7fff) >> 3)
+            # Follow the chain of free fragments, starting with the link in
+            # the zone header at bit 8.
+            free = {}
+            link = 8
+            value = (bits >> 8) & 0x7fff
             
-            if next == 0:
+            while value != 0:
             
-                # No more free space in this zone. Look at the free
-                # space field in the next zone.
-                a = next_zone
-                continue
+                link = link + value
+                if link >= end or link in free:
+                    break
+                
+                free[link] = None
+                value = (bits >> link) & id_mask
             
-            # Update the offset to point to the free space in this zone.
-            a = a + next
+            fragments = []
+            bit = start
             
-            while a < next_zone:
+            while bit + idlen < end:
             
-                # Read the offset to the next free fragment in this zone.
-                offset = self._read_unsigned_half_word(self.sectors[a:a+2])
-                
-                # Convert this to a byte offset.
-                next = ((offset & 0x7fff) >> 3)
+                # The fragment ends with the first set bit after its ID.
+                rest = bits >> (bit + idlen)
                 
-                # Find the end of the free space.
-                b = a + 1
-                
-                while b < next_zone:
-                
-                    c = b + 1
-                    
-                    value = self._read_unsigned_byte(self.sectors[b])
-                    
-                    if (value & 0x80) != 0:
-                    
-                        break
-                    
-                    b = c
-                
-                # Record the offset into the map of this item of free space
-                # and the offset of the byte after it ends.
-                free_space.append((a, c))
+                if rest == 0:
+                    break
                 
-                if next == 0:
+                length = idlen + (rest & -rest).bit_length()
                 
-                    break
+                if bit in free:
+                    fragments.append([bit, length, None])
+                else:
+                    fragments.append([bit, length, (bits >> bit) & id_mask])
                 
-                # Move to the next free space entry.
-                a = a + next
+                bit = bit + length
             
-            # Whether we are at the end of the zone or not, move to the
-            # beginning of the next zone.
-            a = next_zone
+            zones.append(fragments)
         
-        # Return the free space list.
-        return free_space
+        return zones
     
-    def read_catalogue(self, base):
+    def fragment_address(self, zone, bit):
     
-        head = base
-        p = 0
+        """Returns the disc address described by the given bit in the zone
+        specified."""
         
-        dir_seq = self.sectors[head + p]
-        dir_start = self.sectors[head+p+1:head+p+5]
-        if dir_start not in self.dir_markers:
+        offset, start, end, first = self.layout[zone]
+        return (first + bit - start) * self.record["bytes per bit"]
+    
+    def _read_free_space(self, zones):
+    
+        # Return the free space as a list of (start, end) disc addresses.
+        bytes_per_bit = self.record["bytes per bit"]
+        free_space = []
         
-            if self.verify:
-            
-                self.verify_log.append(
-                    (WARNING, 'Not a directory: %s' % hex(head))
-                    )
+        for zone, fragments in enumerate(zones):
+        
+            for start, length, owner in fragments:
             
-            return '', []
+                if owner is None:
+                
+                    begin = self.fragment_address(zone, start)
+                    free_space.append(
+                        (begin, begin + (length * bytes_per_bit))
+                        )
         
-        p = p + 5
+        return free_space
+    
+    def _read_objects(self, entries):
+    
+        # Returns a list of ADFSfile and ADFSdirectory instances for the
+        # objects described by the list of entries, in the form returned by
+        # _read_entries().
         
         files = []
         
-        while ord(self.sectors[head+p]) != 0:
+        for offset, old_name, load, exe, length, address, newdiratts in \
+            entries:
         
-            old_name = self.sectors[head+p:head+p+10]
-            top_set = 0
-            counter = 1
-            for i in old_name:
-                if (ord(i) & 128) != 0:
-                    top_set = counter
-                counter = counter + 1
-            
-            name = self._safe(self.sectors[head+p:head+p+10])
+            found = len(files)
+            name = self._safe(old_name)
             
-            load = self._read_unsigned_word(self.sectors[head+p+10:head+p+14])
-            exe = self._read_unsigned_word(self.sectors[head+p+14:head+p+18])
-            length = self._read_unsigned_word(self.sectors[head+p+18:head+p+22])
-            
-            inddiscadd = self._read_new_address(
-                self.sectors[head+p+22:head+p+25]
-                )
-            newdiratts = self._read_unsigned_byte(self.sectors[head+p+25])
+            inddiscadd = self._read_new_address(address)
             
             if inddiscadd == -1:
             
@@ -611,12 +1046,11 @@ class ADFSnewMap(ADFSmap):
                             (WARNING, "Couldn't find directory: %s" % name)
                             )
                         self.verify_log.append(
-                            (WARNING, "    at: %x" % (head+p+22))
+                            (WARNING, "    at: %x" % (offset+22))
+                            )
+                        self.verify_log.append(
+                            (WARNING, "    file details: %x" % address)
                             )
-                        self.verify_log.append( (
-                            WARNING, "    file details: %x" % \
-                            self._str2num(3, self.sectors[head+p+22:head+p+25])
-                            ) )
                         self.verify_log.append(
                             (WARNING, "    atts: %x" % newdiratts)
                             )
@@ -629,13 +1063,11 @@ class ADFSnewMap(ADFSmap):
                             (WARNING, "Couldn't find file: %s" % name)
                             )
                         self.verify_log.append(
-                            (WARNING, "    at: %x" % (head+p+22))
+                            (WARNING, "    at: %x" % (offset+22))
+                            )
+                        self.verify_log.append(
+                            (WARNING, "    file details: %x" % address)
                             )
-                        self.verify_log.append( (
-                            WARNING,
-                            "    file details: %x" % \
-                            self._str2num(3, self.sectors[head+p+22:head+p+25])
-                            ) )
                         self.verify_log.append(
                             (WARNING, "    atts: %x" % newdiratts)
                             )
@@ -644,51 +1076,100 @@ class ADFSnewMap(ADFSmap):
                 
                     # Store a zero length file. This appears to be the
                     # standard behaviour for storing empty files.
-                    files.append(ADFSfile(name, "", load, exe, length))
+                    file_obj = ADFSfile(name, b"", load, exe, length)
+                    file_obj.addr = address
+                    files.append(file_obj)
             
             else:
             
                 if (newdiratts & 0x8) != 0:
                 
                     # Remember that inddiscadd will be a sequence of
-                    # pairs of addresses.
+                    # pairs of addresses. The directory begins at the start
+                    # of the first of these, but big directories can occupy
+                    # more than one piece.
                     
-                    for start, end in inddiscadd:
+                    start = inddiscadd[0][0]
                     
-                        # Try to interpret the data at the referenced address
-                        # as a directory.
-                        
-                        lower_dir_name, lower_files = \
-                            self.read_catalogue(start)
-                        
-                        # Store the directory name and file found therein.
-                        files.append(ADFSdirectory(name, lower_files))
+                    # Try to interpret the data at the referenced address
+                    # as a directory.
+                    
+                    lower_dir_name, lower_files = \
+                        self.read_catalogue(start, inddiscadd)
+                    
+                    # Store the directory name and file found therein.
+                    dir_obj = ADFSdirectory(name, lower_files)
+                    
+                    # Keep the details from the catalogue entry so that
+                    # the entry can be written again.
+                    dir_obj.load_address = load
+                    dir_obj.execution_address = exe
+                    dir_obj.length = length
+                    dir_obj.addr = address
+                    dir_obj.extents = inddiscadd
+                    dir_obj.big = self._is_big_directory(start)
+                    files.append(dir_obj)
                 
                 else:
                 
                     # Remember that inddiscadd will be a sequence of
                     # pairs of addresses.
                     
-                    file = ""
-                    remaining = length
-                    
-                    for start, end in inddiscadd:
+                    file_obj = ADFSfile(name, None, load, exe, length,
+                                        inddiscadd, self.sectors)
                     
-                        amount = min(remaining, end - start)
-                        file = file + self.sectors[start : (start + amount)]
-                        remaining = remaining - amount
+                    if self.copy_data:
+                        file_obj.data = file_obj.read()
+                        file_obj.sectors = None
                     
-                    file_obj = ADFSfile(name, file, load, exe, length)
                     # Store the SIN (System Internal Number) for debugging.
-                    file_obj.addr = self._str2num(3, self.sectors[head+p+22:head+p+25])
+                    file_obj.addr = address
                     files.append(file_obj)
             
-            p = p + 26
+            # Record the name and attributes as they were stored for any
+            # objects found.
+            for obj in files[found:]:
+                obj.raw_name = old_name
+                obj.attributes = newdiratts
         
+        return files
+    
+    def _is_big_directory(self, head):
+    
+        return self.sectors[head + 4:head + 8] == b"SBPr"
+    
+    def read_catalogue(self, base, extents = None):
+    
+        if self._is_big_directory(base):
         
-        # Go to tail of directory structure (0x800 -- 0xc00)
+            return self._read_big_catalogue(base, extents)
+        
+        head = base
+        p = 0
+        
+        dir_seq = self.sectors[head + p]
+        dir_start = self.sectors[head+p+1:head+p+5]
+        if dir_start not in self.dir_markers:
+        
+            if self.verify:
+            
+                self.verify_log.append(
+                    (WARNING, 'Not a directory: %s' % hex(head))
+                    )
+            
+            return '', []
+        
+        p = p + 5
         
-        tail = head + self.sector_size
+        # The tail of the directory occupies the last sector of the 2048
+        # bytes used by the directory, whatever the sector size.
+        tail = head + 0x800 - self.sector_size
+        
+        files = self._read_objects(
+            self._read_entries(head + p, tail + self.sector_size)
+            )
+        
+        # Go to tail of directory structure (0x800 -- 0xc00)
         
         dir_end = self.sectors[tail+self.sector_size-5:tail+self.sector_size-1]
         
@@ -732,11 +1213,82 @@ class ADFSnewMap(ADFSmap):
         
         return dir_name, files
     
-    def _read_new_address(self, s):
+    def _read_big_catalogue(self, head, extents = None):
+    
+        # See the description of big directories in the FileCore chapter of
+        # the RISC OS Programmer's Reference Manual (volume 5a).
+        
+        (dir_seq, marker, name_length, size, entries, names_size,
+         parent) = _big_header_struct.unpack_from(self.sectors, head)
+        
+        # Collect the directory from the pieces of the object holding it.
+        if extents:
+            block = b"".join(
+                [self.sectors[start:end] for start, end in extents]
+                )[:size]
+        else:
+            block = self.sectors[head:head + size]
+        
+        first = _big_header_struct.size + ((name_length + 3) & ~3)
+        names = first + (entries * _big_entry_struct.size)
+        
+        if len(block) < size or names + names_size > size - 8:
+        
+            if self.verify:
+            
+                self.verify_log.append(
+                    (WARNING, 'Big directory is incomplete at %x' % head)
+                    )
+            
+            return '', []
+        
+        dir_name = self._safe(block[_big_header_struct.size:
+                                    _big_header_struct.size + name_length])
+        
+        # Decode all the entries at once.
+        try:
+            entries_struct = _big_entries_structs[entries]
+        except KeyError:
+            entries_struct = _big_entries_structs[entries] = \
+                struct.Struct("<" + (_big_entry_format * entries))
+        
+        values = entries_struct.unpack_from(block, first)
+        catalogue = []
+        
+        for i in range(0, len(values), 7):
+        
+            load, exe, length, address, atts, obj_name_length, obj_name = \
+                values[i:i+7]
+            
+            obj_name = names + obj_name
+            catalogue.append(
+                (head + first + (i * 4),
+                 block[obj_name:obj_name + obj_name_length],
+                 load, exe, length, address, atts & 0xff)
+                )
+        
+        files = self._read_objects(catalogue)
+        
+        if block[size-8:size-4] != b"oven" or \
+            ord(block[size-4:size-3]) != dir_seq:
+            
+        
+            if self.verify:
+            
+                self.verify_log.append(
+                    ( WARNING,
+                      'Broken big directory: %s at %x' % (dir_name, head) )
+                    )
+        
+        if head == self.root_dir_address:
+            dir_name = '$'
+        
+        return dir_name, files
+    
+    def _read_new_address(self, value):
     
-        # From the three character string passed, determine the address on the
-        # disc.
-        value = self._str2num(3, s)
+        # From the value of the three byte disc address passed, determine the
+        # address on the disc.
         
         # This is a SIN (System Internal Number)
         # The bottom 8 bits are the sector offset + 1
@@ -772,34 +1324,12 @@ class ADFSnewMap(ADFSmap):
         except KeyError:
         
             return []
-    
-    def find_address_from_map(self, addr, begin, entry):
-    
-        return ((addr - begin) * self.sector_size)
 
 
 class ADFSbigNewMap(ADFSnewMap):
 
-    dir_markers = ('Nick',)
+    dir_markers = (b'Nick',)
     root_dir_address = 0xc8800
-    
-    def find_address_from_map(self, addr, begin, entry):
-    
-        # I can't remember where the rationale for this calculation
-        # came from or where the necessary information was obtained.
-        # It probably came from one of the WSS files, such as
-        # Formats.htm or Formats2.htm which imply that the F format
-        # uses 512 byte sectors (see the 0x200 value below) and
-        # indicate that F format uses 4 zones rather than 1.
-        
-        upper = (entry & 0x7f00) >> 8
-        
-        if upper > 1:
-            upper = upper - 1
-        if upper > 3:
-            upper = 3
-        
-        return ((addr - begin) - (upper * 0xc8)) * 0x200
 
 
 class ADFSoldMap(ADFSmap):
@@ -833,25 +1363,367 @@ class ADFSoldMap(ADFSmap):
         name = name + \
             self.sectors[base+self.sector_size-10:base+self.sector_size-5]
         
-        disc_id = self._str2num(
-            2, self.sectors[base+self.sector_size-5:base+self.sector_size-3]
-            )
+        disc_id = self._str2num(
+            2, self.sectors[base+self.sector_size-5:base+self.sector_size-3]
+            )
+        
+        boot = self._read_unsigned_byte(self.sectors[base+self.sector_size-3])
+        
+        checksum1 = self._read_unsigned_byte(self.sectors[base+self.sector_size-1])
+        
+        return free_space
+
+
+class SpaceAnalyser:
+
+    """analyser = SpaceAnalyser(disc)
+    
+    Examines the map of the ADFSdisc instance, disc, which must use a new
+    format map. Call the analyse() method to obtain a dictionary describing
+    the use of space on the disc.
+    """
+    
+    def __init__(self, disc):
+    
+        if not isinstance(getattr(disc, "disc_map", None), ADFSnewMap):
+        
+            raise ADFS_exception(
+                "Only images with new format maps can be analysed")
+        
+        self.disc = disc
+        self.disc_map = disc.disc_map
+    
+    def analyse(self):
+    
+        """Returns a dictionary containing the following entries:
+        
+        "disc size"           the size of the disc in bytes
+        "free space"          the number of free bytes
+        "free extents"        a list of (start, end) disc addresses of the
+                              free space, with neighbouring free fragments
+                              joined together
+        "largest free"        the size of the largest free extent in bytes
+        "objects"             the number of objects in the map, other than
+                              the map itself and the root directory stored
+                              with it, which cannot be moved
+        "fragments"           the number of fragments used by those objects
+        "fragmented objects"  the number of objects in more than one fragment
+        "file fragmentation"  the proportion of fragments that are not the
+                              first fragment of an object
+        "free fragmentation"  the proportion of free space that lies outside
+                              the largest area of free space, where free
+                              extents divided only by the map and defects,
+                              which cannot be moved, are treated as a single
+                              area
+        "score"               the larger of the two proportions above, as a
+                              percentage
+        "zones"               a list of (used, free, size) tuples for each
+                              zone of the map, giving the number of bytes
+                              in each case
+        "files"               a list of (path, fragments, bytes) tuples for
+                              the objects in the catalogue
+        
+        Fragments are counted in the order that they occur on the disc, so
+        an object whose fragments follow each other without a gap is counted
+        as having a single fragment.
+        """
+        
+        disc_map = self.disc_map
+        bytes_per_bit = disc_map.record["bytes per bit"]
+        
+        free_extents = []
+        zones = []
+        area = largest_area = 0
+        
+        # For each ID, record the number of fragments, the end of the last
+        # fragment and the number of bytes allocated.
+        runs = {}
+        
+        for zone, fragments in enumerate(disc_map.zones):
+        
+            offset, start, end, first = disc_map.layout[zone]
+            used = free = 0
+            
+            for bit, length, owner in fragments:
+            
+                begin = disc_map.fragment_address(zone, bit)
+                size = length * bytes_per_bit
+                
+                if owner is None:
+                
+                    free = free + size
+                    area = area + size
+                    largest_area = max(largest_area, area)
+                    
+                    if free_extents and free_extents[-1][1] == begin:
+                        free_extents[-1][1] = begin + size
+                    else:
+                        free_extents.append([begin, begin + size])
+                
+                else:
+                
+                    used = used + size
+                    run = runs.get(owner)
+                    
+                    if owner > 2:
+                        area = 0
+                    
+                    if run is None:
+                        runs[owner] = [1, begin + size, size]
+                    else:
+                        if run[1] != begin:
+                            run[0] = run[0] + 1
+                        run[1] = begin + size
+                        run[2] = run[2] + size
+            
+            zones.append((used, free, (end - start) * bytes_per_bit))
+        
+        # ID 1 is used to mark defects rather than an object.
+        runs.pop(1, None)
+        
+        movable = [run for file_no, run in runs.items() if file_no != 2]
+        fragments = sum([run[0] for run in movable])
+        fragmented = len([run for run in movable if run[0] > 1])
+        free_space = sum([end - start for start, end in free_extents])
+        
+        if free_extents:
+            largest = max([end - start for start, end in free_extents])
+        else:
+            largest = 0
+        
+        if fragments:
+            file_fragmentation = float(fragments - len(movable)) / fragments
+        else:
+            file_fragmentation = 0.0
+        
+        if free_space:
+            free_fragmentation = float(free_space - largest_area) / free_space
+        else:
+            free_fragmentation = 0.0
+        
+        return {"disc size": disc_map.record["disc size"],
+                "free space": free_space,
+                "free extents": [tuple(extent) for extent in free_extents],
+                "largest free": largest,
+                "objects": len(movable),
+                "fragments": fragments,
+                "fragmented objects": fragmented,
+                "file fragmentation": file_fragmentation,
+                "free fragmentation": free_fragmentation,
+                "score": 100 * max(file_fragmentation, free_fragmentation),
+                "zones": zones,
+                "files": self.files(runs)}
+    
+    def files(self, runs):
+    
+        # Objects that share a fragment have the same ID, so they are given
+        # the fragment count of that ID. The root directory is stored with
+        # the map.
+        files = []
+        
+        for path, obj in [("$", self.disc.root)] + list(self.disc.walk()):
+        
+            if path == "$":
+                file_no = 2
+            elif getattr(obj, "addr", None) is not None:
+                file_no = obj.addr >> 8
+            else:
+                continue
+            
+            count, end, size = runs.get(file_no, (0, 0, 0))
+            files.append((path, count, size))
+        
+        return files
+
+
+class ExtractionManifest:
+
+    """manifest = ExtractionManifest(path, out_path, use_hashes = False)
+    
+    Records the files written by ADFSdisc.extract_files() to the directory
+    at out_path in the manifest file at the given path, so that a later
+    extraction to the same directory only needs to write the files that have
+    changed. The manifest is a JSON object that maps the path of each file,
+    relative to out_path, to a list containing its load and execution
+    addresses, length, the hexadecimal SHA-1 digest of its contents if
+    use_hashes is set, and the relative path of its .inf file, if any.
+    
+    The manifest written by the previous extraction is read when the instance
+    is created. It is replaced when the write() method is called.
+    """
+    
+    def __init__(self, path, out_path, use_hashes = False):
+    
+        self.path = path
+        self.out_path = out_path
+        self.use_hashes = use_hashes
+        self.previous = {}
+        self.current = {}
+        self.directories = {}
+        
+        import json
+        
+        try:
+            f = open(path)
+            try:
+                entries = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            entries = {}
+        
+        # Names are read as Unicode strings but, with Python 2, are used as
+        # byte strings.
+        for name, entry in entries.items():
+        
+            if not isinstance(name, str):
+            
+                name = name.encode("latin-1")
+                if entry[4] is not None:
+                    entry[4] = entry[4].encode("latin-1")
+            
+            self.previous[name] = entry
+    
+    def _relative(self, path):
+    
+        return os.path.relpath(path, self.out_path)
+    
+    def entry(self, obj, out_file, inf_file):
+    
+        """Returns the manifest entry for the ADFSfile instance, obj, written
+        to out_file with the .inf file, inf_file, which may be None."""
+        
+        if self.use_hashes:
+            digest = binascii.hexlify(obj.content_hash()).decode("ascii")
+        else:
+            digest = None
+        
+        if inf_file is not None:
+            inf_file = self._relative(inf_file)
+        
+        return [obj.load_address, obj.execution_address, obj.length, digest,
+                inf_file]
+    
+    def unchanged(self, out_file, inf_file, entry):
+    
+        """Returns True if the entry for the file at out_file is the same as
+        the one in the previous manifest and the file and its .inf file,
+        unless inf_file is None, still exist."""
+        
+        return self.previous.get(self._relative(out_file)) == entry and \
+            os.path.isfile(out_file) and \
+            (inf_file is None or os.path.isfile(inf_file))
+    
+    def add(self, out_file, entry):
+    
+        """Records the entry for the file at out_file in the new manifest."""
+        
+        self.current[self._relative(out_file)] = entry
+    
+    def add_directory(self, path):
+    
+        """Records that the directory at path holds objects in the current
+        extraction, so that it is kept even if it is empty."""
+        
+        self.directories[self._relative(path)] = None
+    
+    def remove_stale(self):
+    
+        """Removes the files in the previous manifest that are not in the new
+        one, with their .inf files, then any directories left empty that do
+        not hold objects in the current extraction."""
+        
+        directories = {}
+        
+        for name, entry in self.previous.items():
+        
+            if name in self.current:
+                continue
+            
+            for path in (name, entry[4]):
+            
+                if path is None:
+                    continue
+                
+                path = os.path.join(self.out_path, path)
+                
+                try:
+                    os.remove(path)
+                    print("Removed file:", path)
+                except OSError:
+                    pass
+                
+                directories[os.path.dirname(path)] = None
+        
+        # Remove the deepest directories first, stopping at the top of the
+        # extracted tree.
+        directories = sorted(directories, key = len, reverse = True)
+        top = os.path.normpath(self.out_path)
+        
+        for directory in directories:
+        
+            while os.path.normpath(directory) != top and \
+                self._relative(directory) not in self.directories:
+                
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                
+                directory = os.path.dirname(directory)
+    
+    def write(self):
+    
+        """Writes the new manifest, replacing the previous one."""
+        
+        import json
         
-        boot = self._read_unsigned_byte(self.sectors[base+self.sector_size-3])
+        # With Python 2, names are byte strings that need to be decoded.
+        if sys.version_info[0] >= 3:
+            options = {}
+        else:
+            options = {"encoding": "latin-1"}
         
-        checksum1 = self._read_unsigned_byte(self.sectors[base+self.sector_size-1])
+        temp_path = self.path + ".new"
+        f = open(temp_path, "w")
+        try:
+            json.dump(self.current, f, sort_keys = True, indent = 0,
+                      separators = (",", ": "), **options)
+        finally:
+            f.close()
         
-        return free_space
+        os.rename(temp_path, self.path)
 
 
 class ADFSdisc(Utilities):
 
-    """disc = ADFSdisc(file_handle, verify = 0)
+    """disc = ADFSdisc(file_handle, verify = 0, copy_data = 1, use_mmap = 0,
+                      recover = 0, interleaved = None)
     
     Represents an ADFS disc image stored in the file with the specified file
     handle. The image is not verified by default; pass True or another
     non-False value to request automatic verification of the disc format.
     
+    By default, the data for each file is copied from the image when the
+    catalogue is read. Pass False or another non-True value for copy_data to
+    read file data from the image each time it is requested instead; this
+    avoids holding two copies of every file in memory.
+    
+    If use_mmap is True, images whose sectors are stored in order are mapped
+    into memory instead of being read, so that only the parts of the image
+    that are used are read from the file. This is most useful together with
+    copy_data. The advise() method can be used to ask for parts of a mapped
+    image to be read in advance.
+    
+    If recover is True, the image is searched for directories that are not
+    part of the catalogue, such as those whose parent directories have been
+    damaged. Any that are found are placed in a directory called lost+found
+    in the root directory.
+    
+    The tracks of the two sides of L format discs are usually interleaved in
+    image files. Pass False for interleaved to read an L format image whose
+    tracks are stored in order, or True to insist on the usual layout.
+    
     If the disc image specified cannot be read successfully, an ADFS_exception
     is raised.
     
@@ -878,13 +1750,18 @@ class ADFSdisc(Utilities):
                      "adl": "ADFS L format",
                      "adD": "ADFS D format",
                      "adE": "ADFS E format",
-                     "adEbig": "ADFS F format"}
+                     "adEbig": "ADFS F format",
+                     "adEhard": "ADFS hard disc"}
+    
+    image_fd = None
     
-    def __init__(self, adf, verify = 0):
+    def __init__(self, adf, verify = 0, copy_data = 1, use_mmap = 0,
+                 recover = 0, interleaved = None):
     
         # Log problems if the verify flag is set.
         self.verify = verify
         self.verify_log = []
+        self.copy_data = copy_data
         
         # Check the properties using the length of the file
         adf.seek(0,2)
@@ -897,7 +1774,7 @@ class ADFSdisc(Utilities):
             self.sector_size = 256
             interleave = 0
             self.disc_type = 'ads'
-            self.dir_markers = ('Hugo',)
+            self.dir_markers = (b'Hugo',)
         
         elif length == 327680:
             self.ntracks = 80
@@ -905,7 +1782,7 @@ class ADFSdisc(Utilities):
             self.sector_size = 256
             interleave = 0
             self.disc_type = 'adm'
-            self.dir_markers = ('Hugo',)
+            self.dir_markers = (b'Hugo',)
         
         elif length == 655360:
             self.ntracks = 160
@@ -913,9 +1790,12 @@ class ADFSdisc(Utilities):
             self.sector_size = 256    # in bytes
             # Most L format discs are interleaved, but at least one is
             # sequenced.
-            interleave = 1
+            if interleaved is None:
+                interleave = 1
+            else:
+                interleave = int(interleaved)
             self.disc_type = 'adl'
-            self.dir_markers = ('Hugo',)
+            self.dir_markers = (b'Hugo',)
         
         elif length == 819200:
         
@@ -923,7 +1803,7 @@ class ADFSdisc(Utilities):
             self.nsectors = 10
             self.sector_size = 1024
             interleave = 0
-            self.dir_markers = ('Hugo', 'Nick')
+            self.dir_markers = (b'Hugo', b'Nick')
             
             format = self._identify_format(adf)
             
@@ -936,8 +1816,8 @@ class ADFSdisc(Utilities):
                 self.disc_type = 'adE'
             
             else:
-                raise ADFS_exception, \
-                    'Please supply a .adf, .adl or .adD file.'
+                raise ADFS_exception(
+                    'Please supply a .adf, .adl or .adD file.')
         
         elif length == 1638400:
         
@@ -946,13 +1826,30 @@ class ADFSdisc(Utilities):
             self.sector_size = 1024
             interleave = 0
             self.disc_type = 'adEbig'
-            self.dir_markers = ('Nick',)
+            self.dir_markers = (b'Nick',)
         
         else:
-            raise ADFS_exception, 'Please supply a .adf, .adl or .adD file.'
         
-        # Read tracks
-        self.sectors = self._read_tracks(adf, interleave)
+            # Hard disc images can have any length, so look for a disc record
+            # in the boot block instead.
+            if not self._identify_hard_disc(adf):
+                raise ADFS_exception(
+                    'Please supply a .adf, .adl or .adD file.')
+            
+            self.ntracks = length // (self.nsectors * self.sector_size)
+            interleave = 0
+            self.disc_type = 'adEhard'
+            self.dir_markers = (b'Nick',)
+        
+        # Read tracks. Hard disc images are read whole since they may end
+        # with an incomplete track.
+        if use_mmap and not interleave:
+            self.sectors = self._map_image(adf)
+        elif self.disc_type == 'adEhard':
+            adf.seek(0, 0)
+            self.sectors = adf.read()
+        else:
+            self.sectors = self._read_tracks(adf, interleave)
         
         # Close the ADF file
         adf.close()
@@ -966,7 +1863,9 @@ class ADFSdisc(Utilities):
         
             # Find the root directory name and all the files and directories
             # contained within it.
-            self.root_name, self.files = self._read_old_catalogue(0x400)
+            self.root_name, self.files = self._read_old_catalogue(
+                self.root_address()
+                )
         
         elif self.disc_type == 'adE':
         
@@ -975,22 +1874,258 @@ class ADFSdisc(Utilities):
             
             # Find the root directory name and all the files and directories
             # contained within it.
-            self.root_name, self.files = self.disc_map.read_catalogue(2*self.sector_size)
+            self.root_name, self.files = self.disc_map.read_catalogue(
+                self.disc_map.root_dir_address
+                )
         
-        elif self.disc_type == 'adEbig':
+        elif self.disc_type == 'adEbig' or self.disc_type == 'adEhard':
         
             # Read the disc name and map
             self.disc_name = self._safe(self._read_disc_info(), with_space = 1)
             
             # Find the root directory name and all the files and directories
-            # contained within it. The 
-            self.root_name, self.files = self.disc_map.read_catalogue((self.ntracks * self.nsectors/2 + 2) * self.sector_size)
+            # contained within it. The root directory is found using the
+            # disc record, which is stored in the middle of the disc.
+            self.root_name, self.files = self.disc_map.read_catalogue(
+                self.disc_map.root_dir_address
+                )
         
         else:
         
             # Find the root directory name and all the files and directories
             # contained within it.
-            self.root_name, self.files = self._read_old_catalogue(2*self.sector_size)
+            self.root_name, self.files = self._read_old_catalogue(
+                self.root_address()
+                )
+        
+        # Provide a directory containing the objects in the root directory.
+        self.root = ADFSdirectory("$", self.files)
+        
+        if hasattr(self, "disc_map") and \
+            isinstance(self.disc_map, ADFSnewMap):
+            
+            self.root.big = self.disc_map._is_big_directory(
+                self.disc_map.root_dir_address
+                )
+            
+            root = self.disc_map._read_new_address(
+                self.disc_map.record["root SIN"]
+                )
+            
+            if root != -1:
+                self.root.extents = root
+        
+        else:
+        
+            root = self.root_address()
+            self.root.extents = [(root, root + self._old_directory_size())]
+        
+        if recover:
+            self.recover_directories()
+    
+    def recover_directories(self):
+    
+        """Searches the disc for directories that are not part of the
+        catalogue and places them in a lost+found directory in the root
+        directory, which is created if necessary. Returns a list of the
+        directories recovered.
+        
+        The directories inside each recovered directory are read with it, so
+        only the outermost directories are placed in lost+found. Directories
+        found inside the data of files are ignored."""
+        
+        if hasattr(self, "disc_map") and \
+            isinstance(self.disc_map, ADFSnewMap):
+            
+            reader = self.disc_map.read_catalogue
+            size = 0x800
+            alignment = self.sector_size
+        else:
+            reader = self._read_old_catalogue
+            size = self._old_directory_size()
+            alignment = 256
+        
+        # Record the directories and files that are already known.
+        known = {}
+        files = []
+        
+        for path, obj in [("$", self.root)] + list(self.walk()):
+        
+            if isinstance(obj, ADFSdirectory):
+                for start, end in obj.extents[:1]:
+                    known[start] = None
+            else:
+                files = files + obj.extents
+        
+        files.sort()
+        
+        # Find all the complete directories on the disc with a search for
+        # their markers, checking that each one starts on a sector boundary
+        # and ends with the same marker.
+        candidates = []
+        
+        for match in _directory_marker.finditer(self.sectors):
+        
+            head = match.start() - 1
+            tail = self.sectors[head + size - 5:head + size - 1]
+            
+            if head % alignment == 0 and head not in known and \
+                tail == match.group() and \
+                not self._inside_extents(head, files):
+                
+                candidates.append(head)
+        
+        # Read each directory, then discard those that were found inside
+        # others.
+        found = {}
+        inside = {}
+        
+        for head in candidates:
+        
+            name, objects = reader(head)
+            directory = ADFSdirectory(name or ("Dir_%x" % head), objects)
+            directory.extents = [(head, head + size)]
+            found[head] = directory
+            
+            for path, obj in self.walk(objects):
+            
+                if isinstance(obj, ADFSdirectory):
+                    for start, end in obj.extents[:1]:
+                        inside[start] = None
+        
+        recovered = [found[head] for head in candidates
+                     if head not in inside]
+        
+        if not recovered:
+            return []
+        
+        lost = self.root.lookup(lost_and_found)
+        
+        if not isinstance(lost, ADFSdirectory):
+        
+            lost = ADFSdirectory(lost_and_found, [])
+            self.files.append(lost)
+            self.root.changed()
+        
+        for directory in recovered:
+        
+            # Give directories with the same names as others different names
+            # based on their locations.
+            if lost.lookup(directory.name) is not None:
+            
+                directory.name = "%s_%x" % (directory.name,
+                                            directory.extents[0][0])
+                directory.unix_name = directory.name.translate(_unix_table)
+            
+            lost.files.append(directory)
+            lost.changed()
+            
+            if self.verify:
+            
+                self.verify_log.append(
+                    (INFORM, "Recovered directory: %s at %x" % (
+                     directory.name, directory.extents[0][0]))
+                    )
+            
+        return recovered
+    
+    def _inside_extents(self, offset, extents):
+    
+        # Returns True if the offset lies inside one of the sorted list of
+        # (start, end) extents. The search begins with the extent before any
+        # that start at the offset; no extent ends before -1, and None cannot
+        # be compared with numbers with Python 3.
+        i = max(bisect.bisect_right(extents, (offset, -1)) - 1, 0)
+        
+        while i < len(extents):
+        
+            start, end = extents[i]
+            
+            if start <= offset < end:
+                return True
+            elif start > offset:
+                break
+            
+            i = i + 1
+        
+        return False
+    
+    def root_address(self):
+    
+        """Returns the offset of the root directory from the start of the
+        disc."""
+        
+        if hasattr(self, "disc_map") and \
+            isinstance(self.disc_map, ADFSnewMap):
+            
+            return self.disc_map.root_dir_address
+        
+        elif self.disc_type == 'adD':
+            return 0x400
+        else:
+            return 2 * self.sector_size
+    
+    def _identify_hard_disc(self, adf):
+    
+        """Returns True if the image accessed by the file object, adf, contains
+        a hard disc with a new format map, setting the sector size and number
+        of sectors per track. Hard discs are described by a disc record in the
+        boot block, and the map it describes must have a valid zone check.
+        Only the boot block and the start of the map are read, since the
+        image may be large.
+        """
+        
+        adf.seek(0, 2)
+        length = adf.tell()
+        adf.seek(0, 0)
+        
+        self.sectors = adf.read(0xe00)
+        
+        if len(self.sectors) < 0xe00:
+            return False
+        
+        record = self._read_disc_record(0xdc0)
+        
+        if record["log2 sector size"] not in (8, 9, 10, 11) or \
+            record["zones"] == 0 or record["id length"] == 0 or \
+            record["sectors"] == 0 or \
+            record["zone spare"] >= 8 * record["sector size"]:
+            
+            return False
+        
+        header = self._map_address(record)
+        end = header + (2 * record["zones"] * record["sector size"])
+        
+        if header < 0 or end > length:
+            return False
+        
+        adf.seek(header, 0)
+        zone = adf.read(record["sector size"])
+        
+        if self._zone_check(zone) != ord(zone[:1]):
+            return False
+        
+        if self.verify:
+            self.verify_log.append((INFORM, "Hard disc with a new format map"))
+        
+        self.sector_size = record["sector size"]
+        self.nsectors = record["sectors"]
+        return True
+    
+    def _map_address(self, record):
+    
+        # The map is stored in the middle of the disc, at the start of the
+        # zone given by half the number of zones. The first zone describes
+        # fewer blocks than the others because it also holds the disc record.
+        zone_size = (8 * record["sector size"]) - record["zone spare"]
+        zones = record["zones"]
+        
+        if zones > 1:
+            blocks = ((zones // 2) * zone_size) - (60 * 8)
+        else:
+            blocks = 0
+        
+        return blocks * record["bytes per bit"]
     
     def _identify_format(self, adf):
     
@@ -1047,10 +2182,11 @@ class ADFSdisc(Utilities):
         
         # Check the data at the root directory location.
         
-        adf.seek((record["root dir"] * record["sector size"]) + 1, 0)
-        word = adf.read(4)
+        adf.seek(record["root dir"] * record["sector size"], 0)
+        header = adf.read(8)
         
-        if word == "Hugo" or word == "Nick":
+        if header[1:5] == b"Hugo" or header[1:5] == b"Nick" or \
+            header[4:8] == b"SBPr":
         
             # A valid directory identifier was found.
             checklist["Root directory at location given"] = 1
@@ -1068,8 +2204,7 @@ class ADFSdisc(Utilities):
                     )
         
         # If all the tests pass then the disc is an E format disc.
-        if reduce(lambda a, b: a + b, checklist.values(), 0) == \
-            len(checklist.keys()):
+        if sum(checklist.values()) == len(checklist):
         
             if self.verify: self.verify_log.append((INFORM, "E format disc"))
             return "E"
@@ -1087,7 +2222,7 @@ class ADFSdisc(Utilities):
         word2 = adf.read(4)
         adf.seek(0)
         
-        if word1 == 'Hugo':
+        if word1 == b'Hugo':
         
             if self.verify:
             
@@ -1099,7 +2234,7 @@ class ADFSdisc(Utilities):
             
             return 'D'
         
-        elif word1 == 'Nick':
+        elif word1 == b'Nick':
         
             if self.verify:
             
@@ -1111,7 +2246,7 @@ class ADFSdisc(Utilities):
             
             return 'D'
         
-        elif word2 == 'Nick':
+        elif word2 == b'Nick':
         
             if self.verify:
             
@@ -1141,16 +2276,14 @@ class ADFSdisc(Utilities):
         dictionary describing the disc image.
         """
         
-        # See ADFS/DiscRecord.htm for details.
-        
-        # Total sectors per track (sectors * heads)
-        log2_sector_size = ord(self.sectors[offset])
-        # Sectors per track
-        nsectors = ord(self.sectors[offset + 1])
-        # Heads per track
-        heads = ord(self.sectors[offset + 2])
-        
-        density = ord(self.sectors[offset+3])
+        # See ADFS/DiscRecord.htm for details. The whole record is unpacked
+        # at once, padding records that are truncated by the end of the image.
+        (log2_sector_size, nsectors, heads, density, idlen, log2_bpmb,
+         bit_size, zones_low, zone_spare, root_sin, disc_size, disc_id,
+         disc_name, disc_size_high, zones_high) = _disc_record_struct.unpack(
+            self.sectors[offset:offset + _disc_record_struct.size].ljust(
+                _disc_record_struct.size, b"\x00")
+            )
         
         if density == 1:
         
@@ -1171,42 +2304,41 @@ class ADFSdisc(Utilities):
         
             density = 'unknown'
         
-        # Length of ID fields in the disc map
-        idlen = self._read_unsigned_byte(self.sectors[offset + 4])
-        # Number of bytes per map bit.
-        bytes_per_bit = 2 ** self._read_unsigned_byte(self.sectors[offset + 5])
+        # The length of ID fields in the disc map (idlen) is followed by the
+        # number of bytes per map bit.
+        bytes_per_bit = 2 ** log2_bpmb
         # LowSector
         # StartUp
         # LinkBits
         # BitSize (size of ID field?)
-        bit_size = self._read_unsigned_byte(self.sectors[offset + 6 : offset + 7])
         #print "Bit size: %s" % hex(bit_size)
         # RASkew
         # BootOpt
-        # Zones
-        zones = ord(self.sectors[offset + 9])
+        # Zones (the high byte is stored later in the record)
+        zones = zones_low + (zones_high << 8)
         # ZoneSpare
-        # RootDir
-        root = self._str2num(3, self.sectors[offset + 13 : offset + 16]) # was 15
+        # RootDir (the full SIN of the root directory is also kept)
+        root = root_sin >> 8
         # Identify
         # SequenceSides
         # DoubleStep
-        # DiscSize
-        disc_size = self._read_unsigned_word(self.sectors[offset + 16 : offset + 20])
+        # DiscSize (with the high word of the disc size for large discs)
+        disc_size = disc_size + (disc_size_high << 32)
         # DiscId
-        disc_id   = self._read_unsigned_half_word(self.sectors[offset + 20 : offset + 22])
         # DiscName
-        disc_name = string.strip(self.sectors[offset + 22 : offset + 32])
+        disc_name = disc_name.strip()
         
         return {'sectors': nsectors, 'log2 sector size': log2_sector_size,
             'sector size': 2**log2_sector_size, 'heads': heads,
             'density': density,
             'disc size': disc_size, 'disc ID': disc_id,
-            'disc name': disc_name, 'zones': zones, 'root dir': root }
+            'disc name': disc_name, 'zones': zones, 'root dir': root,
+            'id length': idlen, 'bytes per bit': bytes_per_bit,
+            'zone spare': zone_spare, 'root SIN': root_sin }
     
     def _read_disc_info(self):
     
-        checksum = ord(self.sectors[0])
+        checksum = ord(self.sectors[0:1])
         first_free = self._read_unsigned_half_word(self.sectors[1:3])
         
         if self.disc_type == 'adE':
@@ -1220,6 +2352,26 @@ class ADFSdisc(Utilities):
             self.disc_map = ADFSnewMap(self.map_header, self.map_start,
                                        self.map_end, self.sectors,
                                        self.sector_size, self.record)
+            self._share_options(self.disc_map)
+            
+            return self.record['disc name']
+        
+        elif self.disc_type == 'adEhard':
+        
+            # The disc record in the boot block describes the disc, including
+            # the location of the map.
+            self.record = self._read_disc_record(0xdc0)
+            
+            self.sector_size = self.record["sector size"]
+            
+            self.map_header = self._map_address(self.record)
+            self.map_start = self.map_header + 0x40
+            self.map_end = self.map_header + \
+                           (self.record["zones"] * self.sector_size)
+            self.disc_map = ADFSbigNewMap(self.map_header, self.map_start,
+                                          self.map_end, self.sectors,
+                                          self.sector_size, self.record)
+            self._share_options(self.disc_map)
             
             return self.record['disc name']
         
@@ -1234,15 +2386,84 @@ class ADFSdisc(Utilities):
             self.disc_map = ADFSbigNewMap(self.map_header, self.map_start,
                                           self.map_end, self.sectors,
                                           self.sector_size, self.record)
+            self._share_options(self.disc_map)
             
             return self.record['disc name']
         
         else:
-            return 'Unknown'
+            return b'Unknown'
+    
+    def _share_options(self, disc_map):
+    
+        # The map reads the catalogue for new format discs, so it needs to
+        # follow the disc's options and write to the same verification log.
+        disc_map.verify = self.verify
+        disc_map.verify_log = self.verify_log
+        disc_map.copy_data = self.copy_data
+    
+    def _map_image(self, f):
+    
+        # Maps the image file into memory. A duplicate of the file descriptor
+        # is kept so that advice about the file can be given after the file
+        # object is closed.
+        sectors = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.image_fd = os.dup(f.fileno())
+        return sectors
+    
+    def advise(self, ranges):
+    
+        """Tells the operating system that the list of (start, end) ranges of
+        the disc image will be read soon, so that it can read them in advance.
+        This only has an effect for images that were mapped into memory; the
+        data of other images is already held in memory.
+        
+        The advice is given for the mapped pages with madvise() where Python
+        provides it, and otherwise for the image file with posix_fadvise()."""
+        
+        global _fadvise
+        
+        if self.image_fd is None:
+            return
+        
+        if hasattr(self.sectors, "madvise") and \
+            hasattr(mmap, "MADV_WILLNEED"):
+            
+            # The start of each range is rounded down to the start of the
+            # page that contains it.
+            for start, end in ranges:
+            
+                page = start - (start % mmap.PAGESIZE)
+                self.sectors.madvise(mmap.MADV_WILLNEED, page, end - page)
+            
+            return
+        
+        if _fadvise is None:
+        
+            _fadvise = getattr(os, "posix_fadvise", False)
+            
+            if not _fadvise:
+            
+                try:
+                    import ctypes, ctypes.util
+                    libc = ctypes.CDLL(ctypes.util.find_library("c"))
+                    _fadvise = libc.posix_fadvise
+                    _fadvise.argtypes = [ctypes.c_int, ctypes.c_int64,
+                                         ctypes.c_int64, ctypes.c_int]
+                except (AttributeError, ImportError, OSError, TypeError):
+                    pass
+        
+        if not _fadvise:
+            return
+        
+        for start, end in ranges:
+        
+            _fadvise(self.image_fd, start, end - start, POSIX_FADV_WILLNEED)
     
     def _read_tracks(self, f, inter):
     
-        t = ""
+        # The tracks are collected in a list and joined once they have all
+        # been read to avoid copying the data read so far for each track.
+        t = []
         
         f.seek(0, 0)
         
@@ -1250,13 +2471,13 @@ class ADFSdisc(Utilities):
             try:
                 for i in range(0, self.ntracks):
                 
-                    t = t + f.read(self.nsectors * self.sector_size)
+                    t.append(f.read(self.nsectors * self.sector_size))
             
             except IOError:
-                print 'Less than %i tracks found.' % self.ntracks
+                print('Less than %i tracks found.' % self.ntracks)
                 f.close()
-                raise ADFS_exception, \
-                    'Less than %i tracks found.' % self.ntracks
+                raise ADFS_exception(
+                    'Less than %i tracks found.' % self.ntracks)
         
         else:
         
@@ -1269,20 +2490,20 @@ class ADFSdisc(Utilities):
                 
                     if i < (self.ntracks >> 1):
                         f.seek(i*2*self.nsectors*self.sector_size, 0)
-                        t = t + f.read(self.nsectors*self.sector_size)
+                        t.append(f.read(self.nsectors*self.sector_size))
                     else:
                         j = i - (self.ntracks >> 1)
                         f.seek(((j*2)+1)*self.nsectors*self.sector_size, 0)
-                        t = t + f.read(self.nsectors*self.sector_size)
+                        t.append(f.read(self.nsectors*self.sector_size))
             
             except IOError:
             
-                print 'Less than %i tracks found.' % self.ntracks
+                print('Less than %i tracks found.' % self.ntracks)
                 f.close()
-                raise ADFS_exception, \
-                    'Less than %i tracks found.' % self.ntracks
+                raise ADFS_exception(
+                    'Less than %i tracks found.' % self.ntracks)
         
-        return t
+        return b"".join(t)
     
     def _read_old_catalogue(self, base):
     
@@ -1305,32 +2526,23 @@ class ADFSdisc(Utilities):
         
         files = []
         
-        while ord(self.sectors[head+p]) != 0:
+        # The tail of the directory occupies the last sector.
+        if self.disc_type == 'adD':
+            tail = head + self.sector_size    # 1024 bytes
+        else:
+            tail = head + (self.sector_size*4)    # 1024 bytes
+        
+        for offset, old_name, load, exe, length, address, olddirobseq in \
+            self._read_entries(head + p, tail + self.sector_size):
         
-            old_name = self.sectors[head+p:head+p+10]
-            top_set = 0
-            counter = 1
-            for i in old_name:
-                if (ord(i) & 128) != 0:
-                    top_set = counter
-                counter = counter + 1
-            
-            name = self._safe(self.sectors[head+p:head+p+10])
-            
-            load = self._read_unsigned_word(self.sectors[head+p+10:head+p+14])
-            exe = self._read_unsigned_word(self.sectors[head+p+14:head+p+18])
-            length = self._read_unsigned_word(self.sectors[head+p+18:head+p+22])
+            found = len(files)
+            top_set = self._top_bit_set(old_name)
+            name = self._safe(old_name)
             
             if self.disc_type == 'adD':
-                inddiscadd = 256 * self._str2num(
-                    3, self.sectors[head+p+22:head+p+25]
-                    )
+                inddiscadd = 256 * address
             else:
-                inddiscadd = self.sector_size * self._str2num(
-                    3, self.sectors[head+p+22:head+p+25]
-                    )
-            
-            olddirobseq = self._read_unsigned_byte(self.sectors[head+p+25])
+                inddiscadd = self.sector_size * address
             
             if self.disc_type == 'adD':
             
@@ -1341,13 +2553,14 @@ class ADFSdisc(Utilities):
                     lower_dir_name, lower_files = \
                         self._read_old_catalogue(inddiscadd)
                         
-                    files.append(ADFSdirectory(name, lower_files))
+                    files.append(self._old_directory(name, lower_files,
+                                                     inddiscadd))
                 
                 else:
                 
                     # A file has been found.
-                    data = self.sectors[inddiscadd:inddiscadd+length]
-                    files.append(ADFSfile(name, data, load, exe, length))
+                    files.append(self._old_file(name, load, exe, length,
+                                                inddiscadd))
             
             else:
             
@@ -1360,24 +2573,22 @@ class ADFSdisc(Utilities):
                     lower_dir_name, lower_files = \
                         self._read_old_catalogue(inddiscadd)
                     
-                    files.append(ADFSdirectory(name, lower_files))
+                    files.append(self._old_directory(name, lower_files,
+                                                     inddiscadd))
                 
                 else:
                 
                     # A file has been found.
-                    data = self.sectors[inddiscadd:inddiscadd+length]
-                    files.append(ADFSfile(name, data, load, exe, length))
+                    files.append(self._old_file(name, load, exe, length,
+                                                inddiscadd))
             
-            p = p + 26
+            # Record the name as it was stored for any objects found.
+            for obj in files[found:]:
+                obj.raw_name = old_name
         
         
         # Go to tail of directory structure (0x200 -- 0x700)
         
-        if self.disc_type == 'adD':
-            tail = head + self.sector_size    # 1024 bytes
-        else:
-            tail = head + (self.sector_size*4)    # 1024 bytes
-        
         dir_end = self.sectors[tail+self.sector_size-5:tail+self.sector_size-1]
         if dir_end not in self.dir_markers:
         
@@ -1403,8 +2614,11 @@ class ADFSdisc(Utilities):
                 self.sectors[tail+self.sector_size-38:tail+self.sector_size-35]
                 )
             
-            dir_title = \
-                self.sectors[tail+self.sector_size-35:tail+self.sector_size-16]
+            # Note that the title may contain spaces.
+            dir_title = self._safe(
+                self.sectors[tail+self.sector_size-35:tail+self.sector_size-16],
+                with_space = 1
+                )
         else:
         
             dir_name = self._safe(
@@ -1423,9 +2637,7 @@ class ADFSdisc(Utilities):
         if parent == head:
         
             # Use the directory title as the disc name.
-            
-            # Note that the title may contain spaces.
-            self.disc_name = self._safe(dir_title, with_space = 1)
+            self.disc_name = dir_title
         
         endseq = self.sectors[tail+self.sector_size-6]
         if endseq != dir_seq:
@@ -1442,6 +2654,32 @@ class ADFSdisc(Utilities):
         
         return dir_name, files
     
+    def _old_directory_size(self):
+    
+        # Directories on D format discs occupy 2048 bytes; those on smaller
+        # discs occupy five 256 byte sectors.
+        if self.disc_type == 'adD':
+            return 0x800
+        else:
+            return self.sector_size * 5
+    
+    def _old_directory(self, name, files, address):
+    
+        directory = ADFSdirectory(name, files)
+        directory.extents = [(address, address + self._old_directory_size())]
+        return directory
+    
+    def _old_file(self, name, load, exe, length, address):
+    
+        # Files on old format discs are stored in a single piece.
+        if self.copy_data:
+            data = self.sectors[address:address+length]
+            return ADFSfile(name, data, load, exe, length,
+                            [(address, address + length)])
+        else:
+            return ADFSfile(name, None, load, exe, length,
+                            [(address, address + length)], self.sectors)
+    
     def print_catalogue(self, files = None, path = "$", filetypes = 0):
     
         """Prints the contents of the disc catalogue to standard output.
@@ -1468,7 +2706,7 @@ class ADFSdisc(Utilities):
         
         if files == []:
         
-            print path, "(empty)"
+            print(path, "(empty)")
         
         for obj in files:
     
@@ -1478,11 +2716,11 @@ class ADFSdisc(Utilities):
                 if not filetypes:
                 
                     # Load and execution addresses treated as valid.
-                    print string.expandtabs(
+                    print((
                         "%s.%s\t%X\t%X\t%X" % (
                             path, name, obj.load_address,
                             obj.execution_address, obj.length
-                            ), 16
+                            )).expandtabs(16)
                         )
                 
                 else:
@@ -1493,28 +2731,80 @@ class ADFSdisc(Utilities):
                     time_stamp = obj.time_stamp()
                     if not time_stamp or not obj.has_filetype():
                     
-                        print string.expandtabs(
+                        print((
                             "%s.%s\t%X\t%X\t%X" % (
                                 path, name, obj.load_address,
                                 obj.execution_address, obj.length
-                                ), 16
+                                )).expandtabs(16)
                             )
                     else:
                     
                         time_stamp = time.strftime("%H:%M:%S, %a %m %b %Y", time_stamp)
-                        print string.expandtabs(
+                        print((
                             "%s.%s\t%s\t%s\t%X" % (
                                 path, name, obj.filetype().upper(), time_stamp,
                                 obj.length
-                                ), 16
+                                )).expandtabs(16)
                             )
             
             else:
             
                 self.print_catalogue(obj.files, path + "." + name, filetypes)
     
+    def walk(self, files = None, path = "$"):
+    
+        """Returns a generator that yields a (path, object) tuple for each
+        file and directory in the disc catalogue. Each directory is yielded
+        before the objects it contains.
+        
+        As with print_catalogue(), the files and path parameters can be used
+        to walk a subset of the catalogue.
+        """
+        
+        if files is None:
+        
+            files = self.files
+        
+        for obj in files:
+        
+            obj_path = path + "." + obj.name
+            yield obj_path, obj
+            
+            if isinstance(obj, ADFSdirectory):
+            
+                for item in self.walk(obj.files, obj_path):
+                
+                    yield item
+    
+    def find(self, path):
+    
+        """Returns the object with the given path, such as "$.Games.Loader",
+        or None if there is no such object. Names are compared without regard
+        to case, as on RISC OS, and each directory on the path is searched
+        using its index of names rather than by examining every object."""
+        
+        names = path.split(".")
+        
+        if names[0] == "$":
+            names = names[1:]
+        
+        obj = self.root
+        
+        for name in names:
+        
+            if not isinstance(obj, ADFSdirectory):
+                return None
+            
+            obj = obj.lookup(name)
+            
+            if obj is None:
+                return None
+        
+        return obj
+    
     def _extract_old_files(self, objects, path, filetypes = 0, separator = ",",
-                           convert_dict = {}, with_time_stamps = False):
+                           convert_dict = {}, time_stamps = None,
+                           manifest = None, skip = None):
     
         new_path = self._create_directory(path)
         
@@ -1526,6 +2816,9 @@ class ADFSdisc(Utilities):
         
             return
         
+        if manifest is not None:
+            manifest.add_directory(path)
+        
         for obj in objects:
         
             old_name = obj.name
@@ -1539,49 +2832,32 @@ class ADFSdisc(Utilities):
                 if not filetypes:
                 
                     # Load and execution addresses assumed to be valid.
-                    
-                    # Create the INF file
                     out_file = os.path.join(path, name)
-                    inf_file = os.path.join(path, name) + separator + "inf"
-                    
-                    try:
-                        out = open(out_file, "wb")
-                        out.write(obj.data)
-                        out.close()
-                    except IOError:
-                        print "Couldn't open the file: %s" % out_file
-                    
-                    try:
-                        inf = open(inf_file, "w")
-                        inf.write("$.%s\t%X\t%X\t%X" % (
-                            name, obj.load_address, obj.execution_address,
-                            obj.length
-                            ))
-                        inf.close()
-                    except IOError:
-                        print "Couldn't open the file: %s" % inf_file
+                    inf_file = out_file + separator + "inf"
                 
                 else:
                 
                     # Interpret the load address as a filetype.
                     out_file = os.path.join(path, name) + separator + obj.filetype()
-                    
-                    try:
-                        out = open(out_file, "wb")
-                        out.write(obj.data)
-                        out.close()
-                    except IOError:
-                        print "Couldn't open the file: %s" % out_file
+                    inf_file = None
+                
+                self._extract_file(obj, name, out_file, inf_file, time_stamps,
+                                   manifest, skip)
             else:
             
                 new_path = os.path.join(path, name)
                 
                 self._extract_old_files(
-                    obj.files, new_path, filetypes, separator, convert_dict
+                    obj.files, new_path, filetypes, separator, convert_dict,
+                    time_stamps, manifest, skip
                     )
+                
+                if os.path.isdir(new_path):
+                    self._record_time_stamp(time_stamps, new_path, obj)
     
     def _extract_new_files(self, objects, path, filetypes = 0, separator = ",",
-                           convert_dict = {}, with_time_stamps = False):
+                           convert_dict = {}, time_stamps = None,
+                           manifest = None, skip = None):
     
         new_path = self._create_directory(path)
         
@@ -1593,6 +2869,9 @@ class ADFSdisc(Utilities):
         
             return
         
+        if manifest is not None:
+            manifest.add_directory(path)
+        
         for obj in objects:
         
             old_name = obj.name
@@ -1608,49 +2887,83 @@ class ADFSdisc(Utilities):
                 if not filetypes:
                 
                     # Load and execution addresses assumed to be valid.
-                    
-                    # Create the INF file
                     out_file = path + os.sep + name
-                    inf_file = path + os.sep + name + separator + "inf"
-                    
-                    try:
-                        out = open(out_file, "wb")
-                        out.write(obj.data)
-                        out.close()
-                    except IOError:
-                        print "Couldn't open the file: %s" % out_file
-                    
-                    try:
-                        inf = open(inf_file, "w")
-                        inf.write("$.%s\t%X\t%X\t%X" % (
-                            name, obj.load_address, obj.execution_address,
-                            obj.length
-                            ))
-                        inf.close()
-                    except IOError:
-                        print "Couldn't open the file: %s" % inf_file
+                    inf_file = out_file + separator + "inf"
+                
                 else:
                 
                     # Interpret the load address as a filetype.
                     out_file = path + os.sep + name + separator + obj.filetype()
-                    
-                    try:
-                        out = open(out_file, "wb")
-                        out.write(obj.data)
-                        out.close()
-                    except IOError:
-                        print "Couldn't open the file: %s" % out_file
+                    inf_file = None
+                
+                self._extract_file(obj, name, out_file, inf_file, time_stamps,
+                                   manifest, skip)
             else:
             
                 new_path = os.path.join(path, name)
                 
                 self._extract_new_files(
-                    obj.files, new_path, filetypes, separator, convert_dict
+                    obj.files, new_path, filetypes, separator, convert_dict,
+                    time_stamps, manifest, skip
                     )
+                
+                if os.path.isdir(new_path):
+                    self._record_time_stamp(time_stamps, new_path, obj)
+    
+    def _extract_file(self, obj, name, out_file, inf_file, time_stamps,
+                      manifest, skip = None):
+    
+        # Writes the data of the file object to out_file and, unless inf_file
+        # is None, its name and addresses to inf_file. Files recorded in the
+        # manifest as unchanged since it was last written are skipped, as are
+        # those rejected by the skip function.
+        if skip is not None and skip(obj):
+            return
+        
+        if manifest is not None:
+        
+            entry = manifest.entry(obj, out_file, inf_file)
+            
+            if manifest.unchanged(out_file, inf_file, entry):
+            
+                manifest.add(out_file, entry)
+                self._record_time_stamp(time_stamps, out_file, obj)
+                if inf_file is not None:
+                    self._record_time_stamp(time_stamps, inf_file, obj)
+                return
+        
+        try:
+            out = open(out_file, "wb")
+            out.write(obj.data)
+            out.close()
+            self._record_time_stamp(time_stamps, out_file, obj)
+        except IOError:
+            print("Couldn't open the file: %s" % out_file)
+            return
+        
+        if inf_file is not None:
+        
+            # Create the INF file
+            try:
+                inf = open(inf_file, "wb")
+                inf.write(to_bytes("$.%s\t%X\t%X\t%X" % (
+                    name, obj.load_address, obj.execution_address,
+                    obj.length
+                    )))
+                inf.close()
+                self._record_time_stamp(time_stamps, inf_file, obj)
+            except IOError:
+                print("Couldn't open the file: %s" % inf_file)
+                return
+        
+        if manifest is not None:
+            manifest.add(out_file, entry)
     
     def extract_files(self, out_path, files = None, filetypes = 0,
                       separator = ",", convert_dict = {},
-                      with_time_stamps = False):
+                      with_time_stamps = False, manifest = None,
+                      use_hashes = False, remove_stale = False,
+                      skip = None):
     
         """Extracts the files stored in the disc image into a directory
         structure stored on the path specified by out_path.
@@ -1668,40 +2981,102 @@ class ADFSdisc(Utilities):
         characters used in ADFS file names and those on the target file system.
         
         If with_time_stamps is set, each extracted file will be given the time
-        stamp on the target file system that it has in the disc image.
+        stamp on the target file system that it has in the disc image, as will
+        directories that are time stamped. The time stamps are applied in a
+        single pass after all the files have been written, since writing to a
+        directory changes its modification time.
+        
+        If manifest is the path of a file, the files are extracted
+        incrementally: a file is only written if it is not recorded in the
+        manifest written by the previous extraction to out_path, or if its
+        length or load or execution address has changed since then. If
+        use_hashes is set, the contents of the files are also compared using
+        their SHA-1 digests. The manifest is rewritten to describe the files
+        extracted. If remove_stale is also set, files recorded in the previous
+        manifest that are no longer extracted are removed, along with their
+        .inf files and any directories that are left empty.
+        
+        If skip is given, it is called with each ADFSfile instance before the
+        file is written, and the file is not extracted if it returns True.
         """
         
         if files is None:
         
             files = self.files
         
+        if with_time_stamps:
+            time_stamps = []
+        else:
+            time_stamps = None
+        
+        if manifest is not None:
+            manifest = ExtractionManifest(manifest, out_path, use_hashes)
+        
         if self.disc_type == 'adD':
         
             self._extract_old_files(
                 files, out_path, filetypes, separator, convert_dict,
-                with_time_stamps
+                time_stamps, manifest, skip
                 )
         
         elif self.disc_type == 'adE':
         
             self._extract_new_files(
                 files, out_path, filetypes, separator, convert_dict,
-                with_time_stamps
+                time_stamps, manifest, skip
                 )
         
         elif self.disc_type == 'adEbig':
         
             self._extract_new_files(
                 files, out_path, filetypes, separator, convert_dict,
-                with_time_stamps
+                time_stamps, manifest, skip
                 )
         
         else:
         
             self._extract_old_files(
                 files, out_path, filetypes, separator, convert_dict,
-                with_time_stamps
+                time_stamps, manifest, skip
                 )
+        
+        if manifest is not None:
+        
+            if remove_stale:
+                manifest.remove_stale()
+            
+            manifest.write()
+        
+        if time_stamps:
+            self._apply_time_stamps(time_stamps)
+    
+    def _record_time_stamp(self, time_stamps, path, obj):
+    
+        # Records the time stamp of the object for the file or directory
+        # with the given path if time stamps are being collected and the
+        # object is time stamped.
+        if time_stamps is None:
+            return
+        
+        load = getattr(obj, "load_address", None)
+        
+        if load is not None and load & 0xfff00000 == 0xfff00000:
+            time_stamps.append((path, riscos_time(load, obj.execution_address)))
+    
+    def _apply_time_stamps(self, time_stamps):
+    
+        # Sets the access and modification times of each path in the list
+        # of (path, seconds) tuples.
+        for path, seconds in time_stamps:
+        
+            # Skip directories removed after their contents were removed.
+            if not os.path.exists(path):
+                continue
+            
+            try:
+                os.utime(path, (seconds, seconds))
+            except (OSError, OverflowError, ValueError):
+                print("Couldn't set the time stamp of: %s" % path)
     
     def print_log(self, verbose = 0):
     
@@ -1709,32 +3084,32 @@ class ADFSdisc(Utilities):
         are only printed if verbose is set to 1.
         """
         
-        if hasattr(self, "disc_map") and self.disc_map.has_key(1):
+        if hasattr(self, "disc_map") and 1 in self.disc_map:
         
-            print self._plural(
+            print(self._plural(
                 "%i mapped %s found.", [len(self.disc_map[1])],
                 [("defects", "defect", "defects")]
-                )
+                ))
         
-        # Count the information, warning and error messages in the log.
-        informs = reduce(lambda a, b: a + (b[0] == INFORM), self.verify_log, 0)
-        warnings = reduce(
-            lambda a, b: a + (b[0] == WARNING), self.verify_log, 0
-            )
-        errors = reduce(lambda a, b: a + (b[0] == ERROR), self.verify_log, 0)
+        # Count the warning and error messages in the log.
+        counts = {INFORM: 0, WARNING: 0, ERROR: 0}
+        
+        for msgtype, line in self.verify_log:
+        
+            counts[msgtype] = counts[msgtype] + 1
         
-        if (warnings + errors) == 0:
+        if (counts[WARNING] + counts[ERROR]) == 0:
         
-            print "All objects located."
+            print("All objects located.")
             if not verbose: return
         
         if self.verify_log != []:
         
-            print
+            print()
         
         for msgtype, line in self.verify_log:
         
-            print line
+            print(line)
     
     def disc_format(self):
     
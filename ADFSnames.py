@@ -0,0 +1,203 @@
+"""
+ADFSnames.py, the names given to the objects in ADFS disc images when they
+are presented in a Unix filing system.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+
+import ADFSlib
+
+# The ways in which filetype suffixes and .inf files can be presented.
+suffix_modes = ("auto", "none", "all")
+inf_modes = ("auto", "show", "hide")
+
+
+class NameEncoder:
+
+    """Provides methods for encoding the names of objects in disc images for
+    use in filesystems, and for finding objects by their encoded names. This
+    class is used as a base class by the FUSE filesystem classes.
+    
+    On E and F format discs, files are given suffixes derived from their
+    filetypes, or from their contents for some kinds of file. On other
+    discs, a .inf file describing each file can be found alongside it.
+    
+    The suffixes attribute can be set to "none" to present the names of
+    files without suffixes, or to "all" to give suffixes to files with
+    filetypes on all discs. The inf_files attribute can be set to "show" or
+    "hide" to provide .inf files on all discs or on none of them. Both are
+    "auto" by default, giving the behaviour described above.
+    """
+    
+    suffixes = "auto"
+    inf_files = "auto"
+    
+    def __init__(self):
+    
+        self.info_handlers = \
+        {
+            0xfca00:    self.squash_info,
+            0xddc00:    self.nspark_info
+        }
+    
+    def encode_name_from_entry(self, obj, disc = None):
+    
+        # The encoded name only depends on the entry and the disc format, so
+        # it is stored in the entry the first time it is calculated.
+        try:
+            return obj.encoded_name
+        except AttributeError:
+            pass
+        
+        if disc is None:
+        
+            disc = self.adfsdisc
+        
+        # Any slashes in the name were replaced by dots when the catalogue
+        # was read.
+        new_name = obj.unix_name
+        
+        new_format = disc.disc_type.find("adE") == 0
+        
+        if self.suffixes == "all":
+            add_suffix = new_format or (isinstance(obj, ADFSlib.ADFSfile) and
+                                        obj.has_filetype())
+        else:
+            add_suffix = new_format and self.suffixes == "auto"
+        
+        if add_suffix:
+        
+            if isinstance(obj, ADFSlib.ADFSfile) and "." not in new_name:
+            
+                # Construct a suffix from the object's load address/filetype.
+                
+                info_handler = self.info_handlers.get(obj.load_address & 0xfff00, None)
+                
+                # Provide default values for the file type, MIME type and
+                # length.
+                filetype = obj.filetype()
+                mimetype = None
+                length = obj.length
+                
+                if info_handler:
+                
+                    filetype, mimetype, length = info_handler(
+                        obj, filetype, mimetype, length
+                        )
+                
+                new_name = new_name + "." + filetype
+        
+        obj.encoded_name = new_name
+        return new_name
+    
+    def name_index(self, objs, disc):
+    
+        """Returns a dictionary mapping the names used in the filesystem for
+        the objects in the list, objs, to (object, is_inf) tuples, where
+        is_inf is True for the .inf files provided for files on old style
+        discs. The dictionary is created when a list of objects is first
+        searched and kept with the disc until the catalogue is changed."""
+        
+        try:
+            indexes = disc.name_indexes
+        except AttributeError:
+            indexes = disc.name_indexes = {}
+        
+        # The list is stored with its index so that its identity remains
+        # valid for as long as the index is kept.
+        entry = indexes.get(id(objs))
+        
+        if entry is not None:
+            return entry[1]
+        
+        index = {}
+        if self.inf_files == "auto":
+            inf_files = disc.disc_type.find("adE") == -1
+        else:
+            inf_files = self.inf_files == "show"
+        
+        # Where objects have the same name, the first one is found.
+        for this_obj in objs[::-1]:
+        
+            obj_name = self.encode_name_from_entry(this_obj, disc)
+            index[obj_name] = (this_obj, False)
+            
+            if inf_files and isinstance(this_obj, ADFSlib.ADFSfile):
+            
+                # Old style discs will have .inf files, too.
+                index.setdefault(obj_name + ".inf", (this_obj, True))
+        
+        # Files given filetype suffixes can also be found by their names
+        # without suffixes, unless another object has that name, so that a
+        # file created in a writable image can be found by the name it was
+        # created with.
+        for this_obj in objs:
+        
+            if self.encode_name_from_entry(this_obj, disc) != \
+                this_obj.unix_name:
+                
+                index.setdefault(this_obj.unix_name, (this_obj, False))
+        
+        indexes[id(objs)] = (objs, index)
+        return index
+    
+    def squash_info(self, obj, def_filetype, def_mimetype, def_length):
+    
+        # Each Squash file contains the length of the data they
+        # contain once it is decompressed. Only the header is read, so that
+        # files that are read lazily are not read in full.
+        
+        header = obj.read_range(0, 12)
+        
+        if len(header) >= 8:
+        
+            length = struct.unpack("<I", header[4:8])[0]
+        
+        else:
+        
+            # Use the default length supplied.
+            length = def_length
+        
+        # For Squash files, use the filetype in the header for
+        # this file's suffix.
+        
+        if len(header) == 12:
+        
+            filetype = "%03x" % (
+                (struct.unpack("<I", header[8:12])[0] >> 8) & 0xfff
+                )
+        
+        else:
+        
+            filetype = "fca"
+        
+        # Let the client discover the MIME type by reading
+        # the file.
+        mimetype = None
+        
+        return filetype, mimetype, length
+    
+    def nspark_info(self, obj, def_filetype, def_mimetype, def_length):
+    
+        # For the archive as a whole, we run the nspark utility with
+        # a contradictory set of options.
+        
+        #command = "nspark -qtv"
+        
+        # For now, just return the default values.
+        return def_filetype, def_mimetype, def_length
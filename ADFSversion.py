@@ -0,0 +1,25 @@
+"""
+ADFSversion.py, the version information for the fuse_adfs package, kept
+apart from the filesystem modules so that it can be read without importing
+the FUSE bindings.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "David Boddie <david@boddie.org.uk>"
+__version__ = "0.21"
+__date__ = "Saturday 25th November 2017"
+__license__ = "GNU General Public License version 3 (or later)"
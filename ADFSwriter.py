@@ -0,0 +1,1192 @@
+"""
+ADFSwriter.py, support for modifying the contents of new format ADFS disc
+images.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import binascii, errno, os, struct, time, zlib
+
+import ADFSlib
+
+
+# The size of a new format directory and the number of entries it can hold.
+new_directory_size = 2048
+max_directory_entries = 77
+
+# Attribute bits used in catalogue entries.
+owner_read = 0x01
+owner_write = 0x02
+locked = 0x04
+directory_flag = 0x08
+
+# Files on old format discs have their attributes stored in the top bits of
+# the first four characters of their names.
+old_attribute_bits = (owner_read, owner_write, locked, directory_flag)
+
+# Characters that cannot be used in RISC OS names.
+invalid_name_chars = '$&@^%.:#*"|\\'
+
+# Journal files begin with this marker and the number of writes they hold.
+# Each write is described by its offset in the image and its length, and is
+# followed by its data. The file ends with a CRC-32 of everything before it.
+journal_marker = b"ADFSjnl1"
+_journal_write_struct = struct.Struct("<QI")
+
+
+def _ror13(value):
+
+    return ((value >> 13) | (value << 19)) & 0xffffffff
+
+
+def directory_check_byte(block, last):
+
+    """Returns the check byte for the new format directory held in the
+    string, block, where last is the offset of the byte following the last
+    entry in the directory."""
+    
+    value = 0
+    words = struct.unpack("<%iI" % (last // 4), block[:last & ~3])
+    
+    for word in words:
+        value = word ^ _ror13(value)
+    
+    for c in bytearray(block[last & ~3:last]):
+        value = c ^ _ror13(value)
+    
+    # The words in the tail are included, apart from the last one which
+    # contains the check byte itself.
+    size = len(block)
+    for word in struct.unpack("<9I", block[size - 40:size - 4]):
+        value = word ^ _ror13(value)
+    
+    return (value ^ (value >> 8) ^ (value >> 16) ^ (value >> 24)) & 0xff
+
+
+def object_attributes(obj):
+
+    """Returns the attributes of the ADFSfile or ADFSdirectory instance, obj,
+    in the form used in the catalogue entries of new format discs. Objects
+    read from S, M and L format discs have their attributes decoded from the
+    names stored in their entries."""
+    
+    if hasattr(obj, "attributes"):
+        return obj.attributes
+    
+    attributes = 0
+    raw_name = bytearray(obj.raw_name or b"")
+    
+    for i in range(min(len(raw_name), len(old_attribute_bits))):
+        if raw_name[i] & 0x80:
+            attributes = attributes | old_attribute_bits[i]
+    
+    if isinstance(obj, ADFSlib.ADFSdirectory):
+        return attributes | directory_flag
+    else:
+        return (attributes & ~directory_flag) or (owner_read | owner_write)
+
+
+def new_directory_block(entries, name, parent, title, sequence,
+                        marker = b"Nick"):
+    
+    """Returns a string containing a new format directory holding the list of
+    entries given. Each entry is a (name, load address, execution address,
+    length, SIN, attributes) tuple. The directory's own name, the SIN of its
+    parent, its title and its sequence number are stored in its tail.
+    
+    The entries are sorted by name, ignoring case, as RISC OS expects. The
+    marker is stored at the start and end of the directory; D format discs
+    use directories with the same layout but with "Hugo" as the marker, and
+    with disc addresses in place of SINs. The names and the title are given
+    as strings of bytes, as they are stored in the directory."""
+    
+    if len(entries) > max_directory_entries:
+        raise IOError(errno.ENOSPC, "Directory is full")
+    
+    entries = sorted(entries, key = lambda entry: entry[0].lower())
+    
+    pieces = [struct.pack("<B", sequence), marker]
+    
+    for entry_name, load, exe, length, address, attributes in entries:
+    
+        pieces.append(entry_name[:10].ljust(10, b"\r"))
+        pieces.append(struct.pack("<IIIHBB", load, exe, length,
+                                  address & 0xffff, (address >> 16) & 0xff,
+                                  attributes))
+    
+    block = b"".join(pieces)
+    last = len(block)
+    
+    tail = (struct.pack("<I", parent)[:3] + title[:19].ljust(19, b"\r") +
+            name[:10].ljust(10, b"\r") + struct.pack("<B", sequence) + marker)
+    
+    # The byte following the last entry is zero, as is the reserved part of
+    # the tail.
+    block = block + (b"\x00" * (new_directory_size - last - len(tail) - 1)) + \
+            tail
+    
+    return block + struct.pack("<B", directory_check_byte(block + b"\x00",
+                                                          last))
+
+
+def encode_journal(writes):
+
+    """Returns a string containing a journal that records the list of
+    (offset, data) writes given."""
+    
+    pieces = [journal_marker, struct.pack("<I", len(writes))]
+    
+    for offset, data in writes:
+    
+        pieces.append(_journal_write_struct.pack(offset, len(data)))
+        pieces.append(bytes(data))
+    
+    body = b"".join(pieces)
+    return body + struct.pack("<I", zlib.crc32(body) & 0xffffffff)
+
+
+def decode_journal(journal):
+
+    """Returns the list of (offset, data) writes recorded in the string,
+    journal, or None if the journal is incomplete or damaged."""
+    
+    header = len(journal_marker) + 4
+    
+    if len(journal) < header + 4 or not journal.startswith(journal_marker):
+        return None
+    
+    body = journal[:-4]
+    if struct.unpack("<I", journal[-4:])[0] != zlib.crc32(body) & 0xffffffff:
+        return None
+    
+    count = struct.unpack("<I", body[len(journal_marker):header])[0]
+    position = header
+    writes = []
+    
+    for i in range(count):
+    
+        offset, length = _journal_write_struct.unpack_from(body, position)
+        position = position + _journal_write_struct.size
+        writes.append((offset, body[position:position + length]))
+        position = position + length
+    
+    return writes
+
+
+def read_journal(path):
+
+    """Returns the list of (offset, data) writes recorded in the journal file
+    at the specified path, or None if there is no complete journal there."""
+    
+    try:
+        f = open(path, "rb")
+    except IOError:
+        return None
+    
+    try:
+        return decode_journal(f.read())
+    finally:
+        f.close()
+
+
+def _sync_directory(path):
+
+    # Makes the creation or removal of the file at path permanent by
+    # synchronising the directory containing it, where this is possible.
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    
+    os.close(fd)
+
+
+class MapEditor:
+
+    """editor = MapEditor(disc_map)
+    
+    Holds an editable copy of the fragments described by the new format map,
+    disc_map, an ADFSnewMap instance. Objects are freed and allocated by
+    changing the owners of fragments and the modified map is obtained by
+    calling the encode() method.
+    """
+    
+    def __init__(self, disc_map):
+    
+        self.disc_map = disc_map
+        self.layout = disc_map.zone_layout()
+        self.zones = disc_map.read_fragments()
+        self.id_length = disc_map.record["id length"]
+        self.bytes_per_bit = disc_map.record["bytes per bit"]
+        
+        # Objects are allocated whole sectors, and fragments cannot be
+        # shorter than an ID and its end bit.
+        self.unit = max(1, disc_map.sector_size // self.bytes_per_bit)
+        self.minimum = self._round(self.id_length + 1)
+    
+    def _round(self, bits):
+    
+        return ((bits + self.unit - 1) // self.unit) * self.unit
+    
+    def used_ids(self):
+    
+        used = {}
+        for fragments in self.zones:
+            for start, length, owner in fragments:
+                if owner is not None:
+                    used[owner] = None
+        
+        return used
+    
+    def extents(self, address):
+    
+        """Returns a list of (start, end) offsets in the disc image occupied
+        by the object with the SIN given, in the same form as the extents of
+        ADFSfile instances."""
+        
+        file_no = address >> 8
+        extents = []
+        
+        for zone in self.disc_map.zone_order(file_no):
+        
+            for start, length, owner in self.zones[zone]:
+            
+                if owner == file_no:
+                
+                    begin = self.disc_map.fragment_address(zone, start)
+                    extents.append((begin, begin + length * self.bytes_per_bit))
+        
+        # Objects that share a fragment begin at a sector within it.
+        offset = address & 0xff
+        if offset != 0 and extents:
+        
+            begin, end = extents[0]
+            extents[0] = (begin + (offset - 1) * self.disc_map.sector_size, end)
+        
+        return extents
+    
+    def free(self, file_no):
+    
+        """Marks the fragments belonging to the object with the given file
+        number as free, merging them with any neighbouring free fragments."""
+        
+        for fragments in self.zones:
+        
+            merged = []
+            
+            for fragment in fragments:
+            
+                if fragment[2] == file_no:
+                    fragment = [fragment[0], fragment[1], None]
+                
+                if fragment[2] is None and merged and merged[-1][2] is None:
+                    merged[-1][1] = merged[-1][1] + fragment[1]
+                else:
+                    merged.append(fragment)
+            
+            fragments[:] = merged
+    
+    def allocate(self, length):
+    
+        """Allocates space for an object of length bytes and returns its SIN.
+        The first free fragments that can hold the object are used, with
+        free fragments divided where necessary. An IOError is raised if there
+        is not enough free space on the disc.
+        
+        The object is given an ID belonging to the first zone with free
+        space, and any further fragments are taken from the zones that follow
+        it, so that the fragments are found in order when the map is read."""
+        
+        file_no = None
+        
+        for zone, fragments in enumerate(self.zones):
+        
+            if None in [owner for start, size, owner in fragments]:
+            
+                file_no = self._new_id(zone)
+                if file_no is not None:
+                    break
+        
+        if file_no is None:
+            raise IOError(errno.ENOSPC, "Not enough free space on the disc")
+        
+        needed = self._round((length + self.bytes_per_bit - 1) //
+                             self.bytes_per_bit)
+        
+        saved = [[fragment[:] for fragment in fragments]
+                 for fragments in self.zones]
+        
+        for zone in self.disc_map.zone_order(file_no):
+        
+            fragments = self.zones[zone]
+            i = 0
+            while i < len(fragments) and needed > 0:
+            
+                start, size, owner = fragments[i]
+                
+                if owner is None:
+                
+                    take = min(size, max(needed, self.minimum))
+                    
+                    # Any space left over must be large enough to form a
+                    # fragment of its own.
+                    if size - take < self.minimum:
+                        take = size
+                    
+                    fragments[i] = [start, take, file_no]
+                    
+                    if take < size:
+                        fragments.insert(i + 1, [start + take, size - take, None])
+                    
+                    needed = needed - take
+                
+                i = i + 1
+        
+        if needed > 0:
+        
+            self.zones = saved
+            raise IOError(errno.ENOSPC, "Not enough free space on the disc")
+        
+        return file_no << 8
+    
+    def _new_id(self, zone):
+    
+        # IDs 0 and 1 are not used for objects and 2 is used for the map and
+        # the root directory. Each zone has its own range of IDs.
+        used = self.used_ids()
+        ids_per_zone = self.disc_map.ids_per_zone
+        
+        for file_no in range(max(3, zone * ids_per_zone),
+                             min(1 << self.id_length,
+                                 (zone + 1) * ids_per_zone)):
+        
+            if file_no not in used:
+                return file_no
+        
+        return None
+    
+    def free_space(self):
+    
+        """Returns the number of bytes in free fragments."""
+        
+        total = 0
+        for fragments in self.zones:
+            for start, length, owner in fragments:
+                if owner is None:
+                    total = total + length
+        
+        return total * self.bytes_per_bit
+    
+    def encode(self):
+    
+        """Returns a string containing all the zones of the map, with the
+        changes made to the fragments, free space lists and zone checks."""
+        
+        sectors = self.disc_map.sectors
+        sector_size = self.disc_map.sector_size
+        id_mask = (1 << self.id_length) - 1
+        pieces = []
+        
+        for (offset, begin, end, first), fragments in \
+            zip(self.layout, self.zones):
+            
+            zone = sectors[offset:offset + sector_size]
+            bits = ADFSlib._little_endian(zone)
+            
+            # Clear the free link in the header and the fragments, leaving
+            # the zone check, cross check, disc record and any bits after
+            # the end of the zone in place.
+            bits = bits & ~(0xffff << 8)
+            bits = bits & ~(((1 << (end - begin)) - 1) << begin)
+            
+            # Each free fragment links to the next, with the first linked
+            # from the header.
+            link = 8
+            value = 0x8000
+            
+            for start, length, owner in fragments:
+            
+                if owner is None:
+                
+                    if link == 8:
+                        value = 0x8000 | (start - 8)
+                    else:
+                        bits = bits | ((start - link) << link)
+                    
+                    link = start
+                
+                else:
+                
+                    bits = bits | ((owner & id_mask) << start)
+                
+                bits = bits | (1 << (start + length - 1))
+            
+            bits = bits | (value << 8)
+            
+            zone = binascii.unhexlify("%0*x" % (sector_size * 2, bits))[::-1]
+            pieces.append(struct.pack("<B", self.disc_map._zone_check(zone)) +
+                          zone[1:])
+        
+        return b"".join(pieces)
+
+
+class ImageFile:
+
+    """store = ImageFile(path)
+    
+    Gives direct access to the image file at the specified path. Changes
+    written through the file objects returned by open() are made to the
+    image itself.
+    
+    Writes that change parts of the image in place are first recorded in a
+    journal file whose path is that of the image with ".journal" appended.
+    If the writes are interrupted, the recover() method completes them.
+    """
+    
+    def __init__(self, path):
+    
+        self.path = path
+        self.journal_path = path + ".journal"
+    
+    def open(self, mode = "rb"):
+    
+        return open(self.path, mode)
+    
+    def sync(self, f):
+    
+        f.flush()
+        os.fsync(f.fileno())
+    
+    def begin(self, writes):
+    
+        """Records the list of (offset, data) writes that are about to be
+        made to the image in the journal file."""
+        
+        f = open(self.journal_path, "wb")
+        try:
+            f.write(encode_journal(writes))
+            self.sync(f)
+        finally:
+            f.close()
+        
+        _sync_directory(self.journal_path)
+    
+    def end(self):
+    
+        """Removes the journal file once its writes have been made."""
+        
+        os.remove(self.journal_path)
+        _sync_directory(self.journal_path)
+    
+    def recover(self):
+    
+        """Makes the writes recorded in a journal file left by an interrupted
+        update, then removes the journal. A journal that is incomplete was
+        interrupted before the image was changed, so it is discarded."""
+        
+        if not os.path.exists(self.journal_path):
+            return
+        
+        writes = read_journal(self.journal_path)
+        
+        if writes:
+        
+            f = self.open("r+b")
+            try:
+                for offset, data in writes:
+                    f.seek(offset)
+                    f.write(data)
+                self.sync(f)
+            finally:
+                f.close()
+        
+        self.end()
+
+
+class ImageOverlay:
+
+    """store = ImageOverlay(path, side_path = None, block_size = 1024)
+    
+    Presents the image file at the specified path as if it were writable
+    without changing it. Blocks of block_size bytes that are written are kept
+    in memory or, if side_path is given, in a sparse file of the same size
+    as the image at that path, and are read in place of the corresponding
+    blocks of the image. Any existing file at side_path is replaced.
+    
+    The combined image can be written to a new file with the commit()
+    method.
+    
+    If the image has a journal file left by an interrupted update, as
+    described for ImageFile, its writes are made to the overlay. Updates
+    made through the overlay are not journalled, since the overlay does not
+    outlast the process using it.
+    """
+    
+    def __init__(self, path, side_path = None, block_size = 1024):
+    
+        self.path = path
+        self.block_size = block_size
+        self.base = open(path, "rb")
+        self.base.seek(0, 2)
+        self.size = self.base.tell()
+        
+        # Blocks held in memory are mapped to their contents; those held in
+        # the side file are mapped to None.
+        self.blocks = {}
+        
+        if side_path is None:
+            self.side = None
+        else:
+            self.side = open(side_path, "w+b")
+            self.side.truncate(self.size)
+    
+    def open(self, mode = "rb"):
+    
+        return OverlayFile(self)
+    
+    def begin(self, writes):
+    
+        pass
+    
+    def end(self):
+    
+        pass
+    
+    def recover(self):
+    
+        for offset, data in read_journal(self.path + ".journal") or []:
+            self.write(offset, data)
+    
+    def sync(self, f):
+    
+        # The overlay only lasts as long as this object, so there is no need
+        # to wait for the side file to reach the disk.
+        if self.side is not None:
+            self.side.flush()
+    
+    def close(self):
+    
+        self.base.close()
+        if self.side is not None:
+            self.side.close()
+    
+    def changed_blocks(self):
+    
+        """Returns the number of blocks that differ from the image."""
+        
+        return len(self.blocks)
+    
+    def read(self, offset, length):
+    
+        """Returns up to length bytes from the combined image, starting at
+        offset."""
+        
+        end = min(self.size, offset + length)
+        pieces = []
+        
+        while offset < end:
+        
+            block = offset // self.block_size
+            block_end = min(end, (block + 1) * self.block_size)
+            
+            if block in self.blocks:
+            
+                data = self._read_block(block)
+                start = offset - (block * self.block_size)
+                pieces.append(data[start:start + block_end - offset])
+            
+            else:
+            
+                # Read unchanged blocks from the image in a single request.
+                while block_end < end and \
+                    block_end // self.block_size not in self.blocks:
+                    
+                    block_end = min(end, block_end + self.block_size)
+                
+                self.base.seek(offset)
+                pieces.append(self.base.read(block_end - offset))
+            
+            offset = block_end
+        
+        return b"".join(pieces)
+    
+    def write(self, offset, data):
+    
+        """Writes the string, data, to the combined image at offset. Data
+        beyond the end of the image is discarded."""
+        
+        data = bytes(data[:max(0, self.size - offset)])
+        
+        while data:
+        
+            block = offset // self.block_size
+            start = offset - (block * self.block_size)
+            amount = min(len(data), self.block_size - start)
+            
+            # Start with the current contents of the block so that partial
+            # writes leave the rest of it unchanged.
+            contents = self.read(block * self.block_size, self.block_size)
+            contents = contents[:start] + data[:amount] + \
+                       contents[start + amount:]
+            
+            if self.side is None:
+            
+                self.blocks[block] = contents
+            
+            else:
+            
+                self.side.seek(block * self.block_size)
+                self.side.write(contents)
+                self.blocks[block] = None
+            
+            offset = offset + amount
+            data = data[amount:]
+    
+    def _read_block(self, block):
+    
+        contents = self.blocks[block]
+        
+        if contents is None:
+        
+            self.side.seek(block * self.block_size)
+            contents = self.side.read(self.block_size)
+        
+        return contents
+    
+    def commit(self, path, chunk_size = 1048576):
+    
+        """Writes the combined image to a new file at the given path."""
+        
+        f = open(path, "wb")
+        try:
+        
+            for offset in range(0, self.size, chunk_size):
+            
+                f.write(self.read(offset, chunk_size))
+            
+            f.flush()
+            os.fsync(f.fileno())
+        
+        finally:
+            f.close()
+
+
+class OverlayFile:
+
+    """f = OverlayFile(overlay)
+    
+    A file object for reading and writing the combined image described by
+    an ImageOverlay instance.
+    """
+    
+    def __init__(self, overlay):
+    
+        self.overlay = overlay
+        self.offset = 0
+    
+    def seek(self, offset, whence = 0):
+    
+        if whence == 1:
+            offset = self.offset + offset
+        elif whence == 2:
+            offset = self.overlay.size + offset
+        
+        self.offset = offset
+    
+    def tell(self):
+    
+        return self.offset
+    
+    def read(self, size = -1):
+    
+        if size < 0:
+            size = self.overlay.size - self.offset
+        
+        data = self.overlay.read(self.offset, size)
+        self.offset = self.offset + len(data)
+        return data
+    
+    def write(self, data):
+    
+        self.overlay.write(self.offset, data)
+        self.offset = self.offset + len(data)
+    
+    def flush(self):
+    
+        pass
+    
+    def close(self):
+    
+        pass
+
+
+class ADFSjournal:
+
+    """journal = ADFSjournal(path, store = None)
+    
+    Provides write access to the E or F format disc image stored in the file
+    at the specified path. If store is given, the image is read and written
+    through it instead of through the file itself; this is usually an
+    ImageOverlay instance that keeps the changes separate from the image.
+    
+    The image is read into an ADFSdisc instance, available as the disc
+    attribute, and its catalogue is presented as a tree of ADFSdirectory and
+    ADFSfile instances beginning with the directory in the root attribute.
+    Changes made with the methods of this class are applied to the tree
+    immediately and recorded in memory, but the image itself is only updated
+    when the flush() method is called. At that point the space for new and
+    changed objects is allocated and their data is written. The directories
+    that are changed in place and both copies of the map are then recorded
+    in the store's journal before they are written, and the image is read
+    again. An update that is interrupted is completed when the image is next
+    opened, so the image holds either the old catalogue or the new one.
+    
+    Errors are reported by raising IOError exceptions with the errno values
+    that a filing system would use.
+    """
+    
+    def __init__(self, path, store = None):
+    
+        self.path = path
+        self.store = store or ImageFile(path)
+        self.store.recover()
+        self._load()
+    
+    def _load(self):
+    
+        disc = ADFSlib.ADFSdisc(self.store.open("rb"), copy_data = 0)
+        
+        if not isinstance(getattr(disc, "disc_map", None), ADFSlib.ADFSnewMap):
+            raise ADFSlib.ADFS_exception(
+                "Writing is only supported for E and F format images.")
+        
+        self.disc = disc
+        self.root = disc.root
+        self.root.raw_name = b"$"
+        self.root.addr = disc.record["root SIN"]
+        self.root.attributes = directory_flag
+        
+        # Directories that need to be written, and the objects that were
+        # stored in the map when the image was read.
+        self.dirty = {}
+        self.stored = self._stored_ids()
+    
+    def _walk(self, directory = None):
+    
+        # Yields (parent, object) pairs for every object in the tree,
+        # including the root directory which has no parent.
+        if directory is None:
+            directory = self.root
+            yield None, directory
+        
+        for obj in directory.files:
+        
+            yield directory, obj
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+                for item in self._walk(obj):
+                    yield item
+    
+    def _stored_ids(self):
+    
+        stored = {}
+        
+        for parent, obj in self._walk():
+        
+            if obj.addr is not None and obj.addr >> 8 > 2:
+                stored[obj.addr >> 8] = None
+        
+        return stored
+    
+    def modified(self):
+    
+        """Returns True if there are changes that have not been written to
+        the image."""
+        
+        return len(self.dirty) != 0
+    
+    def find(self, directory, name):
+    
+        """Returns the object in the directory with the given name, ignoring
+        case, or None if there is no such object."""
+        
+        return directory.lookup(name)
+    
+    def _check_writable(self, directory):
+    
+        # Big directories can be read but not written, so refuse to change
+        # them before anything is modified.
+        if directory.big:
+            raise IOError(errno.EROFS, "Cannot modify big directory: %s" % \
+                          directory.name)
+    
+    def _changed(self, directory):
+    
+        self._check_writable(directory)
+        directory.changed()
+        self.dirty[directory] = None
+    
+    def _check_name(self, directory, name, replacing = None):
+    
+        self._check_writable(directory)
+        
+        if not name or len(name) > 10:
+            raise IOError(errno.ENAMETOOLONG, "Invalid name: %s" % name)
+        
+        for c in name:
+        
+            if c in invalid_name_chars or ord(c) <= 32 or ord(c) == 127 or \
+                ord(c) > 255:
+                
+                raise IOError(errno.EINVAL, "Invalid name: %s" % name)
+        
+        existing = self.find(directory, name)
+        
+        if existing is not None and existing is not replacing:
+            raise IOError(errno.EEXIST, "Object exists: %s" % name)
+        
+        if existing is None and len(directory.files) >= max_directory_entries:
+            raise IOError(errno.ENOSPC, "Directory is full")
+    
+    def _add(self, directory, obj, name, attributes):
+    
+        obj.raw_name = ADFSlib.to_bytes(name)
+        obj.addr = None
+        obj.attributes = attributes
+        self._changed(directory)
+        directory.files.append(obj)
+    
+    def create_file(self, directory, name, filetype = 0xffd, data = b""):
+    
+        """Creates a file with the given name, filetype and data in the
+        directory and returns the ADFSfile instance representing it. The
+        file is time stamped with the current time."""
+        
+        self._check_name(directory, name)
+        
+        load, exe = ADFSlib.riscos_time_stamp(0xfff00000 | (filetype << 8),
+                                              time.time())
+        obj = ADFSlib.ADFSfile(name, data, load, exe, len(data))
+        self._add(directory, obj, name, owner_read | owner_write)
+        return obj
+    
+    def mkdir(self, directory, name):
+    
+        """Creates an empty directory with the given name inside the
+        directory specified and returns the ADFSdirectory instance that
+        represents it."""
+        
+        self._check_name(directory, name)
+        
+        obj = ADFSlib.ADFSdirectory(name, [])
+        obj.load_address, obj.execution_address = \
+            ADFSlib.riscos_time_stamp(0xfffffd00, time.time())
+        obj.length = new_directory_size
+        self._add(directory, obj, name, directory_flag)
+        
+        # The new directory needs to be written as well as its parent.
+        self._changed(obj)
+        return obj
+    
+    def remove(self, directory, obj):
+    
+        """Removes the file or empty directory, obj, from the directory. The
+        space it occupies is freed when the changes are flushed."""
+        
+        if isinstance(obj, ADFSlib.ADFSdirectory) and obj.files:
+            raise IOError(errno.ENOTEMPTY, "Directory not empty")
+        
+        if obj.attributes & locked:
+            raise IOError(errno.EPERM, "Object is locked")
+        
+        self._changed(directory)
+        directory.files.remove(obj)
+        self.dirty.pop(obj, None)
+    
+    def rename(self, directory, obj, new_directory, new_name):
+    
+        """Moves obj from the directory to new_directory, giving it the name
+        new_name. Any object in new_directory with the same name is
+        replaced, as long as it is a file or an empty directory."""
+        
+        self._check_name(new_directory, new_name, obj)
+        
+        # Directories cannot be moved inside themselves.
+        if isinstance(obj, ADFSlib.ADFSdirectory):
+        
+            for parent, child in self._walk(obj):
+            
+                if child is new_directory:
+                    raise IOError(errno.EINVAL, "Cannot move a directory "
+                                                "inside itself")
+            
+            if obj is new_directory:
+                raise IOError(errno.EINVAL, "Cannot move a directory "
+                                            "inside itself")
+        
+        self._changed(directory)
+        self._changed(new_directory)
+        
+        # The tail of a directory records its name and its parent.
+        if isinstance(obj, ADFSlib.ADFSdirectory):
+            self._changed(obj)
+        
+        existing = self.find(new_directory, new_name)
+        
+        if existing is not None and existing is not obj:
+            self.remove(new_directory, existing)
+        
+        directory.files.remove(obj)
+        new_directory.files.append(obj)
+        
+        obj.name = new_name
+        obj.raw_name = ADFSlib.to_bytes(new_name)
+        obj.unix_name = new_name.translate(ADFSlib._unix_table)
+        
+        # The names were indexed when looking for an existing object.
+        directory.changed()
+        new_directory.changed()
+    
+    def write(self, directory, obj, data, offset):
+    
+        """Writes the string, data, to the file, obj, in the directory at the
+        given offset, extending the file if necessary."""
+        
+        contents = self._contents(directory, obj)
+        
+        if offset > len(contents):
+            contents.extend(b"\x00" * (offset - len(contents)))
+        
+        contents[offset:offset + len(data)] = data
+        obj.length = len(contents)
+    
+    def truncate(self, directory, obj, length):
+    
+        """Changes the length of the file, obj, in the directory to the
+        length given, padding it with zero bytes if it is extended."""
+        
+        contents = self._contents(directory, obj)
+        
+        if length < len(contents):
+            del contents[length:]
+        else:
+            contents.extend(b"\x00" * (length - len(contents)))
+        
+        obj.length = length
+    
+    def _contents(self, directory, obj):
+    
+        # Returns a bytearray holding the data of the file, obj, which is
+        # changed in place by each write so that only the data written is
+        # copied. The file's existing data is only read the first time it
+        # is changed.
+        data = obj.__dict__.get("data")
+        
+        if not isinstance(data, bytearray):
+            data = bytearray(obj.read())
+        
+        self._replace(directory, obj, data)
+        return data
+    
+    def _replace(self, directory, obj, data):
+    
+        if obj.attributes & locked:
+            raise IOError(errno.EPERM, "Object is locked")
+        
+        self._changed(directory)
+        
+        # Changed files are written to newly allocated space, so their new
+        # data is kept in memory until then.
+        obj.data = data
+        obj.length = len(data)
+        obj.sectors = None
+        obj.extents = []
+        obj.addr = None
+        obj._hashes = {}
+    
+    def set_attributes(self, directory, obj, attributes):
+    
+        """Sets the attributes of the object, obj, in the directory, leaving
+        the directory flag unchanged."""
+        
+        self._changed(directory)
+        obj.attributes = (obj.attributes & directory_flag) | \
+                         (attributes & ~directory_flag & 0xff)
+    
+    def set_time_stamp(self, directory, obj, seconds):
+    
+        """Sets the time stamp of the object, obj, in the directory to the
+        time given in seconds since the Epoch. Objects with load and
+        execution addresses instead of a time stamp are unchanged."""
+        
+        if obj.load_address & 0xfff00000 != 0xfff00000:
+            return
+        
+        self._changed(directory)
+        obj.load_address, obj.execution_address = \
+            ADFSlib.riscos_time_stamp(obj.load_address, seconds)
+    
+    def flush(self):
+    
+        """Writes any changes made to the catalogue to the image, then reads
+        the image again."""
+        
+        if not self.dirty:
+            return
+        
+        editor = MapEditor(self.disc.disc_map)
+        
+        # Objects that have been removed or changed are no longer referenced.
+        # Objects can share fragments, so only those whose IDs are not used
+        # by any remaining object are freed.
+        kept = self._stored_ids()
+        unused = [file_no for file_no in self.stored.keys()
+                  if file_no not in kept]
+        
+        # Allocate space for new and changed objects before freeing the
+        # space of unused ones, so that nothing the catalogue in the image
+        # still refers to is overwritten before the new map is written.
+        writes = []
+        parents = {}
+        created = {}
+        
+        for parent, obj in self._walk():
+        
+            parents[obj] = parent
+            
+            if obj.addr is not None:
+                continue
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+            
+                obj.addr = editor.allocate(new_directory_size)
+                created[obj] = None
+            
+            elif obj.length == 0:
+            
+                obj.addr = 0
+            
+            else:
+            
+                obj.addr = editor.allocate(obj.length)
+                writes.append((editor.extents(obj.addr), obj.data))
+        
+        for file_no in unused:
+            editor.free(file_no)
+        
+        # New directories are written to newly allocated space along with
+        # the files, but existing ones are changed in place.
+        in_place = []
+        
+        for directory in self.dirty.keys():
+        
+            # Directories that were removed after being changed are not
+            # written.
+            if directory not in parents:
+                continue
+            
+            block = self._directory_block(directory,
+                                          parents[directory] or directory,
+                                          directory in created)
+            
+            if directory in created:
+                writes.append((editor.extents(directory.addr), block))
+            else:
+                in_place = in_place + self._pieces(
+                    editor.extents(directory.addr), block)
+        
+        disc_map = editor.encode()
+        in_place.append((self.disc.map_header, disc_map + disc_map))
+        
+        f = self.store.open("r+b")
+        try:
+        
+            # The new space is not referred to by the map in the image, so
+            # it can be written directly.
+            for extents, data in writes:
+            
+                for offset, piece in self._pieces(extents, data):
+                
+                    f.seek(offset)
+                    f.write(piece)
+            
+            self.store.sync(f)
+            
+            # The directories and the map are changed in place, so they are
+            # recorded in the journal first. Once the journal is complete,
+            # an interrupted update is finished when the image is opened.
+            self.store.begin(in_place)
+            
+            for offset, data in in_place:
+            
+                f.seek(offset)
+                f.write(data)
+            
+            self.store.sync(f)
+            self.store.end()
+        
+        finally:
+            f.close()
+        
+        self._load()
+    
+    def _pieces(self, extents, data):
+    
+        # Returns a list of (offset, data) pairs for the pieces of data that
+        # are stored in the list of (start, end) extents.
+        pieces = []
+        position = 0
+        
+        for start, end in extents:
+        
+            if position >= len(data):
+                break
+            
+            pieces.append((start, data[position:position + end - start]))
+            position = position + end - start
+        
+        return pieces
+    
+    def _directory_block(self, directory, parent, created):
+    
+        if not created:
+        
+            # Keep the title of an existing directory and increase its
+            # sequence number.
+            sectors = self.disc.sectors
+            start = self.disc.disc_map._read_new_address(directory.addr)[0][0]
+            end = start + new_directory_size
+            title = sectors[end - 35:end - 16]
+            sequence = (struct.unpack("<B", sectors[start:start + 1])[0] + 1) \
+                       & 0xff
+        else:
+            title = directory.raw_name
+            sequence = 0
+        
+        entries = []
+        for obj in directory.files:
+        
+            entries.append((obj.raw_name, obj.load_address,
+                            obj.execution_address, obj.length, obj.addr,
+                            obj.attributes))
+        
+        return new_directory_block(entries, directory.raw_name, parent.addr,
+                                   title, sequence)
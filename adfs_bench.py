@@ -0,0 +1,312 @@
+#! /usr/bin/env python
+
+"""
+adfs_bench.py
+
+Measures the time taken by the ADFS modules to perform common tasks, such as
+starting a new process that imports them or reading the catalogues of images,
+and the time taken to decode the numbers and records stored in images.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import os, struct, subprocess, sys, time, timeit
+from optparse import OptionParser
+
+# The modules whose import times are measured by default. The FUSE utilities
+# are only measured if the bindings they use can be imported.
+import_modules = ["ADFSversion", "ADFSlib", "ADFSnames", "ADFScache",
+                  "ADFSwriter", "ADFSbuilder", "fuse_adfs", "fuse_adfs_ll"]
+
+
+def median(values):
+
+    """Returns the median of the sequence of numbers, values."""
+    
+    values = sorted(values)
+    middle = len(values) // 2
+    
+    if len(values) % 2 == 1:
+        return values[middle]
+    else:
+        return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_times(command, repeats):
+
+    """Runs the Python code in the command string in a new interpreter the
+    given number of times, returning a list of the times taken, in seconds,
+    or None if the code failed. The interpreter searches the directory
+    containing this module for other modules before any others."""
+    
+    environment = os.environ.copy()
+    path = os.path.dirname(os.path.abspath(__file__))
+    
+    if environment.get("PYTHONPATH"):
+        path = path + os.pathsep + environment["PYTHONPATH"]
+    
+    environment["PYTHONPATH"] = path
+    
+    times = []
+    null = open(os.devnull, "w")
+    try:
+    
+        for i in range(repeats):
+        
+            start = time.time()
+            result = subprocess.call([sys.executable, "-c", command],
+                                     stdout = null, stderr = null,
+                                     env = environment)
+            times.append(time.time() - start)
+            
+            if result != 0:
+                return None
+    
+    finally:
+        null.close()
+    
+    return times
+
+
+def bench_imports(modules, repeats = 20):
+
+    """Returns a list of (name, minimum, median) tuples giving the times, in
+    milliseconds, taken to start a new interpreter and import each of the
+    modules in the list given. The first tuple, named "(python)", describes
+    an interpreter that imports nothing, and the times for each module
+    include this time. Modules that cannot be imported are given times of
+    None."""
+    
+    results = []
+    
+    for name, command in [("(python)", "pass")] + \
+        [(module, "import " + module) for module in modules]:
+        
+        times = run_times(command, repeats)
+        
+        if times is None:
+            results.append((name, None, None))
+        else:
+            results.append((name, min(times) * 1000, median(times) * 1000))
+    
+    return results
+
+
+def print_imports(results):
+
+    """Writes the results returned by bench_imports() to the standard output,
+    with the time each import adds to the start of an empty interpreter."""
+    
+    base = results[0][1]
+    print("%-14s %10s %10s %10s" % ("Module", "Min (ms)", "Median", "Import"))
+    
+    for name, minimum, middle in results:
+    
+        if minimum is None:
+            print("%-14s %10s" % (name, "unavailable"))
+        else:
+            print("%-14s %10.2f %10.2f %10.2f" % (name, minimum, middle,
+                                                  minimum - base))
+
+
+def count_objects(objects):
+
+    """Returns the number of files and directories in the list of objects
+    given, including those in any subdirectories."""
+    
+    import ADFSlib
+    
+    count = len(objects)
+    
+    for obj in objects:
+    
+        if isinstance(obj, ADFSlib.ADFSdirectory):
+            count = count + count_objects(obj.files)
+    
+    return count
+
+
+def bench_catalogue(paths, repeats = 20):
+
+    """Returns a list of (path, objects, minimum, median) tuples giving the
+    number of objects in each of the images whose paths are given, and the
+    times, in milliseconds, taken to read their catalogues and the contents
+    of their files in this interpreter."""
+    
+    import ADFSlib
+    
+    results = []
+    
+    for path in paths:
+    
+        times = []
+        
+        for i in range(repeats):
+        
+            f = open(path, "rb")
+            try:
+                start = time.time()
+                disc = ADFSlib.ADFSdisc(f)
+                objects = count_objects(disc.files)
+                times.append(time.time() - start)
+            finally:
+                f.close()
+        
+        results.append((path, objects, min(times) * 1000,
+                        median(times) * 1000))
+    
+    return results
+
+
+def print_catalogue(results):
+
+    """Writes the results returned by bench_catalogue() to the standard
+    output, preceded by the version of the interpreter used."""
+    
+    print("Python %i.%i.%i" % tuple(sys.version_info[:3]))
+    print("%-30s %8s %10s %10s" % ("Image", "Objects", "Min (ms)", "Median"))
+    
+    for path, objects, minimum, middle in results:
+        print("%-30s %8i %10.2f %10.2f" % (os.path.basename(path)[-30:],
+                                           objects, minimum, middle))
+
+
+def decode_data():
+
+    """Returns a string of bytes containing a disc record at offset 4,
+    followed by a directory containing 47 entries at offset 64, for use by
+    bench_decode()."""
+    
+    import ADFSlib
+    
+    record = ADFSlib._disc_record_struct.pack(
+        10, 5, 2, 2, 15, 7, 0, 4, 1504, 0x203, 819200, 0x1234, b"Benchmark ",
+        0, 0)
+    
+    entries = []
+    for i in range(47):
+        entries.append(struct.pack("<10sIIIHBB", b"File%02i\r" % i,
+                                   0xfffffd00, 0x12345678, i * 100,
+                                   (i * 0x41) & 0xffff, 0, 3))
+    
+    return (b"\x00" * 4 + record).ljust(64, b"\x00") + b"\x01Hugo" + \
+        b"".join(entries) + b"\x00"
+
+
+def bench_decode(repeats = 20, number = 2000):
+
+    """Returns a list of (task, minimum, median) tuples giving the times, in
+    microseconds, taken by the methods of ADFSlib that decode numbers and
+    records in images. Each task is performed the given number of times for
+    each of the repeats."""
+    
+    import ADFSlib
+    
+    class Decoder(ADFSlib.ADFSdisc):
+    
+        def __init__(self, sectors):
+            self.sectors = sectors
+    
+    data = decode_data()
+    disc = Decoder(data)
+    end = len(data) - 1
+    
+    tasks = [
+        ("byte", lambda: disc._read_unsigned_byte(data[4:5])),
+        ("half word", lambda: disc._read_unsigned_half_word(data[14:16])),
+        ("word", lambda: disc._read_unsigned_word(data[16:20])),
+        ("3 byte number", lambda: disc._str2num(3, data[17:20])),
+        ("disc record", lambda: disc._read_disc_record(4)),
+        ("47 entries", lambda: disc._read_entries(69, end)),
+        ("zone check", lambda: disc._zone_check(data[:1024]))
+        ]
+    
+    results = []
+    
+    for name, task in tasks:
+    
+        times = timeit.Timer(task).repeat(repeats, number)
+        results.append((name, min(times) * 1000000.0 / number,
+                        median(times) * 1000000.0 / number))
+    
+    return results
+
+
+def print_decode(results):
+
+    """Writes the results returned by bench_decode() to the standard output,
+    preceded by the version of the interpreter used."""
+    
+    print("Python %i.%i.%i" % tuple(sys.version_info[:3]))
+    print("%-14s %10s %10s" % ("Task", "Min (us)", "Median"))
+    
+    for name, minimum, middle in results:
+        print("%-14s %10.3f %10.3f" % (name, minimum, middle))
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] imports [module]...\n"
+             "       %prog [options] catalogue <image>...\n"
+             "       %prog [options] decode\n\n"
+             "Measures the time taken by the ADFS modules to perform common\n"
+             "tasks. The imports command starts a new interpreter for each\n"
+             "module and reports the time taken to import it. The catalogue\n"
+             "command reads each image in this interpreter and reports the\n"
+             "time taken to read its catalogue and files. The decode command\n"
+             "reports the time taken to decode numbers, disc records and\n"
+             "directory entries.\n\n"
+             "Example: %prog --repeats 50 imports ADFSlib fuse_adfs")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-r", "--repeats", type = "int", default = 20,
+                      help = "the number of times each task is performed "
+                             "(default: 20)")
+    
+    options, args = parser.parse_args()
+    
+    if not args or options.repeats < 1:
+        parser.print_help()
+        sys.exit(1)
+    
+    command, args = args[0], args[1:]
+    
+    if command == "imports":
+    
+        print_imports(bench_imports(args or import_modules, options.repeats))
+    
+    elif command == "decode" and not args:
+    
+        print_decode(bench_decode(options.repeats))
+    
+    elif command == "catalogue" and args:
+    
+        import ADFSlib
+        
+        try:
+            print_catalogue(bench_catalogue(args, options.repeats))
+        except (IOError, ADFSlib.ADFS_exception) as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+    
+    else:
+    
+        parser.print_help()
+        sys.exit(1)
+    
+    sys.exit(0)
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+"""
+adfs_build.py
+
+Creates ADFS disc images from directory trees, such as those written by the
+extract_files() method of ADFSlib.ADFSdisc.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from optparse import OptionParser
+
+import ADFSlib
+from ADFSbuilder import ImageBuilder
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] <format> <directory> <image>\n\n"
+             "Creates a disc image of the given format (S, M, L, D, E or F)\n"
+             "containing the files and directories in the directory given.\n"
+             "The load and execution addresses of each file are read from a\n"
+             ".inf file with the same name, followed by ',inf' or '.inf', if\n"
+             "there is one. Otherwise a filetype can be given as a suffix,\n"
+             "as in 'Text,fff', and the file is time stamped with its\n"
+             "modification time. Dots in names are stored as slashes.\n\n"
+             "Example: %prog --title Fixtures E fixtures Fixtures.adf")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-t", "--title", default = "",
+                      help = "the title of the disc")
+    
+    options, args = parser.parse_args()
+    
+    if len(args) != 3:
+        parser.print_help()
+        sys.exit(1)
+    
+    disc_format, tree_path, image_path = args
+    
+    try:
+    
+        builder = ImageBuilder(disc_format.upper(), options.title)
+        builder.add_tree(tree_path)
+        data = builder.build()
+    
+    except (IOError, OSError, ADFSlib.ADFS_exception) as e:
+    
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    
+    f = open(image_path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    
+    sys.exit(0)
@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+
+"""
+adfs_convert.py
+
+Converts ADFS disc images between formats, and between the interleaved and
+sequenced layouts of L format images.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, sys
+from optparse import OptionParser
+
+import ADFSlib
+from ADFSbuilder import ImageBuilder, track_order
+
+# The formats that correspond to the disc types of ADFSdisc instances. Hard
+# discs can be converted to other formats but not written as hard discs.
+disc_formats = {"ads": "S", "adm": "M", "adl": "L", "adD": "D", "adE": "E",
+                "adEbig": "F"}
+
+layouts = {"interleaved": True, "sequenced": False}
+
+
+def copy_tracks(disc, f, interleaved = None, chunk_size = 1048576):
+
+    """Writes the sectors of the ADFSdisc instance, disc, to the file object,
+    f, with the tracks in order or, if interleaved is True, with the tracks
+    of the two sides stored alternately. By default, L format images are
+    written with interleaved tracks."""
+    
+    if interleaved is None:
+        interleaved = disc.disc_type == "adl"
+    
+    sectors = disc.sectors
+    
+    if not interleaved:
+    
+        for i in range(0, len(sectors), chunk_size):
+            f.write(sectors[i:i + chunk_size])
+        
+        return
+    
+    if disc.disc_type != "adl":
+    
+        raise ADFSlib.ADFS_exception(
+            "Only L format images can be interleaved")
+    
+    track_size = disc.nsectors * disc.sector_size
+    
+    for track in track_order(disc.ntracks):
+    
+        f.write(sectors[track * track_size:(track + 1) * track_size])
+
+
+def convert(disc, f, disc_format = None, interleaved = None):
+
+    """Writes an image of the given format containing the catalogue of the
+    ADFSdisc instance, disc, to the file object, f. The format is one of
+    "S", "M", "L", "D", "E" or "F", and the disc's own format is used if it
+    is not given. Images of L format discs have their tracks interleaved
+    unless interleaved is False.
+    
+    If the format is the disc's own format, its sectors are copied to the
+    new image, changing only the order of the tracks. Otherwise, the objects
+    in the catalogue are read from the disc and written to the new image as
+    it is created. An IOError is raised if they do not fit.
+    """
+    
+    source_format = disc_formats.get(disc.disc_type)
+    
+    if disc_format is None:
+    
+        if source_format is None:
+        
+            raise ADFSlib.ADFS_exception(
+                "A format must be given for the new image")
+        
+        disc_format = source_format
+    
+    if disc_format == source_format:
+    
+        copy_tracks(disc, f, interleaved)
+    
+    else:
+    
+        builder = ImageBuilder(disc_format, disc.disc_name, interleaved)
+        builder.files = disc.files
+        builder.write(f)
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] <image> <new image>\n\n"
+             "Writes a copy of an image in another format (S, M, L, D, E or F)\n"
+             "or, for L format images, with another layout, where the tracks\n"
+             "of the two sides of the disc are either interleaved or stored\n"
+             "in sequence. The image is converted without extracting its\n"
+             "files.\n\n"
+             "Example: %prog --format E Disc.adD Disc.adf\n"
+             "         %prog --layout sequenced Disc.adl Sequenced.adl")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-f", "--format", default = None,
+                      help = "the format of the new image (default: the "
+                             "format of the original image)")
+    parser.add_option("-l", "--layout", type = "choice",
+                      choices = list(layouts.keys()), default = None,
+                      help = "the layout of a new L format image: "
+                             "interleaved (the default) or sequenced")
+    parser.add_option("-s", "--source-layout", type = "choice",
+                      choices = list(layouts.keys()), default = None,
+                      help = "the layout of an L format image being "
+                             "converted (default: interleaved)")
+    parser.add_option("-c", "--check", action = "store_true", default = False,
+                      help = "read the new image and check that its files "
+                             "have the same contents as the original")
+    
+    options, args = parser.parse_args()
+    
+    if len(args) != 2:
+        parser.print_help()
+        sys.exit(1)
+    
+    image_path, new_path = args
+    
+    if os.path.exists(new_path) and \
+        os.path.samefile(image_path, new_path):
+        
+        sys.stderr.write("The new image must be written to a different file\n")
+        sys.exit(1)
+    
+    try:
+    
+        disc = ADFSlib.ADFSdisc(open(image_path, "rb"), copy_data = 0,
+                                interleaved = layouts.get(options.source_layout))
+        
+        # The image is written to a temporary file that only replaces the
+        # new image once it is complete, so that a failed conversion does
+        # not leave an empty or partly written image behind.
+        temp_path = new_path + ".new"
+        f = open(temp_path, "wb")
+        try:
+            try:
+                convert(disc, f,
+                        options.format and options.format.upper(),
+                        layouts.get(options.layout))
+            finally:
+                f.close()
+        except:
+            os.remove(temp_path)
+            raise
+        
+        os.rename(temp_path, new_path)
+    
+    except (IOError, ADFSlib.ADFS_exception) as e:
+    
+        sys.stderr.write("%s: %s\n" % (image_path, e))
+        sys.exit(1)
+    
+    if options.check:
+    
+        new_disc = ADFSlib.ADFSdisc(open(new_path, "rb"), copy_data = 0,
+                                    interleaved = layouts.get(options.layout))
+        differences = ADFSlib.compare_images(disc, new_disc)
+        
+        for path in differences:
+            sys.stderr.write("Contents differ: %s\n" % path)
+        
+        if differences:
+            sys.exit(1)
+    
+    sys.exit(0)
@@ -0,0 +1,403 @@
+#! /usr/bin/env python
+
+"""
+adfs_dedup.py
+
+Builds an index of the contents of files found in ADFS disc images and uses
+it to locate identical files in different images.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import binascii, os, sqlite3, sys
+from multiprocessing import Pool
+from optparse import OptionParser
+
+import ADFSlib
+
+
+class ContentIndex:
+
+    """index = ContentIndex(path, algorithm = "sha1")
+    
+    Represents an index, stored in the SQLite database at the specified path,
+    that maps the digests of file contents to the images and paths within
+    images where those contents can be found.
+    
+    Each digest is stored as a string of bytes in the index so that lookups
+    only need to compare a single indexed column.
+    """
+    
+    def __init__(self, path, algorithm = "sha1"):
+    
+        self.algorithm = algorithm
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "    id INTEGER PRIMARY KEY, path TEXT UNIQUE,"
+            "    mtime REAL, size INTEGER, algorithm TEXT);"
+            "CREATE TABLE IF NOT EXISTS contents ("
+            "    digest BLOB, image INTEGER, path TEXT, length INTEGER);"
+            "CREATE INDEX IF NOT EXISTS contents_digest ON contents (digest);"
+            "CREATE INDEX IF NOT EXISTS contents_location "
+            "    ON contents (image, path);"
+            )
+    
+    def close(self):
+    
+        self.db.close()
+    
+    def is_current(self, image_path):
+    
+        """Returns True if the image at image_path has already been indexed
+        with this index's algorithm and has not changed since then."""
+        
+        st = os.stat(image_path)
+        row = self.db.execute(
+            "SELECT mtime, size, algorithm FROM images WHERE path = ?",
+            (os.path.abspath(image_path),)
+            ).fetchone()
+        
+        return row is not None and \
+            row == (st.st_mtime, st.st_size, self.algorithm)
+    
+    def remove_missing(self):
+    
+        """Removes the entries for images that no longer exist and returns
+        the number of images removed."""
+        
+        missing = [path for (path,) in self.db.execute(
+            "SELECT path FROM images") if not os.path.exists(path)]
+        
+        for path in missing:
+        
+            self.remove_image(path)
+        
+        self.db.commit()
+        return len(missing)
+    
+    def add_image(self, image_path, mtime, size, entries):
+    
+        """Records the list of (digest, path, length) entries for the image
+        at image_path, replacing any entries recorded for it previously."""
+        
+        image_path = os.path.abspath(image_path)
+        self.remove_image(image_path)
+        
+        cursor = self.db.execute(
+            "INSERT INTO images (path, mtime, size, algorithm) "
+            "VALUES (?, ?, ?, ?)",
+            (image_path, mtime, size, self.algorithm)
+            )
+        image_id = cursor.lastrowid
+        
+        self.db.executemany(
+            "INSERT INTO contents (digest, image, path, length) "
+            "VALUES (?, ?, ?, ?)",
+            [(sqlite3.Binary(digest), image_id, path, length)
+             for digest, path, length in entries]
+            )
+        self.db.commit()
+    
+    def remove_image(self, image_path):
+    
+        image_path = os.path.abspath(image_path)
+        
+        self.db.execute(
+            "DELETE FROM contents WHERE image IN "
+            "(SELECT id FROM images WHERE path = ?)", (image_path,)
+            )
+        self.db.execute("DELETE FROM images WHERE path = ?", (image_path,))
+    
+    def digest_of(self, image_path, path):
+    
+        """Returns the digest recorded for the file with the given path in
+        the specified image, or None if the file has not been indexed."""
+        
+        row = self.db.execute(
+            "SELECT contents.digest FROM contents, images "
+            "WHERE contents.image = images.id AND images.path = ? "
+            "AND contents.path = ?",
+            (os.path.abspath(image_path), path)
+            ).fetchone()
+        
+        if row is None:
+            return None
+        
+        return bytes(row[0])
+    
+    def locations(self, digest):
+    
+        """Returns a list of (image path, path, length) tuples describing the
+        files in all indexed images that have the digest specified."""
+        
+        return self.db.execute(
+            "SELECT images.path, contents.path, contents.length "
+            "FROM contents, images "
+            "WHERE contents.digest = ? AND contents.image = images.id "
+            "ORDER BY images.path, contents.path",
+            (sqlite3.Binary(digest),)
+            ).fetchall()
+    
+    def first_location(self, digest):
+    
+        """Returns the first (image path, path) tuple, in the order used by
+        locations(), for the files with the digest specified, or None if no
+        file with that digest has been indexed."""
+        
+        return self.db.execute(
+            "SELECT images.path, contents.path FROM contents, images "
+            "WHERE contents.digest = ? AND contents.image = images.id "
+            "ORDER BY images.path, contents.path LIMIT 1",
+            (sqlite3.Binary(digest),)
+            ).fetchone()
+    
+    def seen(self, digest):
+    
+        """Returns True if a file with the given digest has been indexed."""
+        
+        return self.db.execute(
+            "SELECT 1 FROM contents WHERE digest = ? LIMIT 1",
+            (sqlite3.Binary(digest),)
+            ).fetchone() is not None
+    
+    def duplicates(self, min_length = 1):
+    
+        """Returns a list of (digest, count) tuples for each digest that
+        occurs more than once in the index, ignoring files shorter than
+        min_length bytes."""
+        
+        return [(bytes(digest), count) for digest, count in self.db.execute(
+            "SELECT digest, COUNT(*) FROM contents WHERE length >= ? "
+            "GROUP BY digest HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC",
+            (min_length,)
+            )]
+
+
+def hash_image(args):
+
+    """Returns a tuple containing the image path, its modification time and
+    size, and either a list of (digest, path, length) tuples for the files in
+    the image or a string describing why the image could not be read.
+    
+    The arguments are passed as a single (image path, algorithm) tuple so that
+    this function can be used with a multiprocessing pool."""
+    
+    image_path, algorithm = args
+    
+    try:
+    
+        st = os.stat(image_path)
+        image_file = open(image_path, "rb")
+        
+        try:
+        
+            disc = ADFSlib.ADFSdisc(image_file)
+            
+            entries = []
+            for path, obj in disc.walk():
+            
+                if isinstance(obj, ADFSlib.ADFSfile):
+                
+                    entries.append(
+                        (obj.content_hash(algorithm), path, obj.length)
+                        )
+        
+        finally:
+        
+            image_file.close()
+    
+    except Exception as e:
+    
+        # Damaged images can fail in many ways; report them to the caller
+        # rather than stopping the other workers.
+        return image_path, None, None, str(e) or e.__class__.__name__
+    
+    return image_path, st.st_mtime, st.st_size, entries
+
+
+def update_index(index, paths, processes = None):
+
+    """Hashes the files in all images found in the list of paths, using a
+    pool of worker processes, and adds them to the index. Images that are
+    unchanged since they were last indexed are skipped. Images that no longer
+    exist, or that can no longer be read, are removed from the index.
+    
+    Returns a list of (image path, message) tuples for images that could not
+    be read."""
+    
+    index.remove_missing()
+    
+    pending = [(path, index.algorithm)
+               for path in ADFSlib.find_images(paths)
+               if not index.is_current(path)]
+    
+    failed = []
+    
+    if not pending:
+        return failed
+    
+    pool = Pool(processes)
+    
+    try:
+    
+        for image_path, mtime, size, entries in \
+            pool.imap_unordered(hash_image, pending):
+            
+            if mtime is None:
+                index.remove_image(image_path)
+                index.db.commit()
+                failed.append((image_path, entries))
+            else:
+                index.add_image(image_path, mtime, size, entries)
+    
+    finally:
+    
+        pool.close()
+        pool.join()
+    
+    return failed
+
+
+def duplicate_filter(index, image_path):
+
+    """Returns a function for use with ADFSdisc.extract_files that returns
+    True for each file in the image at image_path whose contents are already
+    found in another file. Of the files in the index with the same contents,
+    only those in the first image reported by locations() are extracted,
+    and only the first of those that is found during extraction."""
+    
+    image_path = os.path.abspath(image_path)
+    extracted = set()
+    
+    def skip(obj):
+    
+        digest = obj.content_hash(index.algorithm)
+        first = index.first_location(digest)
+        
+        if first is not None and first[0] != image_path:
+            return True
+        elif digest in extracted:
+            return True
+        
+        extracted.add(digest)
+        return False
+    
+    return skip
+
+
+def print_locations(locations):
+
+    for image_path, path, length in locations:
+    
+        print("%s\t%s\t%X" % (image_path, path, length))
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] index <database> <image or directory>...\n"
+             "       %prog [options] where <database> <image> <path>\n"
+             "       %prog [options] find <database> <digest>\n"
+             "       %prog [options] duplicates <database>\n"
+             "       %prog [options] extract <database> <image> <directory>\n\n"
+             "Indexes the contents of files in ADFS disc images and reports\n"
+             "where identical files can be found. The extract command indexes\n"
+             "an image and extracts its files, skipping those found in other\n"
+             "images if the --skip-duplicates option is given.\n\n"
+             "Example: %prog where index.db Games.adf '$.Loader'")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-a", "--algorithm", default = "sha1",
+                      help = "hashlib algorithm used to hash file contents")
+    parser.add_option("-j", "--jobs", type = "int", default = None,
+                      help = "number of worker processes (default: one per CPU)")
+    parser.add_option("-m", "--min-length", type = "int", default = 1,
+                      help = "ignore files shorter than this when reporting "
+                             "duplicates")
+    parser.add_option("-s", "--skip-duplicates", action = "store_true",
+                      default = False,
+                      help = "when extracting, skip files whose contents are "
+                             "also found earlier in the same image or in an "
+                             "indexed image whose path sorts before it")
+    
+    options, args = parser.parse_args()
+    
+    if len(args) < 2:
+        parser.print_help()
+        sys.exit(1)
+    
+    command, db_path, args = args[0], args[1], args[2:]
+    index = ContentIndex(db_path, options.algorithm)
+    
+    if command == "index" and args:
+    
+        for image_path, message in update_index(index, args, options.jobs):
+        
+            sys.stderr.write("Failed to read %s: %s\n" % (image_path, message))
+    
+    elif command == "where" and len(args) == 2:
+    
+        digest = index.digest_of(args[0], args[1])
+        
+        if digest is None:
+            sys.stderr.write("%s is not in the index.\n" % args[1])
+            sys.exit(1)
+        
+        print_locations(index.locations(digest))
+    
+    elif command == "find" and len(args) == 1:
+    
+        print_locations(index.locations(binascii.unhexlify(args[0])))
+    
+    elif command == "duplicates" and not args:
+    
+        for digest, count in index.duplicates(options.min_length):
+        
+            print("%s\t%i" % (ADFSlib.to_text(binascii.hexlify(digest)),
+                               count))
+    
+    elif command == "extract" and len(args) == 2:
+    
+        image_path, out_path = args
+        
+        for failed_path, message in update_index(index, [image_path],
+                                                 options.jobs):
+        
+            sys.stderr.write("Failed to read %s: %s\n" % (failed_path, message))
+            sys.exit(1)
+        
+        if options.skip_duplicates:
+            skip = duplicate_filter(index, image_path)
+        else:
+            skip = None
+        
+        image_file = open(image_path, "rb")
+        
+        try:
+            disc = ADFSlib.ADFSdisc(image_file)
+            disc.extract_files(out_path, skip = skip)
+        finally:
+            image_file.close()
+    
+    else:
+    
+        parser.print_help()
+        sys.exit(1)
+    
+    index.close()
+    sys.exit(0)
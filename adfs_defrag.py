@@ -0,0 +1,394 @@
+#! /usr/bin/env python
+
+"""
+adfs_defrag.py
+
+Writes a copy of an ADFS disc image with a new format map in which the
+objects are stored without gaps, in catalogue order, each in a single
+fragment where possible.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import errno, os, sys
+from optparse import OptionParser
+
+import ADFSlib, ADFSwriter
+
+# The part of a hard disc image holding the boot block and disc record. This
+# is copied unchanged even if the map describes it as free.
+boot_block = (0xc00, 0xe00)
+
+
+class Defragmenter:
+
+    """defragmenter = Defragmenter(disc)
+    
+    Plans the rearrangement of the objects on the disc described by the
+    ADFSdisc instance, disc, which must use a new format map. The plan is
+    made when the instance is created and the rearranged image is obtained
+    by calling the write() method; the disc itself is not changed.
+    
+    Objects keep their IDs, so their catalogue entries and the directories
+    that contain them are unchanged. The space used by the map, the root
+    directory stored with it, and any defects cannot be moved, so objects
+    are placed in the space around them. Objects are placed in the order in
+    which they occur in the catalogue, with each directory placed before
+    the objects it contains, followed by any objects that are not in the
+    catalogue. An object only occupies more than one fragment if it has to
+    be divided by a zone boundary or by space that cannot be moved. Free
+    space is cleared in the rearranged image.
+    """
+    
+    def __init__(self, disc):
+    
+        disc_map = getattr(disc, "disc_map", None)
+        
+        if not isinstance(disc_map, ADFSlib.ADFSnewMap):
+        
+            raise ADFSlib.ADFS_exception(
+                "Only images with new format maps can be defragmented")
+        
+        self.disc = disc
+        self.disc_map = disc_map
+        self.bytes_per_bit = disc_map.record["bytes per bit"]
+        
+        # Fragments cannot be shorter than an ID and its end bit.
+        self.minimum = disc_map.record["id length"] + 1
+        
+        self.zones, self.pieces = self.plan()
+        self.segments = self._segments()
+    
+    def object_order(self):
+    
+        """Returns a list of the IDs of the objects that can be moved, in the
+        order in which they are placed."""
+        
+        # IDs 1 and 2 are used for defects and for the map and root
+        # directory, and cannot be moved.
+        order = []
+        seen = {0: None, 1: None, 2: None}
+        
+        for path, obj in [("$", self.disc.root)] + list(self.disc.walk()):
+        
+            addr = getattr(obj, "addr", None)
+            
+            if addr is None:
+                continue
+            
+            file_no = addr >> 8
+            
+            if file_no not in seen and file_no in self.disc_map.disc_map:
+                
+                order.append(file_no)
+                seen[file_no] = None
+        
+        # Keep the space allocated to objects that are not in the catalogue,
+        # since they may be recovered later.
+        others = [file_no for file_no in self.disc_map.disc_map.keys()
+                  if file_no not in seen]
+        others.sort()
+        
+        return order + others
+    
+    def plan(self):
+    
+        """Returns a tuple containing a list of fragment lists for each zone
+        of the rearranged map, in the form used by MapEditor, and a dictionary
+        mapping the ID of each object that is moved to a list of (zone, start
+        bit, length in bits) tuples describing its new fragments."""
+        
+        disc_map = self.disc_map
+        
+        # Find the space that can be used for objects in each zone, as a list
+        # of [zone, start bit, end bit] lists in disc order.
+        fixed = []
+        space = []
+        
+        for zone, fragments in enumerate(disc_map.zones):
+        
+            zone_fixed = []
+            start = bit = disc_map.layout[zone][1]
+            
+            for bit, length, owner in fragments:
+            
+                if owner in (1, 2):
+                
+                    if bit > start:
+                        space.append([zone, start, bit])
+                    
+                    zone_fixed.append([bit, length, owner])
+                    start = bit + length
+                
+                bit = bit + length
+            
+            if bit > start:
+                space.append([zone, start, bit])
+            
+            fixed.append(zone_fixed)
+        
+        # Place each object in the space that follows the previous one. As in
+        # MapEditor.allocate(), space that is too small to form a fragment of
+        # its own is given to the object placed before it.
+        pieces = {}
+        i = 0
+        
+        for file_no in self.object_order():
+        
+            needed = sum([end - start for start, end in
+                          disc_map.disc_map[file_no]]) // self.bytes_per_bit
+            placed = pieces[file_no] = []
+            
+            while needed > 0:
+            
+                if i == len(space):
+                
+                    raise IOError(errno.ENOSPC,
+                                  "Not enough space to rearrange the disc")
+                
+                zone, start, end = space[i]
+                size = end - start
+                take = min(size, max(needed, self.minimum))
+                
+                if size - take < self.minimum:
+                    take = size
+                
+                placed.append((zone, start, take))
+                space[i][1] = start + take
+                needed = needed - take
+                
+                if take == size:
+                    i = i + 1
+        
+        # Build the new fragment lists from the fixed fragments, the placed
+        # objects and the remaining space.
+        zones = fixed
+        
+        for file_no, placed in pieces.items():
+        
+            for zone, start, length in placed:
+                zones[zone].append([start, length, file_no])
+        
+        for zone, start, end in space:
+        
+            if end > start:
+                zones[zone].append([start, end - start, None])
+        
+        for fragments in zones:
+            fragments.sort()
+        
+        return zones, pieces
+    
+    def _segments(self):
+    
+        # Returns a list of (destination, length, source) tuples describing
+        # the contents of the rearranged image, sorted by their positions in
+        # it. The source is either the offset in the original image of the
+        # data to be copied, None for space to be cleared, or a string of
+        # bytes.
+        # Other parts of the image are copied without being moved.
+        disc_map = self.disc_map
+        bytes_per_bit = self.bytes_per_bit
+        segments = []
+        
+        for file_no, placed in self.pieces.items():
+        
+            # The fragments of an object are read in the order in which
+            # their zones are searched for them, which can differ from the
+            # order in which they are placed on the disc.
+            order = disc_map.zone_order(file_no)
+            placed = placed[:]
+            placed.sort(key = lambda piece: (order.index(piece[0]), piece[1]))
+            
+            sources = list(disc_map.disc_map[file_no])
+            
+            for zone, start, length in placed:
+            
+                position = disc_map.fragment_address(zone, start)
+                remaining = length * bytes_per_bit
+                
+                while remaining > 0:
+                
+                    if not sources:
+                    
+                        segments.append((position, remaining, None))
+                        break
+                    
+                    begin, end = sources[0]
+                    amount = min(remaining, end - begin)
+                    segments.append((position, amount, begin))
+                    
+                    if amount < end - begin:
+                        sources[0] = (begin + amount, end)
+                    else:
+                        sources.pop(0)
+                    
+                    position = position + amount
+                    remaining = remaining - amount
+        
+        for zone, fragments in enumerate(self.zones):
+        
+            for start, length, owner in fragments:
+            
+                if owner is not None:
+                    continue
+                
+                begin = disc_map.fragment_address(zone, start)
+                end = begin + (length * bytes_per_bit)
+                
+                # Leave the boot block in place.
+                for first, last in ((begin, min(end, boot_block[0])),
+                                    (max(begin, boot_block[1]), end)):
+                    if first < last:
+                        segments.append((first, last - first, None))
+        
+        # Replace both copies of the map.
+        editor = ADFSwriter.MapEditor(disc_map)
+        editor.zones = self.zones
+        new_map = editor.encode()
+        segments.append((self.disc.map_header, 2 * len(new_map),
+                         new_map + new_map))
+        
+        # Segments are ordered by their positions alone, since their sources
+        # have different types.
+        segments.sort(key = lambda segment: segment[:2])
+        return segments
+    
+    def moved(self):
+    
+        """Returns the number of bytes of object data that are moved."""
+        
+        return sum([length for position, length, source in self.segments
+                    if type(source) == int and source != position])
+    
+    def write(self, f, chunk_size = 1048576):
+    
+        """Writes the rearranged image to the file object, f, in a single
+        pass from the start of the image to the end. Data is copied from the
+        original image in pieces of at most chunk_size bytes."""
+        
+        sectors = self.disc.sectors
+        position = 0
+        
+        for destination, length, source in self.segments + \
+            [(len(sectors), 0, None)]:
+            
+            # Copy the parts of the image between the segments unchanged.
+            while position < destination:
+            
+                amount = min(chunk_size, destination - position)
+                f.write(sectors[position:position + amount])
+                position = position + amount
+            
+            if source is None:
+            
+                remaining = length
+                
+                while remaining > 0:
+                
+                    amount = min(chunk_size, remaining)
+                    f.write(b"\x00" * amount)
+                    remaining = remaining - amount
+            
+            elif isinstance(source, bytes):
+            
+                f.write(source)
+            
+            else:
+            
+                end = source + length
+                
+                while source < end:
+                
+                    amount = min(chunk_size, end - source)
+                    f.write(sectors[source:source + amount])
+                    source = source + amount
+            
+            position = destination + length
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] <image> <new image>\n\n"
+             "Writes a copy of an image with a new format map, such as an E, F\n"
+             "or hard disc image, in which the files are stored without gaps\n"
+             "between them, in catalogue order, and are not fragmented unless\n"
+             "they cross a zone boundary or the map. Free space is cleared.\n\n"
+             "Example: %prog Fragmented.adF Compacted.adF")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-n", "--dry-run", action = "store_true",
+                      default = False,
+                      help = "report the changes that would be made without "
+                             "writing a new image")
+    parser.add_option("-c", "--check", action = "store_true", default = False,
+                      help = "read the new image and check that its files "
+                             "have the same contents as the original")
+    
+    options, args = parser.parse_args()
+    
+    if len(args) != 2:
+        parser.print_help()
+        sys.exit(1)
+    
+    image_path, new_path = args
+    
+    if os.path.exists(new_path) and \
+        os.path.samefile(image_path, new_path):
+        
+        sys.stderr.write("The new image must be written to a different file\n")
+        sys.exit(1)
+    
+    try:
+    
+        disc = ADFSlib.ADFSdisc(open(image_path, "rb"), copy_data = 0)
+        defragmenter = Defragmenter(disc)
+    
+    except (IOError, ADFSlib.ADFS_exception) as e:
+    
+        sys.stderr.write("%s: %s\n" % (image_path, e))
+        sys.exit(1)
+    
+    before = ADFSlib.SpaceAnalyser(disc).analyse()
+    print("Fragmentation score before: %.1f" % before["score"])
+    print("Bytes moved: %i" % defragmenter.moved())
+    
+    if options.dry_run:
+        sys.exit(0)
+    
+    f = open(new_path, "wb")
+    try:
+        defragmenter.write(f)
+    finally:
+        f.close()
+    
+    new_disc = ADFSlib.ADFSdisc(open(new_path, "rb"), copy_data = 0)
+    after = ADFSlib.SpaceAnalyser(new_disc).analyse()
+    print("Fragmentation score after: %.1f" % after["score"])
+    
+    if options.check:
+    
+        differences = ADFSlib.compare_images(disc, new_disc)
+        
+        for path in differences:
+            sys.stderr.write("Contents differ: %s\n" % path)
+        
+        if differences:
+            sys.exit(1)
+    
+    sys.exit(0)
@@ -0,0 +1,464 @@
+#! /usr/bin/env python
+
+"""
+adfs_export.py
+
+Writes the contents of an ADFS disc image to a tar or zip archive, reading
+the files from the image as the archive is written.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct, sys, tarfile, time, zipfile, zlib
+from optparse import OptionParser
+
+import ADFSlib
+from ADFSwriter import object_attributes
+
+archive_formats = ("tar", "zip")
+
+# The keywords of the extended headers used to record the RISC OS name, load
+# and execution addresses and attributes of each object in tar archives. The
+# addresses and attributes are written as hexadecimal numbers.
+pax_name = u"RISCOS.name"
+pax_load = u"RISCOS.load"
+pax_exec = u"RISCOS.exec"
+pax_attributes = u"RISCOS.attr"
+
+# The extra field used by RISC OS archivers, such as SparkFS, to hold the load
+# and execution addresses and attributes of each object in zip archives.
+acorn_extra_id = 0x4341
+acorn_extra_signature = b"ARC0"
+
+# Zip archives cannot record times before the start of 1980 or after the end
+# of 2107.
+zip_earliest = (1980, 1, 1, 0, 0, 0)
+zip_latest = (2107, 12, 31, 23, 59, 58)
+
+# The structures written to zip archives. Each file's local header is
+# followed by its data and a data descriptor, so the data can be written as
+# it is read. The general purpose flag used to indicate this is given by
+# zip_descriptor_flag.
+zip_local_header = struct.Struct("<4s5H3I2H")
+zip_data_descriptor = struct.Struct("<4s3I")
+zip_central_header = struct.Struct("<4s6H3I5H2I")
+zip_end_record = struct.Struct("<4s4H2IH")
+zip_descriptor_flag = 0x08
+
+# Version 2.0 of the format is needed for deflate and directories, and the
+# entries are made on Unix so that the Unix modes are used when extracting.
+zip_version = 20
+zip_made_by = (3 << 8) | zip_version
+
+
+class FileReader:
+
+    """reader = FileReader(disc, obj)
+    
+    Provides a file-like object for reading the data of the ADFSfile
+    instance, obj, on the ADFSdisc instance, disc. Only the parts of the
+    image that hold the requested data are read, so files can be copied to
+    an archive without reading each of them into memory in full.
+    """
+    
+    def __init__(self, disc, obj):
+    
+        self.obj = obj
+        self.position = 0
+        
+        # Ask for the file's data to be read in advance if the image was
+        # mapped into memory.
+        disc.advise(obj.image_ranges(0, obj.length))
+    
+    def read(self, size = -1):
+    
+        if size < 0:
+            size = self.obj.length - self.position
+        
+        data = self.obj.read_range(self.position, size)
+        self.position = self.position + len(data)
+        return data
+
+
+class StreamWriter:
+
+    """writer = StreamWriter(f)
+    
+    Wraps the file object, f, keeping count of the bytes written to it so that
+    zip archives can be written to pipes and other files that cannot report
+    their position themselves.
+    """
+    
+    def __init__(self, f):
+    
+        self.f = f
+        self.position = 0
+    
+    def write(self, data):
+    
+        self.f.write(data)
+        self.position = self.position + len(data)
+    
+    def tell(self):
+    
+        return self.position
+    
+    def flush(self):
+    
+        self.f.flush()
+
+
+class ZipStream:
+
+    """archive = ZipStream(f, compression = zipfile.ZIP_STORED,
+                           chunk_size = 65536)
+    
+    Writes a zip archive to the file object, f, which does not need to support
+    seeking. The data of each file is passed to the archive in chunks of
+    chunk_size bytes as it is read, compressed with the deflate method if
+    compression is zipfile.ZIP_DEFLATED, and followed by a data descriptor
+    holding its CRC and sizes. The central directory is written when the
+    archive is closed.
+    """
+    
+    def __init__(self, f, compression = zipfile.ZIP_STORED,
+                 chunk_size = 65536):
+    
+        self.f = StreamWriter(f)
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.entries = []
+    
+    def add(self, name, date_time, extra, external_attr, reader = None):
+    
+        """Adds an entry with the given name, date_time tuple, extra field and
+        external attributes to the archive. If reader is given, the entry's
+        data is read from it until it returns an empty string; otherwise, the
+        entry has no data."""
+        
+        name = ADFSlib.to_bytes(name)
+        year, month, day, hour, minute, second = date_time
+        dos_date = ((year - 1980) << 9) | (month << 5) | day
+        dos_time = (hour << 11) | (minute << 5) | (second // 2)
+        
+        if reader is None:
+            method = zipfile.ZIP_STORED
+        else:
+            method = self.compression
+        
+        offset = self.f.tell()
+        self.f.write(zip_local_header.pack(
+            b"PK\x03\x04", zip_version, zip_descriptor_flag, method,
+            dos_time, dos_date, 0, 0, 0, len(name), len(extra)))
+        self.f.write(name)
+        self.f.write(extra)
+        
+        crc = compressed_size = size = 0
+        
+        if reader is not None:
+        
+            if method == zipfile.ZIP_DEFLATED:
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                              zlib.DEFLATED, -15)
+            else:
+                compressor = None
+            
+            while True:
+            
+                data = reader.read(self.chunk_size)
+                if not data:
+                    break
+                
+                crc = zlib.crc32(data, crc)
+                size = size + len(data)
+                
+                if compressor is not None:
+                    data = compressor.compress(data)
+                
+                self.f.write(data)
+                compressed_size = compressed_size + len(data)
+            
+            if compressor is not None:
+            
+                data = compressor.flush()
+                self.f.write(data)
+                compressed_size = compressed_size + len(data)
+        
+        crc = crc & 0xffffffff
+        self.f.write(zip_data_descriptor.pack(
+            b"PK\x07\x08", crc, compressed_size, size))
+        
+        self.entries.append(
+            (name, extra, external_attr, method, dos_time, dos_date, crc,
+             compressed_size, size, offset))
+    
+    def close(self):
+    
+        """Writes the central directory that describes the entries added to
+        the archive."""
+        
+        start = self.f.tell()
+        
+        for (name, extra, external_attr, method, dos_time, dos_date, crc,
+             compressed_size, size, offset) in self.entries:
+            
+            self.f.write(zip_central_header.pack(
+                b"PK\x01\x02", zip_made_by, zip_version, zip_descriptor_flag,
+                method, dos_time, dos_date, crc, compressed_size, size,
+                len(name), len(extra), 0, 0, 0, external_attr, offset))
+            self.f.write(name)
+            self.f.write(extra)
+        
+        end = self.f.tell()
+        self.f.write(zip_end_record.pack(
+            b"PK\x05\x06", 0, 0, len(self.entries), len(self.entries),
+            end - start, start, 0))
+        self.f.flush()
+
+
+def object_time(obj, default):
+
+    """Returns the time stamp of the ADFSfile or ADFSdirectory instance, obj,
+    as a number of seconds since the Epoch, or the default value given if
+    the object is not time stamped."""
+    
+    load = getattr(obj, "load_address", None)
+    
+    if load is None or load & 0xfff00000 != 0xfff00000:
+        return default
+    
+    return ADFSlib.riscos_time(load, obj.execution_address)
+
+
+def archive_entries(disc, filetypes = 0, separator = ","):
+
+    """Returns a generator that yields an (archive path, object) tuple for
+    each file and directory in the catalogue of the ADFSdisc instance, disc,
+    with each directory yielded before the objects it contains. The archive
+    paths are made from the Unix names of the objects, separated by slashes.
+    
+    If filetypes is set, each file with a filetype is given a suffix made from
+    the separator string and the filetype, as when files are extracted.
+    """
+    
+    names = {"$": ""}
+    
+    for path, obj in disc.walk():
+    
+        parent = path[:path.rfind(".")]
+        name = names[parent] + obj.unix_name
+        
+        if isinstance(obj, ADFSlib.ADFSdirectory):
+        
+            names[path] = name + "/"
+            yield name + "/", obj
+        
+        else:
+        
+            if filetypes and obj.has_filetype():
+                name = name + separator + obj.filetype()
+            
+            yield name, obj
+
+
+def export_tar(disc, f, compress = False, filetypes = 0, separator = ","):
+
+    """Writes a tar archive containing the catalogue of the ADFSdisc instance,
+    disc, to the file object, f, which does not need to support seeking. The
+    archive is compressed with gzip if compress is set.
+    
+    The archive uses the POSIX.1-2001 (pax) format. The RISC OS name, load
+    and execution addresses and attributes of each object are stored in its
+    extended header, using the keywords given by the pax_* constants. Objects
+    that are time stamped are given their time stamps as modification times.
+    The filetypes and separator parameters are passed to archive_entries().
+    """
+    
+    if compress:
+        mode = "w|gz"
+    else:
+        mode = "w|"
+    
+    now = int(time.time())
+    
+    archive = tarfile.open(fileobj = f, mode = mode,
+                           format = tarfile.PAX_FORMAT,
+                           encoding = "iso-8859-1")
+    try:
+    
+        for name, obj in archive_entries(disc, filetypes, separator):
+        
+            info = tarfile.TarInfo(name)
+            info.mtime = max(0, int(object_time(obj, now)))
+            info.pax_headers = {
+                pax_name: ADFSlib.to_bytes(obj.name).decode("iso-8859-1"),
+                pax_attributes: u"%x" % object_attributes(obj)}
+            
+            if hasattr(obj, "load_address"):
+            
+                info.pax_headers[pax_load] = u"%08x" % obj.load_address
+                info.pax_headers[pax_exec] = u"%08x" % obj.execution_address
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+            
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                archive.addfile(info)
+            
+            else:
+            
+                info.size = obj.length
+                info.mode = 0o644
+                archive.addfile(info, FileReader(disc, obj))
+    
+    finally:
+        archive.close()
+
+
+def acorn_extra(obj):
+
+    """Returns the zip extra field describing the load and execution addresses
+    and attributes of the ADFSfile or ADFSdirectory instance, obj."""
+    
+    return struct.pack("<HH4sIIII", acorn_extra_id, 20, acorn_extra_signature,
+                       getattr(obj, "load_address", 0) & 0xffffffff,
+                       getattr(obj, "execution_address", 0) & 0xffffffff,
+                       object_attributes(obj), 0)
+
+
+def export_zip(disc, f, compress = False, filetypes = 0, separator = ","):
+
+    """Writes a zip archive containing the catalogue of the ADFSdisc instance,
+    disc, to the file object, f, which does not need to support seeking. The
+    files are compressed with the deflate method if compress is set.
+    
+    The load and execution addresses and attributes of each object are stored
+    in the extra field used by RISC OS archivers. Objects that are time
+    stamped are given their time stamps as modification times, limited to
+    the range of times that zip archives can record. Each file is
+    read from the image in chunks as it is written to the archive, so files
+    are not held in memory in full. The filetypes and separator parameters
+    are passed to archive_entries().
+    """
+    
+    if compress:
+        compression = zipfile.ZIP_DEFLATED
+    else:
+        compression = zipfile.ZIP_STORED
+    
+    now = time.time()
+    
+    archive = ZipStream(f, compression)
+    try:
+    
+        for name, obj in archive_entries(disc, filetypes, separator):
+        
+            date_time = time.localtime(object_time(obj, now))[:6]
+            date_time = min(max(date_time, zip_earliest), zip_latest)
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+            
+                # Include the MS-DOS directory flag as well as the Unix mode.
+                archive.add(name, date_time, acorn_extra(obj),
+                            (0o40755 << 16) | 0x10)
+            
+            else:
+            
+                archive.add(name, date_time, acorn_extra(obj),
+                            0o100644 << 16, FileReader(disc, obj))
+    
+    finally:
+        archive.close()
+
+
+exporters = {"tar": export_tar, "zip": export_zip}
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] <image> <archive>\n\n"
+             "Writes the files and directories in an image to a tar or zip\n"
+             "archive, reading them from the image as the archive is written.\n"
+             "The archive is written to the standard output if its path is -.\n"
+             "The load and execution addresses and attributes of each object\n"
+             "are recorded in the archive.\n\n"
+             "Example: %prog Disc.adf Disc.zip\n"
+             "         %prog --compress Disc.adf - | ssh host 'tar xzf -'")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-f", "--format", type = "choice",
+                      choices = archive_formats, default = None,
+                      help = "the archive format: tar or zip (default: zip for "
+                             "archives with names ending in .zip, tar otherwise)")
+    parser.add_option("-z", "--compress", action = "store_true",
+                      default = False,
+                      help = "compress tar archives with gzip and the files "
+                             "in zip archives with deflate")
+    parser.add_option("-t", "--filetypes", action = "store_true",
+                      default = False,
+                      help = "add filetype suffixes to the names of files "
+                             "with filetypes")
+    parser.add_option("-s", "--separator", default = ",",
+                      help = "the separator used before filetype suffixes "
+                             "(default: ,)")
+    
+    options, args = parser.parse_args()
+    
+    if len(args) != 2:
+        parser.print_help()
+        sys.exit(1)
+    
+    image_path, archive_path = args
+    archive_format = options.format
+    
+    if archive_format is None:
+    
+        if archive_path.lower().endswith(".zip"):
+            archive_format = "zip"
+        else:
+            archive_format = "tar"
+    
+    try:
+    
+        disc = ADFSlib.ADFSdisc(open(image_path, "rb"), copy_data = 0,
+                                use_mmap = 1)
+    
+    except (IOError, ADFSlib.ADFS_exception) as e:
+    
+        sys.stderr.write("%s: %s\n" % (image_path, e))
+        sys.exit(1)
+    
+    if archive_path == "-":
+        # With Python 3, bytes are written to the standard output's buffer.
+        f = getattr(sys.stdout, "buffer", sys.stdout)
+    else:
+        f = open(archive_path, "wb")
+    
+    try:
+    
+        try:
+            exporters[archive_format](disc, f, options.compress,
+                                      options.filetypes, options.separator)
+        finally:
+            if archive_path != "-":
+                f.close()
+    
+    except IOError as e:
+    
+        sys.stderr.write("%s: %s\n" % (archive_path, e))
+        sys.exit(1)
+    
+    sys.exit(0)
@@ -0,0 +1,364 @@
+#! /usr/bin/env python
+
+"""
+adfs_index.py
+
+Builds a searchable catalogue of the files and directories in a collection of
+ADFS disc images and answers queries about them without reading the images.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import os, sqlite3, sys, time
+from multiprocessing import Pool
+from optparse import OptionParser
+
+import ADFSlib
+
+
+class CatalogueIndex:
+
+    """index = CatalogueIndex(path)
+    
+    Represents a catalogue of the objects in many disc images, stored in the
+    SQLite database at the specified path.
+    
+    Each entry records the image containing an object, the object's path
+    and name, whether it is a directory and, for files, the filetype, load
+    and execution addresses, length and time stamp.
+    """
+    
+    def __init__(self, path):
+    
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "    id INTEGER PRIMARY KEY, path TEXT UNIQUE,"
+            "    mtime REAL, size INTEGER, disc_type TEXT, disc_name TEXT);"
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "    image INTEGER, path TEXT, name TEXT COLLATE NOCASE,"
+            "    directory INTEGER, filetype INTEGER, load INTEGER,"
+            "    exec INTEGER, length INTEGER, time_stamp REAL);"
+            "CREATE INDEX IF NOT EXISTS entries_name ON entries (name);"
+            "CREATE INDEX IF NOT EXISTS entries_filetype "
+            "    ON entries (filetype);"
+            "CREATE INDEX IF NOT EXISTS entries_image ON entries (image);"
+            )
+    
+    def close(self):
+    
+        self.db.close()
+    
+    def stale_images(self, image_paths):
+    
+        """Returns the paths in the list supplied that refer to images that
+        have not been indexed or have changed size or modification time
+        since they were indexed."""
+        
+        known = dict(
+            (path, (mtime, size)) for path, mtime, size in
+            self.db.execute("SELECT path, mtime, size FROM images")
+            )
+        
+        stale = []
+        
+        for image_path in image_paths:
+        
+            st = os.stat(image_path)
+            
+            if known.get(os.path.abspath(image_path)) != \
+                (st.st_mtime, st.st_size):
+                
+                stale.append(image_path)
+        
+        return stale
+    
+    def remove_missing(self):
+    
+        """Removes the entries for images that no longer exist and returns
+        the number of images removed."""
+        
+        missing = [path for (path,) in self.db.execute(
+            "SELECT path FROM images") if not os.path.exists(path)]
+        
+        for path in missing:
+        
+            self.remove_image(path)
+        
+        self.db.commit()
+        return len(missing)
+    
+    def add_image(self, image_path, mtime, size, disc_type, disc_name,
+                  entries):
+        
+        """Records the list of entries for the image at image_path, replacing
+        any entries recorded for it previously. Each entry is a tuple of the
+        form returned by read_image()."""
+        
+        image_path = os.path.abspath(image_path)
+        self.remove_image(image_path)
+        
+        cursor = self.db.execute(
+            "INSERT INTO images (path, mtime, size, disc_type, disc_name) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (image_path, mtime, size, disc_type, disc_name)
+            )
+        image_id = cursor.lastrowid
+        
+        self.db.executemany(
+            "INSERT INTO entries (image, path, name, directory, filetype, "
+            "load, exec, length, time_stamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(image_id,) + entry for entry in entries]
+            )
+        self.db.commit()
+    
+    def remove_image(self, image_path):
+    
+        image_path = os.path.abspath(image_path)
+        
+        self.db.execute(
+            "DELETE FROM entries WHERE image IN "
+            "(SELECT id FROM images WHERE path = ?)", (image_path,)
+            )
+        self.db.execute("DELETE FROM images WHERE path = ?", (image_path,))
+    
+    def query(self, prefix = None, pattern = None, filetype = None,
+              directories = False):
+        
+        """Returns a list of (image path, path, directory, filetype, load,
+        exec, length, time stamp) tuples for the indexed objects that match
+        all the criteria given.
+        
+        The prefix is compared with the start of each object's name and the
+        glob-style pattern is compared with each object's full path. Both
+        comparisons ignore case, as RISC OS does. If filetype is not None,
+        only files with that filetype are returned. Directories are only
+        returned if directories is True."""
+        
+        conditions = []
+        values = []
+        
+        if prefix:
+        
+            # Escape the characters that LIKE treats specially so that the
+            # prefix is matched literally.
+            for c in "\\%_":
+                prefix = prefix.replace(c, "\\" + c)
+            
+            conditions.append("entries.name LIKE ? ESCAPE '\\'")
+            values.append(prefix + "%")
+        
+        if pattern:
+        
+            conditions.append("lower(entries.path) GLOB ?")
+            values.append(pattern.lower())
+        
+        if filetype is not None:
+        
+            conditions.append("entries.filetype = ?")
+            values.append(filetype)
+        
+        if not directories:
+        
+            conditions.append("entries.directory = 0")
+        
+        sql = ("SELECT images.path, entries.path, entries.directory, "
+               "entries.filetype, entries.load, entries.exec, "
+               "entries.length, entries.time_stamp "
+               "FROM entries, images WHERE entries.image = images.id")
+        
+        for condition in conditions:
+        
+            sql = sql + " AND " + condition
+        
+        return self.db.execute(
+            sql + " ORDER BY images.path, entries.path", values
+            ).fetchall()
+
+
+def read_image(image_path):
+
+    """Returns a tuple containing the image path, its modification time,
+    size, disc type and disc name, and a list of entries describing the
+    objects in the image.
+    
+    Each entry is a tuple containing the object's path, name, a directory
+    flag, and the filetype, load and execution addresses, length and time
+    stamp, with None used for the values that do not apply to the object.
+    
+    If the image cannot be read, the modification time is None and the
+    last item in the tuple is a string describing the problem."""
+    
+    try:
+    
+        st = os.stat(image_path)
+        disc = ADFSlib.ADFSdisc(open(image_path, "rb"))
+        
+        entries = []
+        for path, obj in disc.walk():
+        
+            if isinstance(obj, ADFSlib.ADFSfile):
+            
+                if obj.has_filetype():
+                    filetype = (obj.load_address >> 8) & 0xfff
+                    time_stamp = obj.seconds()
+                else:
+                    filetype = time_stamp = None
+                
+                entries.append(
+                    (path, obj.name, 0, filetype, obj.load_address,
+                     obj.execution_address, obj.length, time_stamp)
+                    )
+            else:
+            
+                entries.append(
+                    (path, obj.name, 1, None, None, None, None, None)
+                    )
+    
+    except Exception as e:
+    
+        return image_path, None, None, None, None, \
+               str(e) or e.__class__.__name__
+    
+    return image_path, st.st_mtime, st.st_size, disc.disc_type, \
+           disc.disc_name, entries
+
+
+def update_index(index, paths, processes = None):
+
+    """Reads the catalogues of the images found in the list of paths that
+    have changed since they were last indexed, using a pool of worker
+    processes, and records them in the index. Images that no longer exist,
+    or that can no longer be read, are removed from the index.
+    
+    Returns a list of (image path, message) tuples for images that could not
+    be read."""
+    
+    index.remove_missing()
+    
+    stale = index.stale_images(ADFSlib.find_images(paths))
+    failed = []
+    
+    if not stale:
+        return failed
+    
+    pool = Pool(processes)
+    
+    try:
+    
+        for image_path, mtime, size, disc_type, disc_name, entries in \
+            pool.imap_unordered(read_image, stale):
+            
+            if mtime is None:
+                index.remove_image(image_path)
+                index.db.commit()
+                failed.append((image_path, entries))
+            else:
+                index.add_image(image_path, mtime, size, disc_type,
+                                disc_name, entries)
+    
+    finally:
+    
+        pool.close()
+        pool.join()
+    
+    return failed
+
+
+def print_results(results):
+
+    for image_path, path, directory, filetype, load, exec_, length, \
+        time_stamp in results:
+        
+        if directory:
+        
+            print("%s\t%s\t(directory)" % (image_path, path))
+        
+        elif filetype is None:
+        
+            print(("%s\t%s\t%X\t%X\t%X" % (
+                image_path, path, load, exec_, length)).expandtabs(16))
+        else:
+        
+            print(("%s\t%s\t%03X\t%s\t%X" % (
+                image_path, path, filetype,
+                time.strftime("%H:%M:%S, %a %d %b %Y",
+                              time.localtime(time_stamp)),
+                length)).expandtabs(16))
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] build <database> <image or directory>...\n"
+             "       %prog [options] query <database>\n\n"
+             "Records the catalogues of ADFS disc images in a database and\n"
+             "searches them. Only images that have changed since the last\n"
+             "build are read again.\n\n"
+             "Example: %prog query index.db --prefix '!Run' --filetype feb")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-j", "--jobs", type = "int", default = None,
+                      help = "number of worker processes (default: one per CPU)")
+    parser.add_option("-p", "--prefix", default = None,
+                      help = "match objects whose names begin with PREFIX")
+    parser.add_option("-g", "--glob", default = None,
+                      help = "match objects whose paths match the pattern, "
+                             "such as '$.Games.*'")
+    parser.add_option("-t", "--filetype", default = None,
+                      help = "match files with the hexadecimal FILETYPE")
+    parser.add_option("-d", "--directories", action = "store_true",
+                      default = False,
+                      help = "include directories in the results")
+    
+    options, args = parser.parse_args()
+    
+    if len(args) < 2:
+        parser.print_help()
+        sys.exit(1)
+    
+    command, db_path, args = args[0], args[1], args[2:]
+    index = CatalogueIndex(db_path)
+    
+    if command == "build" and args:
+    
+        for image_path, message in update_index(index, args, options.jobs):
+        
+            sys.stderr.write("Failed to read %s: %s\n" % (image_path, message))
+    
+    elif command == "query" and not args:
+    
+        if options.filetype is not None:
+        
+            try:
+                filetype = int(options.filetype, 16)
+            except ValueError:
+                parser.error("Invalid filetype: %s" % options.filetype)
+        else:
+            filetype = None
+        
+        print_results(index.query(options.prefix, options.glob, filetype,
+                                  options.directories))
+    
+    else:
+    
+        parser.print_help()
+        sys.exit(1)
+    
+    index.close()
+    sys.exit(0)
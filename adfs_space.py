@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+"""
+adfs_space.py
+
+Reports the free space and fragmentation of new format ADFS disc images,
+using the information in their maps.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import json, sys
+from multiprocessing import Pool
+from optparse import OptionParser
+
+import ADFSlib
+
+
+def analyse_image(image_path):
+
+    """Returns a tuple containing the image path, the dictionary returned by
+    SpaceAnalyser.analyse() for the image and an empty string. If the image
+    cannot be analysed, None and a message are returned instead of the
+    dictionary and empty string."""
+    
+    try:
+    
+        disc = ADFSlib.ADFSdisc(open(image_path, "rb"), copy_data = 0)
+        return image_path, ADFSlib.SpaceAnalyser(disc).analyse(), ""
+    
+    except Exception as e:
+    
+        return image_path, None, str(e) or e.__class__.__name__
+
+
+def analyse_images(paths, processes = None):
+
+    """Returns a generator that yields the tuples returned by analyse_image()
+    for the images found in the list of paths, using a pool of worker
+    processes. Results are yielded as they become available, not necessarily
+    in the order of the paths."""
+    
+    pool = Pool(processes)
+    
+    try:
+    
+        for result in pool.imap_unordered(analyse_image,
+                                          ADFSlib.find_images(paths)):
+        
+            yield result
+    
+    finally:
+    
+        pool.close()
+        pool.join()
+
+
+def format_analysis(image_path, analysis, zones = False, files = False):
+
+    """Returns a list of lines describing the analysis of the image. The first
+    line contains the fields of the summary, separated by tabs, and is
+    followed by lines for each zone and for each fragmented file if
+    requested."""
+    
+    lines = ["\t".join([
+        image_path, "%.1f" % analysis["score"],
+        str(analysis["free space"]), str(analysis["largest free"]),
+        str(len(analysis["free extents"])),
+        "%i/%i" % (analysis["fragmented objects"], analysis["objects"])
+        ])]
+    
+    if zones:
+    
+        for zone, (used, free, size) in enumerate(analysis["zones"]):
+        
+            lines.append("\t".join([
+                image_path, "zone", str(zone), str(used), str(free),
+                "%.1f%%" % (100.0 * used / max(1, size))
+                ]))
+    
+    if files:
+    
+        for path, count, size in analysis["files"]:
+        
+            if count > 1:
+                lines.append("\t".join([image_path, "file", path, str(count),
+                                        str(size)]))
+    
+    return lines
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] <image or directory>...\n\n"
+             "Reports the free space and fragmentation of new format ADFS disc\n"
+             "images. For each image, a line is written containing the image\n"
+             "path, fragmentation score, free space in bytes, largest free\n"
+             "extent in bytes, number of free extents and the number of\n"
+             "fragmented objects out of all objects, separated by tabs.\n\n"
+             "The score is a percentage: 0 for an image without fragmented\n"
+             "objects or free space, rising as either becomes fragmented.\n\n"
+             "Example: %prog --sort Archive | head")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-j", "--jobs", type = "int", default = None,
+                      help = "number of worker processes (default: one per CPU)")
+    parser.add_option("--json", action = "store_true", default = False,
+                      help = "write the analysis of each image as a JSON object")
+    parser.add_option("-s", "--sort", action = "store_true", default = False,
+                      help = "list the images with the highest scores first")
+    parser.add_option("-z", "--zones", action = "store_true", default = False,
+                      help = "list the used and free space in each map zone")
+    parser.add_option("-f", "--files", action = "store_true", default = False,
+                      help = "list the files that are fragmented")
+    
+    options, args = parser.parse_args()
+    
+    if not args:
+        parser.print_help()
+        sys.exit(1)
+    
+    results = analyse_images(args, options.jobs)
+    
+    if options.sort:
+        results = sorted(results, key = lambda result: (
+                         result[1] is None, result[1] and -result[1]["score"]))
+    
+    failed = 0
+    
+    for image_path, analysis, message in results:
+    
+        if analysis is None:
+        
+            sys.stderr.write("%s: %s\n" % (image_path, message))
+            failed = failed + 1
+        
+        elif options.json:
+        
+            analysis["image"] = image_path
+            print(json.dumps(analysis, sort_keys = True))
+        
+        else:
+        
+            for line in format_analysis(image_path, analysis, options.zones,
+                                        options.files):
+                print(line)
+    
+    if failed:
+        sys.exit(1)
+    
+    sys.exit(0)
@@ -0,0 +1,566 @@
+#! /usr/bin/env python
+
+"""
+adfs_verify.py
+
+Checks the structure of ADFS disc images and reports any problems found,
+with an error code and the offset on the disc of each problem.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import json, struct, sys
+from multiprocessing import Pool
+from optparse import OptionParser
+
+import ADFSlib, ADFSwriter
+from ADFSlib import INFORM, WARNING, ERROR
+
+
+level_names = {INFORM: "info", WARNING: "warning", ERROR: "error"}
+
+# The problems that can be reported, with their levels and descriptions.
+codes = {
+    "IMG001": (ERROR, "The image could not be read"),
+    "MAP001": (ERROR, "Zone check byte is incorrect"),
+    "MAP002": (ERROR, "Cross check of the map zones is incorrect"),
+    "MAP003": (WARNING, "The copies of the map differ"),
+    "MAP004": (WARNING, "Free space map check byte is incorrect"),
+    "MAP010": (ERROR, "Free space overlaps an object"),
+    "MAP011": (ERROR, "Free space entries overlap"),
+    "MAP012": (ERROR, "Free space extends beyond the end of the disc"),
+    "MAP020": (WARNING, "Fragment is not used by any object"),
+    "MAP021": (WARNING, "Space is neither free nor used by any object"),
+    "DIR001": (ERROR, "Directory marker not found"),
+    "DIR002": (ERROR, "Directory sequence numbers differ"),
+    "DIR003": (WARNING, "Directory check byte is incorrect"),
+    "OBJ001": (ERROR, "Objects overlap"),
+    "OBJ002": (ERROR, "Object is longer than the space allocated to it"),
+    "OBJ003": (ERROR, "Object not found in the map"),
+    }
+
+# Space on old format discs is allocated in 256 byte units.
+old_map_unit = 256
+
+
+class Verifier:
+
+    """verifier = Verifier(disc)
+    
+    Checks the catalogue and map of the ADFSdisc instance, disc. Call the
+    check() method to obtain a list of the problems found.
+    
+    Each problem is described by a (code, offset, detail) tuple, where the
+    code is one of those in the codes dictionary, the offset is the position
+    of the problem from the start of the disc, or None if the problem has no
+    single position, and the detail is a string describing the problem. For
+    interleaved images, offsets on the disc differ from those in the image
+    file.
+    """
+    
+    def __init__(self, disc):
+    
+        self.disc = disc
+        self.new_map = isinstance(getattr(disc, "disc_map", None),
+                                  ADFSlib.ADFSnewMap)
+        self.problems = []
+    
+    def report(self, code, offset, detail):
+    
+        self.problems.append((code, offset, detail))
+    
+    def check(self):
+    
+        """Checks the disc and returns a list of the problems found, sorted
+        by their offsets."""
+        
+        self.problems = []
+        
+        objects = self.check_directories()
+        
+        if self.new_map:
+            self.check_new_map(objects)
+        else:
+            self.check_old_map(objects)
+        
+        self.problems.sort(key = lambda problem: (problem[1] is not None,
+                                                  problem[1]))
+        return self.problems
+    
+    def check_directories(self):
+    
+        """Checks each directory on the disc and returns a list of (path,
+        object) tuples for the objects found, including the root directory."""
+        
+        disc = self.disc
+        objects = [("$", disc.root)]
+        self.check_directory("$", disc.root)
+        
+        for path, obj in disc.walk():
+        
+            objects.append((path, obj))
+            
+            if isinstance(obj, ADFSlib.ADFSdirectory):
+                self.check_directory(path, obj)
+        
+        return objects
+    
+    def check_directory(self, path, directory):
+    
+        if not directory.extents:
+            return
+        
+        sectors = self.disc.sectors
+        head = directory.extents[0][0]
+        
+        if sectors[head + 4:head + 8] == b"SBPr":
+            self.check_big_directory(path, directory)
+            return
+        
+        if self.new_map:
+            size = ADFSwriter.new_directory_size
+        else:
+            size = self.disc._old_directory_size()
+        
+        block = sectors[head:head + size]
+        
+        if len(block) < size or block[1:5] not in self.disc.dir_markers:
+        
+            self.report("DIR001", head, "%s: no directory at the start" % path)
+            return
+        
+        if block[-5:-1] not in self.disc.dir_markers:
+        
+            self.report("DIR001", head + size - 5,
+                        "%s: no directory marker at the end" % path)
+            return
+        
+        # The items of a bytearray are numbers with both Python 2 and 3.
+        values = bytearray(block)
+        
+        if values[0] != values[-6]:
+        
+            self.report("DIR002", head + size - 6,
+                        "%s: sequence numbers %i and %i" % (
+                        path, values[0], values[-6]))
+        
+        entries = self.disc._read_entries(head + 5, head + size)
+        
+        if block[1:5] == b"Nick":
+        
+            last = 5 + (len(entries) * ADFSlib._entry_size)
+            check = ADFSwriter.directory_check_byte(block, last)
+            
+            if check != values[-1]:
+            
+                self.report("DIR003", head + size - 1,
+                            "%s: check byte %02x should be %02x" % (
+                            path, values[-1], check))
+        
+        if self.new_map:
+            self.check_entries(path, entries)
+    
+    def check_big_directory(self, path, directory):
+    
+        sectors = self.disc.sectors
+        head = directory.extents[0][0]
+        
+        (sequence, marker, name_length, size, entries, names_size,
+         parent) = ADFSlib._big_header_struct.unpack_from(sectors, head)
+        
+        block = b"".join([sectors[start:end]
+                          for start, end in directory.extents])[:size]
+        
+        if len(block) < size or block[size - 8:size - 4] != b"oven":
+        
+            self.report("DIR001", head, "%s: no big directory marker at the "
+                        "end" % path)
+            return
+        
+        tail_sequence = bytearray(block)[size - 4]
+        
+        if tail_sequence != sequence:
+        
+            self.report("DIR002", head + size - 4,
+                        "%s: sequence numbers %i and %i" % (
+                        path, sequence, tail_sequence))
+        
+        # Check that the objects in the directory can be found.
+        first = ADFSlib._big_header_struct.size + ((name_length + 3) & ~3)
+        values = struct.unpack_from(
+            "<" + (ADFSlib._big_entry_format * entries), block, first
+            )
+        
+        catalogue = []
+        
+        for i in range(0, len(values), 7):
+        
+            # Only the low byte of the attribute word holds attributes, as
+            # when the catalogue is read by ADFSlib.
+            load, exe, length, address, atts = values[i:i + 5]
+            catalogue.append((head + first + (i * 4), "", load, exe, length,
+                              address, atts & 0xff))
+        
+        self.check_entries(path, catalogue)
+    
+    def check_entries(self, path, entries):
+    
+        # Reports the entries of a directory on a new format disc that refer
+        # to objects that cannot be found in the map.
+        disc_map = self.disc.disc_map
+        
+        for offset, name, load, exe, length, address, atts in entries:
+        
+            if (atts & 0x8 or length != 0) and \
+                disc_map._read_new_address(address) == -1:
+                
+                self.report("OBJ003", offset, "%s.%s: SIN %x" % (
+                            path, self.disc._safe(name), address))
+    
+    def used_ranges(self, obj):
+    
+        """Returns a list of (start, end) offsets of the space on the disc
+        occupied by the object, obj, and the total length of the space
+        allocated to it."""
+        
+        extents = obj.extents
+        allocated = sum([max(end - start, 0) for start, end in extents])
+        
+        if isinstance(obj, ADFSlib.ADFSdirectory):
+        
+            if not extents:
+                return [], 0
+            
+            length = getattr(obj, "length", extents[0][1] - extents[0][0])
+            
+            if obj is self.disc.root and self.new_map:
+            
+                # The length of the root directory is not recorded in a
+                # catalogue entry.
+                length = ADFSwriter.new_directory_size
+                sectors = self.disc.sectors
+                head = extents[0][0]
+                
+                if sectors[head + 4:head + 8] == b"SBPr":
+                    length = ADFSlib._big_header_struct.unpack_from(
+                        sectors, head)[3]
+            
+            file_obj = ADFSlib.ADFSfile("", None, 0, 0, length, extents)
+            return file_obj.image_ranges(0, length), allocated
+        
+        return obj.image_ranges(0, obj.length), allocated
+    
+    def check_objects(self, objects, extra = ()):
+    
+        """Checks that the objects fit in the space allocated to them and do
+        not overlap each other or the labelled (start, end, label) ranges in
+        extra. Returns a list of (start, end, label) ranges used, including
+        those in extra."""
+        
+        used = list(extra)
+        disc_size = len(self.disc.sectors)
+        
+        for path, obj in objects:
+        
+            ranges, allocated = self.used_ranges(obj)
+            length = getattr(obj, "length", 0)
+            
+            if obj.extents and allocated < length:
+            
+                self.report("OBJ002", obj.extents[0][0],
+                            "%s: %i bytes in %i bytes of space" % (
+                            path, length, allocated))
+            
+            for start, end in ranges:
+            
+                if end > disc_size:
+                
+                    self.report("OBJ002", start, "%s: extends beyond the end "
+                                "of the disc" % path)
+                
+                used.append((start, end, path))
+        
+        self.check_overlaps(used)
+        return used
+    
+    def check_overlaps(self, ranges):
+    
+        # Reports overlapping ranges, comparing each range with the ones that
+        # start before it and have not yet ended.
+        ranges = sorted(ranges)
+        active = []
+        
+        for start, end, label in ranges:
+        
+            active = [item for item in active if item[1] > start]
+            
+            for other_start, other_end, other in active:
+            
+                if other != label:
+                    self.report_overlap(start, min(end, other_end), other,
+                                        label)
+            
+            active.append((start, end, label))
+    
+    def report_overlap(self, start, end, first, second):
+    
+        free = [label for label in (first, second) if type(label) == tuple]
+        
+        if len(free) == 2:
+            self.report("MAP011", start, "free space at %x and %x" % (
+                        first[1], second[1]))
+        elif free:
+            self.report("MAP010", start, "%s and free space (%i bytes)" % (
+                        [label for label in (first, second)
+                         if type(label) != tuple][0], end - start))
+        else:
+            self.report("OBJ001", start, "%s and %s (%i bytes)" % (
+                        first, second, end - start))
+    
+    def check_new_map(self, objects):
+    
+        disc_map = self.disc.disc_map
+        sectors = self.disc.sectors
+        sector_size = disc_map.sector_size
+        zones = len(disc_map.layout)
+        
+        # Check each zone of the map, the cross check over all zones and
+        # the second copy of the map.
+        cross_check = 0
+        
+        for zone in range(zones):
+        
+            offset = disc_map.header + (zone * sector_size)
+            data = sectors[offset:offset + sector_size]
+            check = disc_map._zone_check(data)
+            values = bytearray(data[:4])
+            
+            if check != values[0]:
+            
+                self.report("MAP001", offset, "zone %i: %02x should be %02x" % (
+                            zone, values[0], check))
+            
+            cross_check = cross_check ^ values[3]
+        
+        if cross_check != 0xff:
+        
+            self.report("MAP002", disc_map.header + 3, "%02x" % cross_check)
+        
+        length = zones * sector_size
+        
+        if sectors[disc_map.header:disc_map.header + length] != \
+            sectors[disc_map.header + length:disc_map.header + (2 * length)]:
+            
+            self.report("MAP003", disc_map.header + length, "")
+        
+        self.check_objects(objects)
+        
+        # Report fragments that belong to objects not referred to by the
+        # catalogue. IDs 1 and 2 are used for defects and for the map and
+        # root directory.
+        referenced = {1: None, 2: None}
+        
+        for path, obj in objects:
+        
+            if getattr(obj, "addr", None) is not None:
+                referenced[obj.addr >> 8] = None
+        
+        for file_no, extents in disc_map.disc_map.items():
+        
+            if file_no not in referenced:
+            
+                self.report("MAP020", extents[0][0], "ID %x (%i bytes)" % (
+                            file_no, sum([end - start
+                                          for start, end in extents])))
+    
+    def check_old_map(self, objects):
+    
+        sectors = self.disc.sectors
+        
+        # Check the check bytes of the two sectors of the free space map.
+        for offset in (0, 0x100):
+        
+            check = ADFSlib.old_map_check(sectors[offset:offset + 0xff])
+            stored = bytearray(sectors[offset + 0xff:offset + 0x100])[0]
+            
+            if check != stored:
+            
+                self.report("MAP004", offset + 0xff, "%02x should be %02x" % (
+                            stored, check))
+        
+        # The free space map and the root directory occupy the start of the
+        # disc. Objects occupy whole allocation units.
+        root = self.disc.root.extents[0]
+        extra = [(0, root[0], "map")]
+        free = []
+        disc_size = len(sectors)
+        
+        for start, end in read_old_free_space(sectors):
+        
+            if end > disc_size:
+                self.report("MAP012", start, "%i bytes" % (end - start))
+            
+            free.append((start, end, ("free", start)))
+        
+        used = self.check_objects(objects, extra + free)
+        
+        # Report space that is neither free nor used.
+        position = 0
+        
+        for start, end, label in sorted(used):
+        
+            if type(label) != tuple:
+                end = round_up(end, old_map_unit)
+            
+            if start > position:
+                self.report("MAP021", position, "%i bytes" % (start - position))
+            
+            position = max(position, end)
+        
+        if position < disc_size:
+            self.report("MAP021", position, "%i bytes" % (disc_size - position))
+
+
+def round_up(value, unit):
+
+    return (value + unit - 1) & ~(unit - 1)
+
+
+def read_old_free_space(sectors):
+
+    """Returns a list of (start, end) offsets of the free space described by
+    the old format free space map at the start of the string, sectors. The
+    start addresses are stored in the first sector of the map and the lengths
+    in the second, both in 256 byte units."""
+    
+    entries = min(bytearray(sectors[0x1fe:0x1ff])[0] // 3, 82)
+    free = []
+    
+    for i in range(0, entries * 3, 3):
+    
+        start = struct.unpack("<I", sectors[i:i + 3] + b"\x00")[0]
+        length = struct.unpack("<I", sectors[0x100 + i:0x103 + i] + b"\x00")[0]
+        free.append((start * old_map_unit, (start + length) * old_map_unit))
+    
+    return free
+
+
+def verify_image(image_path):
+
+    """Returns a tuple containing the image path and a list of (code, offset,
+    detail) tuples describing the problems found in the image."""
+    
+    try:
+    
+        disc = ADFSlib.ADFSdisc(open(image_path, "rb"), copy_data = 0)
+        return image_path, Verifier(disc).check()
+    
+    except Exception as e:
+    
+        # Damaged images can fail in many ways; report them as problems
+        # rather than stopping the other workers.
+        return image_path, [("IMG001", None, str(e) or e.__class__.__name__)]
+
+
+def verify_images(paths, processes = None):
+
+    """Returns a generator that yields the (image path, problems) tuples
+    returned by verify_image() for the images found in the list of paths,
+    using a pool of worker processes. Results are yielded as they become
+    available, not necessarily in the order of the paths."""
+    
+    pool = Pool(processes)
+    
+    try:
+    
+        for result in pool.imap_unordered(verify_image,
+                                          ADFSlib.find_images(paths)):
+        
+            yield result
+    
+    finally:
+    
+        pool.close()
+        pool.join()
+
+
+def format_problem(image_path, code, offset, detail, as_json = False):
+
+    level, description = codes[code]
+    
+    if as_json:
+    
+        return json.dumps({"image": image_path, "code": code,
+                           "level": level_names[level], "offset": offset,
+                           "description": description, "detail": detail},
+                          sort_keys = True)
+    
+    if offset is None:
+        offset = "-"
+    else:
+        offset = "%x" % offset
+    
+    return "\t".join([image_path, level_names[level], code, offset,
+                      description, detail])
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] <image or directory>...\n\n"
+             "Checks the maps and catalogues of ADFS disc images and reports\n"
+             "each problem found on a line of its own, with the image path,\n"
+             "level, code, hexadecimal offset on the disc, description and\n"
+             "details, separated by tabs. The exit status is 1 if any errors\n"
+             "are found.\n\n"
+             "Example: %prog --json Archive > report.json")
+    
+    parser = OptionParser(usage = usage)
+    parser.add_option("-j", "--jobs", type = "int", default = None,
+                      help = "number of worker processes (default: one per CPU)")
+    parser.add_option("--json", action = "store_true", default = False,
+                      help = "write each problem as a JSON object instead")
+    parser.add_option("-e", "--errors-only", action = "store_true",
+                      default = False,
+                      help = "only report errors, not warnings")
+    
+    options, args = parser.parse_args()
+    
+    if not args:
+        parser.print_help()
+        sys.exit(1)
+    
+    errors = 0
+    
+    for image_path, problems in verify_images(args, options.jobs):
+    
+        for code, offset, detail in problems:
+        
+            level = codes[code][0]
+            
+            if level == ERROR:
+                errors = errors + 1
+            elif options.errors_only:
+                continue
+            
+            print(format_problem(image_path, code, offset, detail,
+                                 options.json))
+    
+    if errors:
+        sys.exit(1)
+    
+    sys.exit(0)
@@ -21,38 +21,18 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import errno, os, struct, sys, time
+import errno, os, posixpath, string, sys, threading, time
 from os.path import stat
 
 import fuse
 from fuse import Fuse
 fuse.fuse_python_api = (0, 2)
 
-import ADFSlib
+import ADFScache, ADFSlib, ADFSnames
 
-__author__ = "David Boddie <david@boddie.org.uk>"
-__version__ = "0.21"
-__date__ = "Saturday 25th November 2017"
-__license__ = "GNU General Public License version 3 (or later)"
+from ADFSversion import __author__, __version__, __date__, __license__
 
 
-# Find the number of centiseconds between 1900 and 1970.
-between_epochs = ((365 * 70) + 17) * 24 * 360000L
-
-def from_riscos_time(load, exec_):
-
-    # RISC OS time is given as a five byte block containing the
-    # number of centiseconds since 1900 (presumably 1st January 1900).
-    
-    value = struct.unpack("<Q", struct.pack("<IBxxx", exec_, load & 0xff))[0]
-    
-    # Convert the time to the time elapsed since the Epoch (assuming
-    # 1970 for this value).
-    centiseconds = value - between_epochs
-    
-    # Convert this to a value in seconds and return a time tuple.
-    return int(centiseconds / 100)
-
 class ADFS_Error(Exception):
 
     pass
@@ -77,30 +57,38 @@ class ADFSstat(fuse.Stat):
 
 class File:
 
-    def __init__(self, name, data, load, exec_, length):
+    def __init__(self, name, data, load, exec_, length, entry = None):
     
+        # The data is None for files in an image, which are read from the
+        # catalogue entry when needed.
         self.name = name
         self.data = data
         self.load = load
         self.exec_ = exec_
         self.length = length
+        self.entry = entry
     
     def stat(self):
     
         info = ADFSstat()
         info.st_mode = stat.S_IFREG | stat.S_IRUSR
-        info.st_size = len(self.data)
-        info.st_mtime = from_riscos_time(self.load, self.exec_)
+        if self.data is None:
+            info.st_size = self.length
+        else:
+            info.st_size = len(self.data)
+        info.st_mtime = \
+            ADFSlib.riscos_centiseconds(self.load, self.exec_) // 100
         info.st_nlink = 1
         return info
 
 class Directory:
 
-    def __init__(self, name, objects, time_stamp):
+    def __init__(self, name, objects, time_stamp, entry = None):
     
         self.name = name
         self.objects = objects
         self.time_stamp = time_stamp
+        self.entry = entry
     
     def __repr__(self):
     
@@ -120,94 +108,458 @@ class Directory:
         for obj in self.objects:
         
             if isinstance(obj, ADFSlib.ADFSfile):
-                objs.append(File(obj.name, obj.data, obj.load_address, obj.execution_address, obj.length))
+                objs.append(File(obj.name, None, obj.load_address, obj.execution_address, obj.length, obj))
             else:
-                objs.append(Directory(obj.name, obj.files, self.time_stamp))
+                objs.append(Directory(obj.name, obj.files, self.time_stamp, obj))
         
         return objs
 
 
-class ADFS(Fuse):
+class HostDirectory:
+
+    """Represents a directory in the host filing system when a directory of
+    images is mounted. Image files are also represented by instances of this
+    class until their contents are needed."""
+    
+    def __init__(self, path):
+    
+        self.path = path
+    
+    def stat(self):
+    
+        info = ADFSstat()
+        info.st_mode = stat.S_IFDIR | stat.S_IRUSR | stat.S_IXUSR
+        info.st_mtime = int(os.stat(self.path).st_mtime)
+        info.st_nlink = 2
+        return info
+    
+    def contents(self):
+    
+        return sorted(os.listdir(self.path))
+
+
+class ADFS(Fuse, ADFSnames.NameEncoder):
 
+    overlay_store = None
+    commit_path = None
+    metrics_path = None
+    
     def __init__(self, *args, **kwargs):
     
         Fuse.__init__(self, *args, **kwargs)
+        ADFSnames.NameEncoder.__init__(self)
+    
+    def check_options(self):
+    
+        """Checks the values of the mount options, raising an ADFS_Error
+        exception if any are invalid or cannot be used together. The timeout
+        options are passed on to FUSE itself."""
+        
+        try:
+            self.budget = int(getattr(self, "cache_size", "256")) * 1024 * 1024
+        except ValueError:
+            raise ADFS_Error("Invalid cache size specified")
+        
+        if self.budget <= 0:
+            raise ADFS_Error("Invalid cache size specified")
+        
+        for name in ("attr_timeout", "entry_timeout"):
+        
+            value = getattr(self, name, "")
+            
+            if value == "":
+                continue
+            
+            try:
+                seconds = float(value)
+            except ValueError:
+                seconds = -1
+            
+            if seconds < 0:
+                raise ADFS_Error("Invalid %s specified" % name)
+            
+            self.fuse_args.add(name, value)
+        
+        if self.suffixes not in ADFSnames.suffix_modes:
+            raise ADFS_Error("The suffixes option must be one of: %s" %
+                             ", ".join(ADFSnames.suffix_modes))
+        
+        if self.inf_files not in ADFSnames.inf_modes:
+            raise ADFS_Error("The inf_files option must be one of: %s" %
+                             ", ".join(ADFSnames.inf_modes))
+        
+        writable = getattr(self, "writable", False) or \
+                   getattr(self, "overlay", False) or \
+                   getattr(self, "overlay_file", "")
+        
+        if writable and (getattr(self, "lazy", False) or
+                         getattr(self, "mmap", False)):
+            
+            raise ADFS_Error("The lazy and mmap options cannot be used with "
+                             "writable images")
+        
+        if getattr(self, "metrics", ""):
         
-        self.info_handlers = \
-        {
-            0xfca00:    self.squash_info,
-            0xddc00:    self.nspark_info
-        }
+            # Use an absolute path because the current directory changes
+            # when the process is daemonized.
+            self.metrics_path = os.path.abspath(self.metrics)
+            
+            if not os.access(os.path.dirname(self.metrics_path), os.W_OK):
+                raise ADFS_Error("The metrics file cannot be written")
     
     def main(self):
     
+        self.root_time = time.time()
+        self.journal = None
+        self.image_path = None
+        self.lock = threading.Lock()
+        
+        # The readers of open files that are read with read-ahead, indexed by
+        # their identities, and counts of the requests handled. The counts
+        # are only approximate when requests are handled in several threads.
+        self.readers = {}
+        self.counters = {"lookups": 0, "opens": 0, "reads": 0,
+                         "bytes read": 0}
+        
+        self.check_options()
+        
+        recover = getattr(self, "recover", False)
+        use_mmap = getattr(self, "mmap", False)
+        
+        if getattr(self, "images", ""):
+        
+            if getattr(self, "writable", False):
+                raise ADFS_Error("A directory of images cannot be written to")
+            
+            # Serve a directory of images, each of which is only read when its
+            # contents are first needed. Use an absolute path because the
+            # current directory changes when the process is daemonized.
+            if not os.path.isdir(self.images):
+                raise ADFS_Error("The images path is not a directory")
+            
+            self.image_dir = os.path.abspath(self.images)
+            self.adfsdisc = None
+            self.cache = ADFScache.ImageCache(
+                self.budget,
+                lambda path: ADFScache.load_image(path, recover, use_mmap)
+                )
+            
+            return Fuse.main(self)
+        
+        self.image_dir = None
+        
         if hasattr(self, "image"):
             path = self.image
         else:
-            raise ADFS_Error, "No path specified"
+            raise ADFS_Error("No path specified")
+        
+        overlay_file = getattr(self, "overlay_file", "")
+        overlay = getattr(self, "overlay", False) or overlay_file
+        
+        if getattr(self, "writable", False) or overlay:
+        
+            if recover:
+                raise ADFS_Error("Recovered directories cannot be written to")
+            
+            # Changes are kept in memory and written to the image when files
+            # are synchronised or the filesystem is unmounted. Requests are
+            # handled one at a time so that they are applied in order. The
+            # image is reopened when changes are written, so use absolute
+            # paths in case the current directory changes.
+            path = os.path.abspath(path)
+            
+            # The writer is only imported when it is needed.
+            import ADFSwriter
+            
+            try:
+            
+                if overlay:
+                
+                    # Write to an overlay instead of the image itself.
+                    if overlay_file:
+                        overlay_file = os.path.abspath(overlay_file)
+                    
+                    self.overlay_store = ADFSwriter.ImageOverlay(
+                        path, overlay_file or None
+                        )
+                    self.journal = ADFSwriter.ADFSjournal(
+                        path, self.overlay_store
+                        )
+                else:
+                    self.journal = ADFSwriter.ADFSjournal(path)
+            
+            except (IOError, ADFSlib.ADFS_exception):
+                raise ADFS_Error("Failed to open the image file for writing")
+            
+            if getattr(self, "commit", ""):
+                self.commit_path = os.path.abspath(self.commit)
+            
+            self.adfsdisc = self.journal.disc
+            self.multithreaded = 0
+            
+            return Fuse.main(self)
+        
+        self.image_path = os.path.abspath(path)
+        
+        if getattr(self, "lazy", False):
+        
+            # The catalogue is read when it is first needed.
+            if not os.access(self.image_path, os.R_OK):
+                raise ADFS_Error("Failed to open the image file specified")
+            
+            self.adfsdisc = None
+        
+        else:
+            self.adfsdisc = self.open_image()
+        
+        return Fuse.main(self)
+    
+    def open_image(self):
+    
+        """Returns an ADFSdisc instance for the image being mounted. File data
+        is only read from the image when it is needed if the lazy or mmap
+        options are used."""
+        
+        lazy = getattr(self, "lazy", False)
+        use_mmap = getattr(self, "mmap", False)
         
         try:
         
-            self.adffile = open(path, "rb")
-            self.adfsdisc = ADFSlib.ADFSdisc(self.adffile, verify = 1)
+            self.adffile = open(self.image_path, "rb")
+            return ADFSlib.ADFSdisc(self.adffile, verify = 1,
+                                    copy_data = not (lazy or use_mmap),
+                                    use_mmap = use_mmap,
+                                    recover = getattr(self, "recover", False))
         
         except IOError:
         
-            raise ADFS_Error, "Failed to open the image file specified"
+            raise ADFS_Error("Failed to open the image file specified")
         
         except ADFSlib.ADFS_exception:
         
             self.adffile.close()
             raise ADFS_Error
+    
+    def load_disc(self):
+    
+        """Returns the ADFSdisc instance for the image being mounted, reading
+        the image first if its catalogue is read lazily and has not been read
+        yet."""
         
-        self.root_time = time.time()
+        if self.adfsdisc is None:
         
-        return Fuse.main(self)
+            self.lock.acquire()
+            try:
+                if self.adfsdisc is None:
+                    self.adfsdisc = self.open_image()
+            finally:
+                self.lock.release()
+        
+        return self.adfsdisc
+    
+    def stats(self):
+    
+        """Returns a dictionary describing the mount options in use and the
+        requests handled since the filesystem was mounted."""
+        
+        options = {"cache_size": self.budget // (1024 * 1024),
+                   "suffixes": self.suffixes,
+                   "inf_files": self.inf_files,
+                   "metrics": self.metrics_path or ""}
+        
+        for name in ("attr_timeout", "entry_timeout", "image", "images",
+                     "commit", "overlay_file"):
+            options[name] = getattr(self, name, "")
+        
+        for name in ("lazy", "mmap", "recover", "writable", "overlay"):
+            options[name] = bool(getattr(self, name, False))
+        
+        stats = dict(self.counters)
+        stats["options"] = options
+        stats["uptime"] = time.time() - self.root_time
+        stats["open files"] = len(self.readers)
+        stats["image loaded"] = self.image_dir is None and \
+                                self.adfsdisc is not None
+        
+        cache = getattr(self, "cache", None)
+        
+        if cache is not None:
+        
+            stats["cache"] = {"hits": cache.hits, "misses": cache.misses,
+                              "evictions": cache.evictions,
+                              "size": cache.size, "budget": cache.budget}
+        
+        return stats
+    
+    def write_metrics(self):
+    
+        """Writes the statistics returned by the stats() method to the file
+        given by the metrics option, if any, as a JSON object."""
+        
+        if self.metrics_path is None:
+            return
+        
+        import json
+        
+        temp_path = self.metrics_path + ".new"
+        
+        try:
+            f = open(temp_path, "w")
+            try:
+                json.dump(self.stats(), f, sort_keys = True)
+            finally:
+                f.close()
+            
+            os.rename(temp_path, self.metrics_path)
+        
+        except (IOError, OSError):
+            pass
+    
+    def find_image(self, path):
+    
+        """Returns a tuple containing the host path of the image that holds
+        the object at path and the path of the object within the image, when
+        a directory of images is mounted.
+        
+        If path refers to a host directory, the path within the image is None.
+        If nothing exists at path, the host path is also None."""
+        
+        elements = [x for x in path.split("/") if x != ""]
+        host_path = self.image_dir
+        
+        for i in range(len(elements)):
+        
+            host_path = os.path.join(host_path, elements[i])
+            
+            if os.path.isdir(host_path):
+                continue
+            elif os.path.isfile(host_path):
+                return host_path, "/".join(elements[i+1:])
+            else:
+                return None, None
+        
+        return host_path, None
+    
+    def find_object(self, path, load = True):
+    
+        """Returns a tuple containing the object at path and the disc that
+        contains it, or None for the object if there is no object at path.
+        
+        When a directory of images is mounted, a HostDirectory is returned for
+        host directories and, if load is False, for image files, so that they
+        can be described without reading them."""
+        
+        self.counters["lookups"] = self.counters["lookups"] + 1
+        
+        if self.image_dir is None:
+        
+            try:
+                disc = self.load_disc()
+            except ADFS_Error:
+                return None, None
+            
+            return self.find_file_within_image(path), disc
+        
+        host_path, inner_path = self.find_image(path)
+        
+        if host_path is None:
+        
+            return None, None
+        
+        elif inner_path is None or (inner_path == "" and not load):
+        
+            return HostDirectory(host_path), None
+        
+        try:
+        
+            disc = self.cache.get(host_path)
+        
+        except (IOError, ADFSlib.ADFS_exception):
+        
+            return None, None
+        
+        return self.find_file_within_image(inner_path, disc.files, disc), disc
     
     def getattr(self, path):
     
-        obj = self.find_file_within_image(path)
+        obj, disc = self.find_object(path, load = False)
         
         if obj is None:
         
-            return -1
+            return -errno.ENOENT
+        
+        info = obj.stat()
+        
+        if self.journal is not None:
         
-        return obj.stat()
+            info.st_mode = info.st_mode | stat.S_IWUSR
+        
+        return info
     
     def readlink(self, path):
     
-        # readlink is not supported
-        return -1
+        # readlink is not supported since there are no links
+        if self.find_object(path, load = False)[0] is None:
+            return -errno.ENOENT
+        
+        return -errno.EINVAL
     
     def readdir(self, path, offset):
     
-        obj = self.find_file_within_image(path)
+        obj, disc = self.find_object(path)
+        
+        if isinstance(obj, HostDirectory):
         
-        if obj is not None and isinstance(obj, Directory):
+            for name in obj.contents():
+            
+                yield fuse.Direntry(name)
+        
+        elif obj is not None and isinstance(obj, Directory):
         
             for entry in obj.contents():
             
-                yield fuse.Direntry(self.encode_name_from_object(entry))
+                name = self.encode_name_from_object(entry, disc)
+                yield fuse.Direntry(name)
+                
+                # The .inf files are only listed if they are shown for all
+                # discs; otherwise, they can be found but are not listed.
+                if self.inf_files == "show" and isinstance(entry, File):
+                    yield fuse.Direntry(name + ".inf")
     
     def unlink(self, path):
     
-        # unlink is not supported
-        return -1
+        return self.modify(path, self._remove, File)
     
     def rmdir(self, path):
     
-        # rmdir is not supported
-        return -1
+        return self.modify(path, self._remove, Directory)
+    
+    def _remove(self, directory, entry):
+    
+        self.journal.remove(directory, entry)
     
     def symlink(self, src, dest):
     
         # symlink is not supported
-        return -1
+        return -errno.EPERM
     
     def rename(self, src, dest):
     
-        # rename is not supported
-        return -1
+        return self.modify(src, self._rename, None, dest)
+    
+    def _rename(self, directory, entry, dest):
+    
+        new_directory, new_name, filetype = self.find_parent(dest)
+        self.journal.rename(directory, entry, new_directory, new_name)
+        
+        if filetype is not None and isinstance(entry, ADFSlib.ADFSfile) and \
+            entry.has_filetype():
+            
+            entry.load_address = (entry.load_address & 0xfff000ff) | \
+                                 (filetype << 8)
+        
+        # The name used in the filesystem needs to be encoded again.
+        entry.__dict__.pop("encoded_name", None)
     
     def link(self, src, dest):
     
@@ -216,280 +568,424 @@ class ADFS(Fuse):
     
     def chmod(self, path, mode):
     
-        # chmod is not supported
-        return -1
+        return self.modify(path, self._chmod, None, mode)
+    
+    def _chmod(self, directory, entry, mode):
+    
+        import ADFSwriter
+        
+        attributes = entry.attributes & ~(ADFSwriter.owner_read |
+                                          ADFSwriter.owner_write)
+        
+        if mode & stat.S_IRUSR:
+            attributes = attributes | ADFSwriter.owner_read
+        if mode & stat.S_IWUSR:
+            attributes = attributes | ADFSwriter.owner_write
+        
+        self.journal.set_attributes(directory, entry, attributes)
     
     def chown(self, path, user, group):
     
         # chown is not supported
-        return -1
+        if self.find_object(path, load = False)[0] is None:
+            return -errno.ENOENT
+        
+        return -errno.EPERM
     
     def truncate(self, path, size):
     
-        obj = self.find_file_within_image(path)
-        
-        if obj is None or isinstance(obj, Directory):
+        return self.modify(path, self.journal_call, File, "truncate", size)
+    
+    def mknod(self, path, mode, dev):
+    
+        if not stat.S_ISREG(mode):
         
-            return -1
+            # Only regular files can be created.
+            return -errno.EPERM
         
-        return obj.data[:size]
+        return self._create_object(path, self._create_file)
     
-    def mknod(self, path, mode, dev):
+    def _create_file(self, directory, name, filetype):
     
-        # mknod is not supported
-        return -1
+        if filetype is None:
+            filetype = 0xffd
+        
+        self.journal.create_file(directory, name, filetype)
     
     def mkdir(self, path, mode):
     
-        # mkdir is not supported
-        return -1
+        return self._create_object(path, self._mkdir)
+    
+    def _mkdir(self, directory, name, filetype):
+    
+        self.journal.mkdir(directory, name)
     
     def utime(self, path, times):
     
-        # utime is not supported
-        return -1
+        return self.modify(path, self.journal_call, None, "set_time_stamp",
+                           times[1])
     
     def open(self, path, flags):
     
-        if flags & (os.O_WRONLY | os.O_RDWR) != 0:
+        if flags & (os.O_WRONLY | os.O_RDWR) != 0 and self.journal is None:
         
             # This filesystem is read-only.
             return -errno.EACCES
         
-        obj = self.find_file_within_image(path)
+        obj, disc = self.find_object(path)
         
-        if obj is None or isinstance(obj, Directory):
+        if obj is None or not isinstance(obj, File):
         
             return -errno.ENOENT
         
+        self.counters["opens"] = self.counters["opens"] + 1
+        
+        if self.reads_directly(obj) and getattr(self, "mmap", False):
+        
+            # Read files from the mapped image with read-ahead. Each handle
+            # has its own reader, which is returned as the file handle and
+            # passed to the methods that use it, so that sequential reads
+            # are detected separately for each handle.
+            reader = ADFScache.ReadAhead(disc, obj.entry)
+            
+            self.lock.acquire()
+            try:
+                self.readers[id(reader)] = reader
+            finally:
+                self.lock.release()
+            
+            return reader
+        
         return 0
     
-    def read(self, path, length, offset):
+    def read(self, path, length, offset, reader = None):
     
-        obj = self.find_file_within_image(path)
+        obj, disc = self.find_object(path)
         
-        if obj is None or isinstance(obj, Directory):
+        if obj is None or not isinstance(obj, File):
         
             return -errno.ENOENT
         
-        return obj.data[offset:offset+length]
+        if self.reads_directly(obj):
+        
+            # Only read the parts of the image that hold the requested data.
+            if reader is not None:
+                data = reader.read(offset, length)
+            else:
+                data = obj.entry.read_range(offset, length)
+        
+        elif obj.data is None and self.journal is not None:
+        
+            # Files in writable images may hold changed data that is read
+            # without copying the rest of the file.
+            data = obj.entry.read_range(offset, length)
+        
+        else:
+            data = self.file_data(obj, path)[offset:offset+length]
+        
+        self.counters["reads"] = self.counters["reads"] + 1
+        self.counters["bytes read"] = self.counters["bytes read"] + len(data)
+        return data
+    
+    def reads_directly(self, obj):
+    
+        """Returns True if the data of the File object, obj, is read from the
+        image being mounted rather than from memory or through the cache."""
+        
+        return obj.data is None and obj.entry is not None and \
+            self.image_dir is None and self.journal is None
     
     def write(self, path, buf, offset):
     
-        # write is not supported
-        return -errno.EACCES
+        result = self.modify(path, self.journal_call, File, "write", buf,
+                             offset)
+        
+        if result == 0:
+            return len(buf)
+        
+        return result
     
-    def release(self, path, flags):
+    def release(self, path, flags, reader = None):
     
+        if reader is not None:
+        
+            self.lock.acquire()
+            try:
+                self.readers.pop(id(reader), None)
+            finally:
+                self.lock.release()
+        
         return 0
     
     def statfs(self):
     
-        files = self.count_files()
+        # Keep the metrics file up to date when the filesystem's usage is
+        # requested, as with the df command.
+        self.write_metrics()
+        
+        info = fuse.StatVfs()
+        info.f_bfree = info.f_bavail = 0
+        info.f_ffree = info.f_favail = 0
+        info.f_flag = 0
+        info.f_namemax = 255
+        
+        if self.image_dir is not None:
         
-        return (self.adfsdisc.sector_size,
-                self.adfsdisc.ntracks * self.adfsdisc.nsectors,
-                0, files, 0)
+            # A directory of images has no single geometry to report.
+            info.f_bsize = info.f_frsize = 1024
+            info.f_blocks = info.f_files = 0
+            return info
+        
+        try:
+            self.load_disc()
+        except ADFS_Error:
+            return -errno.EIO
+        
+        info.f_bsize = info.f_frsize = self.adfsdisc.sector_size
+        info.f_blocks = self.adfsdisc.ntracks * self.adfsdisc.nsectors
+        info.f_files = self.count_files()
+        return info
     
-    def fsync(self, path, isfsyncfile):
+    def fsync(self, path, isfsyncfile, reader = None):
     
-        return 0
+        return self.flush_journal()
     
-    def find_file_within_image(self, path, objs = None):
+    def fsdestroy(self):
     
-        if objs is None:
+        # Write any outstanding changes when the filesystem is unmounted.
+        self.flush_journal()
         
-            objs = self.adfsdisc.files
+        if self.overlay_store is not None:
         
-        elements = path.split("/")
+            if self.commit_path:
+                self.overlay_store.commit(self.commit_path)
+            
+            self.overlay_store.close()
         
-        # Remove any empty elements.
-        elements = filter(lambda x: x != "", elements)
+        self.write_metrics()
+    
+    def flush_journal(self):
+    
+        if self.journal is None:
+            return 0
         
-        if elements == []:
+        try:
         
-            # Special case for root directory.
-            return Directory("/", objs, self.root_time)
+            self.journal.flush()
         
-        for this_obj in objs:
+        except IOError as e:
         
-            # Examine each object and compare its name to the next path
-            # element.
-            
-            if isinstance(this_obj, ADFSlib.ADFSfile):
-            
-                # A file is found. 
-                obj_name = self.encode_name_from_entry(this_obj)
-                
-                if obj_name == elements[0]:
-                
-                    # A match between names.
-                    
-                    if len(elements) == 1:
-                    
-                        # This is the last path element; we have found the
-                        # required file.
-                        return File(
-                            this_obj.name, this_obj.data, this_obj.load_address,
-                            this_obj.execution_address, this_obj.length
-                            )
-                    
-                    else:
-                    
-                        # There are more elements to satisfy but we can
-                        # descend no further.
-                        return None
-                
-                elif self.adfsdisc.disc_type.find("adE") == -1 and \
-                     elements[0] == obj_name + ".inf":
-                
-                    # Old style discs will have .inf files, too.
-                    
-                    if len(elements) == 1:
-                    
-                        # Construct a .inf file to return to the client.
-                        file_data = "%s\t%X\t%X\t%X\n" % \
-                            (this_obj.name, this_obj.load_address,
-                             this_obj.execution_address, this_obj.length)
-                        
-                        return File(this_obj[0] + ".inf", file_data,
-                                    0, 0, len(file_data))
-                    else:
-                        # There are more elements to satisfy but we can
-                        # descend no further.
-                        return None
-            else:
-                # A directory is found.
-                obj_name = self.encode_name_from_entry(this_obj)
-                
-                if obj_name == elements[0]:
-                
-                    # A match between names.
-                    
-                    if len(elements) == 1:
-                    
-                        # This is the last path element; we have found the
-                        # required file.
-                        return Directory(this_obj.name, this_obj.files,
-                                         self.root_time)
-                    
-                    else:
-                    
-                        # More path elements need to be satisfied; descend
-                        # further.
-                        return self.find_file_within_image(
-                            "/".join(elements[1:]), this_obj.files
-                            )
+            return -e.errno
         
-        # No matching objects were found.
-        return None
+        # The image is read again after the changes are written.
+        self.adfsdisc = self.journal.disc
+        return 0
     
-    def count_files(self, root = None):
+    def find_parent(self, path):
     
-        number = 0
+        """Returns a tuple containing the ADFSdirectory that would contain the
+        object at path in a writable image, the RISC OS name of the object
+        and its filetype, or None if the name does not specify one.
         
-        if root is None:
+        A three digit hexadecimal suffix, as added to the names of files
+        without suffixes, is treated as the filetype. Any other dots in the
+        name are stored as slashes, as RISC OS does."""
         
-            root = self.adfsdisc.files
+        dir_path, name = posixpath.split(path)
+        obj, disc = self.find_object(dir_path)
         
-        for obj in root:
+        if not isinstance(obj, Directory):
+            raise IOError(errno.ENOENT, "No such directory: %s" % dir_path)
         
-            if type(obj[1]) != type([]):
-            
-                number = number + 1
-            
-            else:
-            
-                number = number + self.count_files(root = obj[1])
+        directory = obj.entry or self.journal.root
         
-        return number
+        filetype = None
+        base, suffix = posixpath.splitext(name)
+        
+        if len(suffix) == 4 and "." not in base and \
+            not suffix[1:].strip(string.hexdigits):
+        
+            name = base
+            filetype = int(suffix[1:], 16)
+        
+        return directory, name.replace(".", "/"), filetype
     
-    def encode_name_from_object(self, obj):
+    def _create_object(self, path, method):
     
-        if isinstance(obj, File):
+        """Calls method with the directory, name and filetype that describe
+        the new object at path, returning zero or a negative error number.
         
-            return self.encode_name_from_entry(
-                ADFSlib.ADFSfile(obj.name, obj.data, obj.load, obj.exec_, obj.length)
-                )
+        This is not named after any of the operations that python-fuse
+        looks for, such as create, so that requests are not passed to it."""
         
-        else:
+        if self.journal is None:
+            return -errno.EROFS
+        
+        try:
+        
+            directory, name, filetype = self.find_parent(path)
+            method(directory, name, filetype)
         
-            return ".".join(obj.name.split("/"))
+        except IOError as e:
+        
+            return -e.errno
+        
+        self.adfsdisc.__dict__.pop("name_indexes", None)
+        return 0
     
-    def encode_name_from_entry(self, obj):
+    def modify(self, path, method, kind, *args):
     
-        name = obj.name
+        """Calls method with the ADFSdirectory containing the object at path,
+        the object's catalogue entry and the other arguments given, returning
+        zero or a negative error number. If kind is not None, the object must
+        be an instance of that class."""
         
-        # If the name contains a slash then replace it with a dot.
-        new_name = ".".join(name.split("/"))
+        if self.journal is None:
+            return -errno.EROFS
         
-        if self.adfsdisc.disc_type.find("adE") == 0:
+        parent_path, name = posixpath.split(path)
+        parent, disc = self.find_object(parent_path)
+        obj, disc = self.find_object(path)
         
-            if isinstance(obj, ADFSlib.ADFSfile) and "." not in new_name:
+        if obj is None or not isinstance(parent, Directory) or \
+            obj.entry is None:
             
-                # Construct a suffix from the object's load address/filetype.
-                
-                info_handler = self.info_handlers.get(obj.load_address & 0xfff00, None)
-                
-                # Provide default values for the file type, MIME type and
-                # length.
-                filetype = obj.filetype()
-                mimetype = None
-                length = obj.length
-                
-                if info_handler:
-                
-                    filetype, mimetype, length = info_handler(
-                        obj, filetype, mimetype, length
-                        )
-                
-                new_name = new_name + "." + filetype
+            return -errno.ENOENT
+        
+        if kind is not None and not isinstance(obj, kind):
+        
+            if kind is File:
+                return -errno.EISDIR
+            else:
+                return -errno.ENOTDIR
+        
+        try:
+        
+            method(parent.entry or self.journal.root, obj.entry, *args)
+        
+        except IOError as e:
         
-        return new_name
+            return -e.errno
+        
+        # Names may have changed, so the indexes used to find objects are
+        # created again when they are next needed.
+        self.adfsdisc.__dict__.pop("name_indexes", None)
+        return 0
     
-    def squash_info(self, obj, def_filetype, def_mimetype, def_length):
+    def journal_call(self, directory, entry, name, *args):
     
-        # Each Squash file contains the length of the data they
-        # contain once it is decompressed.
+        getattr(self.journal, name)(directory, entry, *args)
+    
+    def file_data(self, obj, path):
+    
+        """Returns the data for the File object, obj, found at path."""
         
-        try:
+        if obj.data is not None:
         
-            length = self.adfsdisc.str2num(4, obj[1][4:8])
+            return obj.data
         
-        except IndexError:
+        elif self.image_dir is None:
         
-            # Use the default length supplied.
-            length = def_length
+            return obj.entry.data
         
-        # For Squash files, use the filetype in the header for
-        # this file's suffix. (Use the disc image's str2num
-        # method to extract the value from the file.)
+        # Read the file through the cache so that the data for frequently
+        # used files is kept in memory, within the cache's budget.
+        host_path, inner_path = self.find_image(path)
+        return self.cache.get_data(host_path, inner_path, obj.entry)
+    
+    def find_file_within_image(self, path, objs = None, disc = None):
+    
+        if disc is None:
         
-        try:
+            disc = self.adfsdisc
+        
+        if objs is None:
+        
+            objs = disc.files
         
-            filetype = (
-                self.adfsdisc.str2num(4, obj[1][8:12]) >> 8
-                ) & 0xfff
+        elements = path.split("/")
+        
+        # Remove any empty elements.
+        elements = [x for x in elements if x != ""]
+        
+        if elements == []:
+        
+            # Special case for root directory.
+            return Directory("/", objs, self.root_time)
+        
+        this_obj, is_inf = self.name_index(objs, disc).get(
+            elements[0], (None, False)
+            )
+        
+        if this_obj is None:
+        
+            # No matching objects were found.
+            return None
+        
+        if isinstance(this_obj, ADFSlib.ADFSfile):
+        
+            if len(elements) > 1:
+            
+                # There are more elements to satisfy but we can descend no
+                # further.
+                return None
+            
+            elif is_inf:
+            
+                # Construct a .inf file to return to the client.
+                file_data = ADFSlib.to_bytes("%s\t%X\t%X\t%X\n" % \
+                    (this_obj.name, this_obj.load_address,
+                     this_obj.execution_address, this_obj.length))
+                
+                return File(this_obj.name + ".inf", file_data,
+                            0, 0, len(file_data))
+            
+            else:
+            
+                # This is the last path element; we have found the required
+                # file.
+                return File(
+                    this_obj.name, None, this_obj.load_address,
+                    this_obj.execution_address, this_obj.length, this_obj
+                    )
         
-        except IndexError:
+        elif len(elements) == 1:
         
-            filetype = 0xfca
+            # This is the last path element; we have found the required
+            # directory.
+            return Directory(this_obj.name, this_obj.files, self.root_time,
+                             this_obj)
         
-        # Let the client discover the MIME type by reading
-        # the file.
-        mimetype = None
+        else:
         
-        return filetype, mimetype, length
+            # More path elements need to be satisfied; descend further.
+            return self.find_file_within_image(
+                "/".join(elements[1:]), this_obj.files, disc
+                )
     
-    def nspark_info(self, obj, def_filetype, def_mimetype, def_length):
+    def count_files(self, root = None):
     
-        # For the archive as a whole, we run the nspark utility with
-        # a contradictory set of options.
+        number = 0
         
-        #command = "nspark -qtv"
+        if root is None:
+        
+            root = self.adfsdisc.files
+        
+        for obj in root:
         
-        # For now, just return the default values.
-        return def_filetype, def_mimetype, def_length
+            if not isinstance(obj, ADFSlib.ADFSdirectory):
+            
+                number = number + 1
+            
+            else:
+            
+                number = number + self.count_files(root = obj.files)
+        
+        return number
+    
+    def encode_name_from_object(self, obj, disc = None):
+    
+        return self.encode_name_from_entry(obj.entry, disc)
 
 
 if __name__ == "__main__":
@@ -499,19 +995,104 @@ if __name__ == "__main__":
              "Usage: %(app)s <mount point> [fuse options]\n\n"
              "Mounts a disk image at the specified mount point.\n"
              'Use fusermount -u <mount point> to dismount the image later.\n\n'
-             "Example: %(app)s /tmp/image -o image=FloppyDisc.adf\n"
+             "Example: %(app)s /tmp/image -o image=FloppyDisc.adf\n\n"
+             "A directory of images can be mounted instead, with each image\n"
+             "presented as a subdirectory of the mount point. The cache size\n"
+             "limits the memory used for images and file data, in megabytes.\n\n"
+             "Example: %(app)s /tmp/images -o images=Archive,cache_size=256\n\n"
+             "E and F format images can be mounted with write access. Changes\n"
+             "are written to the image when files are synchronised and when\n"
+             "the image is dismounted.\n\n"
+             "Example: %(app)s /tmp/image -o image=HardDisc.adE,writable\n\n"
+             "In overlay mode, changes are kept apart from the image, which is\n"
+             "never modified, and can be saved to a new image on dismount.\n\n"
+             "Example: %(app)s /tmp/image -o image=Disc.adE,overlay,commit=New.adE\n\n"
+             "Directories that have become detached from the catalogue of a\n"
+             "damaged image can be shown in a lost+found directory.\n\n"
+             "Example: %(app)s /tmp/image -o image=Damaged.adf,recover\n\n"
+             "Read-only images can be mounted lazily, reading the catalogue\n"
+             "when it is first used, or mapped into memory. The names of\n"
+             "files and the .inf files shown can be changed, and statistics\n"
+             "can be written to a file as the filesystem is used.\n\n"
+             "Example: %(app)s /tmp/image -o image=Disc.adf,mmap,"
+             "attr_timeout=60,metrics=stats.json\n"
              ) % {"app": sys.argv[0], "version": __version__,
                   "date": __date__, "license": __license__}
     
     server = ADFS(version="%prog " + fuse.__version__, usage=usage)
     server.parser.add_option(mountopt="image", metavar="IMAGE", default="",
                              help="specify ADFS disk image")
+    server.parser.add_option(mountopt="images", metavar="DIR", default="",
+                             help="specify a directory of ADFS disk images")
+    server.parser.add_option(mountopt="cache_size", metavar="MB", default="256",
+                             help="memory used for images and file data read "
+                                  "from a directory of images "
+                                  "[default: %default]")
+    server.parser.add_option(mountopt="writable", action="store_true",
+                             default=False,
+                             help="allow changes to be made to an E or F "
+                                  "format image")
+    server.parser.add_option(mountopt="overlay", action="store_true",
+                             default=False,
+                             help="allow changes to be made to an E or F "
+                                  "format image, keeping them in memory "
+                                  "instead of writing them to the image")
+    server.parser.add_option(mountopt="overlay_file", metavar="FILE",
+                             default="",
+                             help="keep the changes made in overlay mode in "
+                                  "a sparse file instead of in memory")
+    server.parser.add_option(mountopt="commit", metavar="FILE", default="",
+                             help="write the image with the changes made in "
+                                  "overlay mode to a new file on dismount")
+    server.parser.add_option(mountopt="recover", action="store_true",
+                             default=False,
+                             help="search damaged images for directories "
+                                  "that are not in the catalogue and show "
+                                  "them in a lost+found directory")
+    server.parser.add_option(mountopt="attr_timeout", metavar="SECONDS",
+                             default="",
+                             help="the time for which the kernel keeps the "
+                                  "attributes of objects [default: FUSE's "
+                                  "own default]")
+    server.parser.add_option(mountopt="entry_timeout", metavar="SECONDS",
+                             default="",
+                             help="the time for which the kernel keeps the "
+                                  "names of objects [default: FUSE's own "
+                                  "default]")
+    server.parser.add_option(mountopt="lazy", action="store_true",
+                             default=False,
+                             help="read the catalogue of a read-only image "
+                                  "when it is first used, and the data of "
+                                  "its files only when they are read")
+    server.parser.add_option(mountopt="mmap", action="store_true",
+                             default=False,
+                             help="map read-only images into memory, reading "
+                                  "files with read-ahead")
+    server.parser.add_option(mountopt="metrics", metavar="FILE", default="",
+                             help="write statistics about the mount options "
+                                  "and requests to a file as JSON when the "
+                                  "filesystem's usage is requested and when "
+                                  "it is unmounted")
+    server.parser.add_option(mountopt="inf_files", metavar="MODE",
+                             default="auto",
+                             help="provide .inf files for the files in "
+                                  "images: auto (on S, M, L and D format "
+                                  "images), show (on all images, listing "
+                                  "them in directories) or hide "
+                                  "[default: %default]")
+    server.parser.add_option(mountopt="suffixes", metavar="MODE",
+                             default="auto",
+                             help="add filetype suffixes to the names of "
+                                  "files: auto (on E, F and hard disc "
+                                  "images), none or all [default: %default]")
     server.parse(values=server, errex=1)
     
     try:
         server.main()
     
-    except ADFS_Error:
+    except ADFS_Error as e:
+        if str(e):
+            sys.stderr.write("%s\n\n" % e)
         sys.stderr.write(usage)
         sys.exit(1)
     
@@ -0,0 +1,347 @@
+#! /usr/bin/env python
+
+"""
+fuse_adfs_ll.py
+
+A FUSE filesystem for ADFS disc images using the low-level, inode-based
+interface provided by the llfuse module.
+
+Copyright (C) 2026 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno, os, stat, sys, time
+from optparse import OptionParser
+
+import llfuse
+
+import ADFScache, ADFSlib, ADFSnames
+
+from ADFSversion import __author__, __version__, __date__, __license__
+
+# With Python 3, llfuse passes names as bytes, but the names of objects in
+# images are text, so they are converted in the same way as the names of
+# files in the host filing system.
+if sys.version_info[0] >= 3:
+
+    fs_name = os.fsencode
+    image_name = os.fsdecode
+
+else:
+
+    def fs_name(name):
+        return name
+    
+    def image_name(name):
+        return name
+
+
+class Node:
+
+    """Represents an object in the disc image that the kernel has looked up
+    or listed, with the inode number it was given. For the .inf files
+    provided on old style discs, obj is the file described and is_inf is
+    True."""
+    
+    def __init__(self, inode, obj, parent, is_inf = False):
+    
+        self.inode = inode
+        self.obj = obj
+        self.parent = parent
+        self.is_inf = is_inf
+    
+    def inf_data(self):
+    
+        obj = self.obj
+        return ADFSlib.to_bytes("%s\t%X\t%X\t%X\n" % (
+            obj.name, obj.load_address, obj.execution_address, obj.length))
+
+
+class ADFSoperations(llfuse.Operations, ADFSnames.NameEncoder):
+
+    """operations = ADFSoperations(disc, timeout = 300)
+    
+    Serves the contents of the ADFSdisc instance, disc, as a read-only
+    filesystem. Each request refers to an object by its inode number, so it
+    is handled without resolving a path from the root directory. Objects are
+    found by name using the index kept for each directory, and directory
+    listings include the attributes of each object.
+    
+    Since the catalogue does not change, the kernel is allowed to keep the
+    attributes and names it is given for timeout seconds.
+    """
+    
+    def __init__(self, disc, timeout = 300):
+    
+        llfuse.Operations.__init__(self)
+        ADFSnames.NameEncoder.__init__(self)
+        
+        self.adfsdisc = disc
+        self.timeout = timeout
+        self.root_time = int(time.time() * 1e9)
+        
+        root = Node(llfuse.ROOT_INODE, disc.root, None)
+        
+        # Nodes are found by inode number, and by the catalogue entry they
+        # represent. Since the catalogue does not change, nodes are kept
+        # once they are created so that each object keeps the same inode
+        # number, whether it is found by a lookup or in a listing.
+        self.nodes = {llfuse.ROOT_INODE: root}
+        self.inodes = {(id(disc.root), False): root}
+        self.next_inode = llfuse.ROOT_INODE + 1
+        
+        # Each open file has a reader that reads the parts of the file that
+        # are requested and asks for the parts that follow them to be read
+        # in advance.
+        self.handles = {}
+        self.next_handle = 1
+    
+    def _node(self, inode):
+    
+        try:
+            return self.nodes[inode]
+        except KeyError:
+            raise llfuse.FUSEError(errno.ENOENT)
+    
+    def _child(self, parent, obj, is_inf = False):
+    
+        # Returns the node for the object in the parent node's directory,
+        # creating it if the object has not been looked up or listed before.
+        key = (id(obj), is_inf)
+        node = self.inodes.get(key)
+        
+        if node is None:
+        
+            node = Node(self.next_inode, obj, parent, is_inf)
+            self.next_inode = self.next_inode + 1
+            self.nodes[node.inode] = node
+            self.inodes[key] = node
+        
+        return node
+    
+    def _attributes(self, node):
+    
+        attr = llfuse.EntryAttributes()
+        attr.st_ino = node.inode
+        attr.entry_timeout = self.timeout
+        attr.attr_timeout = self.timeout
+        attr.st_uid = os.getuid()
+        attr.st_gid = os.getgid()
+        attr.st_blksize = self.adfsdisc.sector_size
+        
+        obj = node.obj
+        
+        if isinstance(obj, ADFSlib.ADFSdirectory):
+        
+            attr.st_mode = stat.S_IFDIR | stat.S_IRUSR | stat.S_IXUSR
+            attr.st_nlink = 2
+            attr.st_mtime_ns = self.root_time
+        
+        else:
+        
+            attr.st_mode = stat.S_IFREG | stat.S_IRUSR
+            attr.st_nlink = 1
+            
+            if node.is_inf:
+                attr.st_size = len(node.inf_data())
+                attr.st_mtime_ns = self.root_time
+            else:
+                attr.st_size = obj.length
+                attr.st_mtime_ns = ADFSlib.riscos_centiseconds(
+                    obj.load_address, obj.execution_address) * 10000000
+        
+        attr.st_atime_ns = attr.st_ctime_ns = attr.st_mtime_ns
+        attr.st_blocks = (attr.st_size + 511) // 512
+        return attr
+    
+    def lookup(self, parent_inode, name, ctx = None):
+    
+        parent = self._node(parent_inode)
+        name = image_name(name)
+        
+        if name == ".":
+            node = parent
+        elif name == "..":
+            node = parent.parent or parent
+        elif not isinstance(parent.obj, ADFSlib.ADFSdirectory):
+            raise llfuse.FUSEError(errno.ENOTDIR)
+        else:
+        
+            index = self.name_index(parent.obj.files, self.adfsdisc)
+            obj, is_inf = index.get(name, (None, False))
+            
+            if obj is None:
+                raise llfuse.FUSEError(errno.ENOENT)
+            
+            node = self._child(parent, obj, is_inf)
+        
+        return self._attributes(node)
+    
+    def forget(self, inode_list):
+    
+        # Nodes are kept until the filesystem is unmounted, so that their
+        # inode numbers do not change, and they only describe objects that
+        # are already held in the catalogue.
+        pass
+    
+    def getattr(self, inode, ctx = None):
+    
+        return self._attributes(self._node(inode))
+    
+    def opendir(self, inode, ctx = None):
+    
+        node = self._node(inode)
+        
+        if not isinstance(node.obj, ADFSlib.ADFSdirectory):
+            raise llfuse.FUSEError(errno.ENOTDIR)
+        
+        return inode
+    
+    def readdir(self, inode, offset):
+    
+        # Each entry is listed with its attributes, and the offset of the
+        # next entry is used to continue a listing that did not fit in the
+        # kernel's buffer.
+        node = self._node(inode)
+        
+        if not isinstance(node.obj, ADFSlib.ADFSdirectory):
+            raise llfuse.FUSEError(errno.ENOTDIR)
+        
+        objs = node.obj.files
+        
+        for i in range(offset, len(objs)):
+        
+            obj = objs[i]
+            child = self._child(node, obj)
+            yield (fs_name(self.encode_name_from_entry(obj, self.adfsdisc)),
+                   self._attributes(child), i + 1)
+    
+    def releasedir(self, fh):
+    
+        pass
+    
+    def open(self, inode, flags, ctx = None):
+    
+        if flags & (os.O_WRONLY | os.O_RDWR) != 0:
+        
+            # This filesystem is read-only.
+            raise llfuse.FUSEError(errno.EACCES)
+        
+        node = self._node(inode)
+        
+        if isinstance(node.obj, ADFSlib.ADFSdirectory):
+            raise llfuse.FUSEError(errno.EISDIR)
+        
+        if node.is_inf:
+            data = node.inf_data()
+            obj = ADFSlib.ADFSfile(node.obj.name + ".inf", data, 0, 0,
+                                   len(data))
+        else:
+            obj = node.obj
+        
+        fh = self.next_handle
+        self.next_handle = self.next_handle + 1
+        self.handles[fh] = ADFScache.ReadAhead(self.adfsdisc, obj)
+        return fh
+    
+    def read(self, fh, offset, length):
+    
+        try:
+            reader = self.handles[fh]
+        except KeyError:
+            raise llfuse.FUSEError(errno.EBADF)
+        
+        return reader.read(offset, length)
+    
+    def release(self, fh):
+    
+        self.handles.pop(fh, None)
+    
+    def statfs(self, ctx = None):
+    
+        disc = self.adfsdisc
+        
+        info = llfuse.StatvfsData()
+        info.f_bsize = info.f_frsize = disc.sector_size
+        info.f_blocks = disc.ntracks * disc.nsectors
+        info.f_bfree = info.f_bavail = 0
+        info.f_files = len(self.nodes)
+        info.f_ffree = info.f_favail = 0
+        info.f_namemax = 255
+        return info
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %prog [options] <image> <mount point>\n\n"
+             "Mounts a disk image at the specified mount point, using the\n"
+             "low-level FUSE interface. The filesystem runs until it is\n"
+             "dismounted with fusermount -u <mount point>.\n\n"
+             "Example: %prog FloppyDisc.adf /tmp/image &")
+    
+    parser = OptionParser(usage = usage, version = "%prog " + __version__)
+    parser.add_option("-t", "--timeout", type = "float", default = 300,
+                      help = "time in seconds for which the kernel may keep "
+                             "names and attributes [default: %default]")
+    parser.add_option("-m", "--mmap", action = "store_true", default = False,
+                      help = "map the image into memory instead of reading "
+                             "it, and read files from it as they are used")
+    parser.add_option("-r", "--recover", action = "store_true",
+                      default = False,
+                      help = "show directories that are not in the catalogue "
+                             "of a damaged image in a lost+found directory")
+    parser.add_option("-w", "--workers", type = "int", default = None,
+                      help = "number of threads used to handle requests")
+    parser.add_option("-d", "--debug", action = "store_true", default = False,
+                      help = "show the requests received from the kernel")
+    
+    options, args = parser.parse_args()
+    
+    if len(args) != 2:
+        parser.print_help()
+        sys.exit(1)
+    
+    image_path, mount_point = args
+    
+    try:
+    
+        disc = ADFSlib.ADFSdisc(open(image_path, "rb"), verify = 1,
+                                copy_data = 0, use_mmap = options.mmap,
+                                recover = options.recover)
+    
+    except (IOError, ADFSlib.ADFS_exception):
+    
+        sys.stderr.write("Failed to open the image file specified\n")
+        sys.exit(1)
+    
+    fuse_options = set(llfuse.default_options)
+    fuse_options.add("fsname=adfs")
+    fuse_options.add("ro")
+    
+    if options.debug:
+        fuse_options.add("debug")
+    
+    llfuse.init(ADFSoperations(disc, options.timeout), mount_point,
+                fuse_options)
+    
+    try:
+        llfuse.main(workers = options.workers)
+    
+    except:
+        llfuse.close(unmount = False)
+        raise
+    
+    llfuse.close()
+    sys.exit(0)
@@ -3,7 +3,7 @@
 from distutils.core import setup
 import sys
 
-import fuse_adfs
+import ADFSversion
 
 setup(
     name         = "fuse_adfs",
@@ -11,10 +11,14 @@ setup(
     
     author       = "David Boddie",
     author_email = "david@boddie.org.uk",
-    license      = fuse_adfs.__license__,
+    license      = ADFSversion.__license__,
     url          = "http://www.boddie.org.uk/david/Projects/Python/FUSE",
-    version      = fuse_adfs.__version__,
+    version      = ADFSversion.__version__,
 
-    py_modules   = ["ADFSlib"],    
-    scripts      = ["fuse_adfs.py"]
+    py_modules   = ["ADFSlib", "ADFScache", "ADFSnames", "ADFSversion",
+                    "ADFSwriter", "ADFSbuilder"],    
+    scripts      = ["fuse_adfs.py", "fuse_adfs_ll.py", "adfs_dedup.py",
+                    "adfs_index.py", "adfs_verify.py", "adfs_space.py",
+                    "adfs_defrag.py", "adfs_build.py", "adfs_convert.py",
+                    "adfs_export.py", "adfs_bench.py"]
     )
@@ -0,0 +1,237 @@
+"""
+test_cache.py, tests that share parsed images and file data between requests
+within a memory budget.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, shutil, struct, sys, tempfile, unittest
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ADFSlib, ADFSwriter
+from ADFScache import ImageCache, ReadAhead, load_image
+from test_images import build
+
+big = bytes(bytearray(range(256))) * 40
+
+
+def merged(ranges):
+
+    """Returns a sorted list of the (start, end) ranges given, with ranges that
+    meet joined together."""
+    
+    joined = []
+    
+    for start, end in sorted(ranges):
+    
+        if joined and joined[-1][1] == start:
+            joined[-1] = (joined[-1][0], end)
+        else:
+            joined.append((start, end))
+    
+    return joined
+
+
+class ImageCacheTests(unittest.TestCase):
+
+    def setUp(self):
+    
+        self.directory = tempfile.mkdtemp()
+        self.paths = {}
+        
+        for disc_format in "SE":
+        
+            path = os.path.join(self.directory, "image." + disc_format)
+            f = open(path, "wb")
+            try:
+                f.write(build(disc_format))
+            finally:
+                f.close()
+            
+            self.paths[disc_format] = path
+        
+        self.loaded = []
+    
+    def tearDown(self):
+    
+        shutil.rmtree(self.directory)
+    
+    def load(self, path):
+    
+        self.loaded.append(os.path.basename(path))
+        return load_image(path)
+    
+    def test_shared(self):
+    
+        s_path = self.paths["S"]
+        cache = ImageCache(1048576, self.load)
+        
+        disc = cache.get(s_path)
+        self.assertTrue(cache.get(s_path) is disc)
+        self.assertEqual(cache.get_data(s_path, "$.Sub.Big"), big)
+        self.assertEqual(cache.get_data(s_path, "$.Sub.Big"), big)
+        self.assertEqual(self.loaded, ["image.S"])
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+        self.assertEqual(cache.size, 163840 + len(big))
+        
+        self.assertRaises(KeyError, cache.get_data, s_path, "$.Missing")
+        self.assertRaises(KeyError, cache.get_data, s_path, "$.Sub")
+        
+        cache.discard(s_path)
+        self.assertEqual((len(cache.entries), cache.size), (0, 0))
+    
+    def test_budget(self):
+    
+        s_path = self.paths["S"]
+        e_path = self.paths["E"]
+        
+        # There is room for both images but not for the file data as well.
+        cache = ImageCache(163840 + 819200, self.load)
+        cache.get_data(s_path, "$.Sub.Big")
+        
+        # The S image was used before its file's data was read, so it is
+        # the least recently used entry when the E image is read.
+        cache.get(e_path)
+        self.assertEqual(list(cache.entries.keys()),
+                         [(s_path, "$.Sub.Big"), e_path])
+        self.assertEqual(cache.evictions, 1)
+        
+        # Discarded images are read again when they are next requested,
+        # and the E image is now the least recently used entry.
+        self.assertEqual(cache.get_data(s_path, "$.Sub.Big"), big)
+        cache.get(s_path)
+        self.assertEqual(self.loaded, ["image.S", "image.E", "image.S"])
+        self.assertEqual(list(cache.entries.keys()),
+                         [(s_path, "$.Sub.Big"), s_path])
+        self.assertEqual(cache.evictions, 2)
+        self.assertTrue(cache.size <= cache.budget)
+        
+        # The most recently requested entry is kept even if it is larger
+        # than the budget.
+        cache = ImageCache(1, self.load)
+        disc = cache.get(e_path)
+        self.assertEqual(list(cache.entries.keys()), [e_path])
+        self.assertTrue(cache.get(e_path) is disc)
+
+
+
+class ReadAheadTests(unittest.TestCase):
+
+    def setUp(self):
+    
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "image.E")
+        
+        f = open(path, "wb")
+        try:
+            f.write(build("E"))
+        finally:
+            f.close()
+        
+        # Make a file that is divided between the spaces left by files
+        # removed from the middle of the disc.
+        journal = ADFSwriter.ADFSjournal(path)
+        
+        for i in range(10):
+            journal.create_file(journal.root, "File%i" % i,
+                                data = struct.pack("<B", i) * 3000)
+        journal.flush()
+        
+        for i in range(0, 10, 2):
+            journal.remove(journal.root, journal.find(journal.root,
+                                                      "File%i" % i))
+        journal.flush()
+        
+        journal.create_file(journal.root, "Large", data = self.data())
+        journal.flush()
+        
+        self.disc = ADFSlib.ADFSdisc(open(path, "rb"))
+        self.obj = self.disc.find("$.Large")
+        
+        # Record the ranges that are requested in advance.
+        self.advised = []
+        self.disc.advise = self.advised.append
+    
+    def tearDown(self):
+    
+        shutil.rmtree(self.directory)
+    
+    def data(self):
+    
+        return bytes(bytearray(range(240))) * 50
+    
+    def test_sequential(self):
+    
+        self.assertTrue(len(self.obj.extents) > 1)
+        
+        reader = ReadAhead(self.disc, self.obj, window = 1024,
+                           max_window = 4096)
+        data = []
+        
+        for offset in range(0, self.obj.length, 512):
+            data.append(reader.read(offset, 512))
+        
+        self.assertEqual(b"".join(data), self.data())
+        
+        # The window doubles each time it is requested, up to the maximum
+        # size, and the requests do not overlap and cover the rest of the
+        # file.
+        sizes = [sum([end - start for start, end in ranges])
+                 for ranges in self.advised]
+        self.assertEqual(sizes[0], 1024)
+        self.assertEqual(reader.window, 4096)
+        self.assertEqual(sum(sizes), self.obj.length - 512)
+        
+        self.assertEqual(merged(sum(self.advised, [])),
+                         merged(self.obj.image_ranges(512, self.obj.length)))
+    
+    def test_physical_order(self):
+    
+        reader = ReadAhead(self.disc, self.obj, window = 16384)
+        self.assertEqual(reader.read(0, 100), self.data()[:100])
+        
+        # The pieces of the file are requested in the order they are stored
+        # in the image.
+        ranges = self.advised[0]
+        self.assertTrue(len(ranges) > 1)
+        self.assertEqual(ranges, sorted(ranges))
+        self.assertEqual(sum([end - start for start, end in ranges]),
+                         self.obj.length - 100)
+    
+    def test_random_access(self):
+    
+        reader = ReadAhead(self.disc, self.obj, window = 1024)
+        reader.read(0, 512)
+        reader.read(512, 512)
+        self.assertEqual(len(self.advised), 2)
+        
+        # Reads made elsewhere in the file are not followed by requests
+        # until reads are sequential again, when the window is reset.
+        self.assertEqual(reader.read(8000, 100), self.data()[8000:8100])
+        self.assertEqual(len(self.advised), 2)
+        self.assertEqual(reader.window, 1024)
+        
+        reader.read(8100, 100)
+        self.assertEqual(len(self.advised), 3)
+        self.assertEqual(self.advised[2], sorted(self.obj.image_ranges(
+                                                 8200, 1024)))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
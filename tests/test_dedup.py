@@ -0,0 +1,126 @@
+"""
+test_dedup.py, tests that index the contents of files in images and find
+the files that are duplicated between and within images.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib, os, shutil, sys, tempfile, unittest
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ADFSlib
+from ADFSbuilder import ImageBuilder
+from adfs_dedup import ContentIndex, duplicate_filter, update_index
+from test_images import build, sample_files
+
+
+def write_file(path, data):
+
+    f = open(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+class DedupTests(unittest.TestCase):
+
+    def setUp(self):
+    
+        self.directory = tempfile.mkdtemp()
+        self.images = os.path.join(self.directory, "images")
+        os.mkdir(self.images)
+        
+        # The E image also holds a copy of the Text file.
+        builder = ImageBuilder("E", "Test")
+        builder.files = [ADFSlib.ADFSfile("Copy", b"Hello\n", 0xfffffff0, 0,
+                                          6)] + sample_files()
+        
+        self.e_path = os.path.join(self.images, "image.E")
+        self.s_path = os.path.join(self.images, "image.S")
+        write_file(self.e_path, builder.build())
+        write_file(self.s_path, build("S"))
+        
+        self.index = ContentIndex(os.path.join(self.directory, "index.db"))
+    
+    def tearDown(self):
+    
+        self.index.close()
+        shutil.rmtree(self.directory)
+    
+    def test_duplicates(self):
+    
+        self.assertEqual(update_index(self.index, [self.images], 1), [])
+        
+        text = hashlib.sha1(b"Hello\n").digest()
+        big = hashlib.sha1(bytes(bytearray(range(256))) * 40).digest()
+        
+        self.assertEqual(self.index.digest_of(self.s_path, "$.Text"), text)
+        self.assertEqual(self.index.digest_of(self.s_path, "$.Copy"), None)
+        
+        # Empty files are only reported if the minimum length allows them.
+        self.assertEqual(sorted(self.index.duplicates()),
+                         sorted([(text, 3), (big, 2)]))
+        self.assertEqual(len(self.index.duplicates(min_length = 0)), 3)
+        
+        self.assertEqual(self.index.locations(text),
+                         [(self.e_path, "$.Copy", 6),
+                          (self.e_path, "$.Text", 6),
+                          (self.s_path, "$.Text", 6)])
+        
+        # Images that can no longer be read are removed from the index.
+        write_file(self.s_path, b"\x00" * 1024)
+        
+        failed = update_index(self.index, [self.images], 1)
+        self.assertEqual([path for path, message in failed], [self.s_path])
+        self.assertEqual(self.index.digest_of(self.s_path, "$.Text"), None)
+        self.assertEqual(len(self.index.locations(text)), 2)
+    
+    def test_duplicate_filter(self):
+    
+        update_index(self.index, [self.images], 1)
+        
+        extracted = {}
+        
+        for image_path in (self.e_path, self.s_path):
+        
+            out_path = os.path.join(self.directory,
+                                    os.path.basename(image_path))
+            disc = ADFSlib.ADFSdisc(open(image_path, "rb"))
+            disc.extract_files(out_path,
+                               skip = duplicate_filter(self.index, image_path))
+            
+            found = []
+            for path, dirs, files in os.walk(out_path):
+            
+                found += [os.path.relpath(os.path.join(path, name), out_path)
+                          for name in files if not name.endswith(",inf")]
+            
+            extracted[image_path] = sorted(found)
+        
+        # Only the first of the files with the same contents is extracted,
+        # and only from the first image that holds them.
+        self.assertEqual(extracted[self.e_path],
+                         ["Copy", os.path.join("Sub", "Big"),
+                          os.path.join("Sub", "Empty")])
+        self.assertEqual(extracted[self.s_path], [])
+
+
+if __name__ == "__main__":
+
+    unittest.main()
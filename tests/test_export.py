@@ -0,0 +1,141 @@
+"""
+test_export.py, tests that write the contents of images to tar and zip
+archives.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import io, os, struct, sys, tarfile, unittest, zipfile
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adfs_export import ZipStream, acorn_extra_id, export_tar, export_zip
+from test_images import build, read, old_formats, new_formats
+
+big = bytes(bytearray(range(256))) * 40
+
+
+class Pipe:
+
+    """Collects the data written to it without supporting seek() or tell(),
+    like a pipe."""
+    
+    def __init__(self):
+    
+        self.data = []
+    
+    def write(self, data):
+    
+        self.data.append(data)
+    
+    def flush(self):
+    
+        pass
+    
+    def getvalue(self):
+    
+        return b"".join(self.data)
+
+
+class ExportTests(unittest.TestCase):
+
+    def test_tar(self):
+    
+        for disc_format in old_formats + new_formats:
+        
+            for compress in (False, True):
+            
+                f = Pipe()
+                export_tar(read(build(disc_format)), f, compress,
+                           filetypes = 1)
+                
+                archive = tarfile.open(fileobj = io.BytesIO(f.getvalue()))
+                members = dict([(info.name, info)
+                                for info in archive.getmembers()])
+                
+                self.assertEqual(sorted(members.keys()),
+                                 ["Sub", "Sub/Big", "Sub/Empty,ffb",
+                                  "Text,fff"])
+                self.assertTrue(members["Sub"].isdir())
+                self.assertEqual(archive.extractfile("Text,fff").read(),
+                                 b"Hello\n")
+                self.assertEqual(archive.extractfile("Sub/Big").read(), big)
+                
+                headers = members["Text,fff"].pax_headers
+                self.assertEqual(headers["RISCOS.name"], u"Text")
+                self.assertEqual(headers["RISCOS.load"], u"fffffff0")
+                self.assertEqual(headers["RISCOS.exec"], u"00000000")
+                headers = members["Sub/Big"].pax_headers
+                self.assertEqual(headers["RISCOS.load"], u"00001900")
+                archive.close()
+    
+    def test_zip(self):
+    
+        for disc_format in old_formats + new_formats:
+        
+            for compress in (False, True):
+            
+                f = Pipe()
+                export_zip(read(build(disc_format)), f, compress)
+                
+                archive = zipfile.ZipFile(io.BytesIO(f.getvalue()))
+                self.assertEqual(archive.testzip(), None)
+                self.assertEqual(sorted(archive.namelist()),
+                                 ["Sub/", "Sub/Big", "Sub/Empty", "Text"])
+                self.assertEqual(archive.read("Text"), b"Hello\n")
+                self.assertEqual(archive.read("Sub/Big"), big)
+                self.assertEqual(archive.read("Sub/Empty"), b"")
+                
+                # Time stamps that zip archives cannot record are limited to
+                # the latest time that they can.
+                self.assertEqual(archive.getinfo("Text").date_time,
+                                 (2107, 12, 31, 23, 59, 58))
+                
+                info = archive.getinfo("Sub/Big")
+                self.assertEqual(info.external_attr >> 16, 0o100644)
+                self.assertEqual(info.compress_type == zipfile.ZIP_DEFLATED,
+                                 compress)
+                
+                extra_id, size, signature, load, exe, attr, reserved = \
+                    struct.unpack("<HH4sIIII", info.extra)
+                self.assertEqual((extra_id, size, signature, load, exe),
+                                 (acorn_extra_id, 20, b"ARC0", 0x1900, 0x1900))
+                archive.close()
+    
+    def test_zip_stream(self):
+    
+        # Data is passed to the archive in chunks that do not divide the
+        # length of the file exactly.
+        f = Pipe()
+        archive = ZipStream(f, zipfile.ZIP_DEFLATED, chunk_size = 1000)
+        archive.add("Dir/", (1980, 1, 1, 0, 0, 0), b"", 0o40755 << 16)
+        archive.add("Dir/File", (2026, 1, 1, 12, 30, 10), b"",
+                    0o100644 << 16, io.BytesIO(big))
+        archive.close()
+        
+        archive = zipfile.ZipFile(io.BytesIO(f.getvalue()))
+        self.assertEqual(archive.testzip(), None)
+        self.assertEqual(archive.namelist(), ["Dir/", "Dir/File"])
+        self.assertEqual(archive.read("Dir/File"), big)
+        self.assertEqual(archive.getinfo("Dir/File").date_time,
+                         (2026, 1, 1, 12, 30, 10))
+        archive.close()
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+test_extract.py, tests that extract the files in images to directories,
+incrementally and with time stamps.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, shutil, sys, tempfile, unittest
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ADFSlib, ADFSwriter
+from ADFSbuilder import ImageBuilder
+
+
+class Output:
+
+    """Collects the messages printed during extraction."""
+    
+    def __init__(self):
+    
+        self.lines = []
+    
+    def write(self, text):
+    
+        self.lines.append(text)
+    
+    def flush(self):
+    
+        pass
+
+
+class ExtractTests(unittest.TestCase):
+
+    def setUp(self):
+    
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "image.E")
+        self.out_path = os.path.join(self.directory, "out")
+        self.manifest = os.path.join(self.directory, "manifest.json")
+        
+        # The files are time stamped 2026-01-01 00:00:00 UTC.
+        load, exe = ADFSlib.riscos_time_stamp(0xfffffd00, 1767225600)
+        
+        builder = ImageBuilder("E", "Test")
+        builder.files = [ADFSlib.ADFSdirectory("Dir", [
+            ADFSlib.ADFSdirectory("Sub", [
+                ADFSlib.ADFSfile("File", b"Sub file\n", load, exe, 9)]),
+            ADFSlib.ADFSdirectory("Old", [
+                ADFSlib.ADFSfile("File", b"Old file\n", load, exe, 9)]),
+            ADFSlib.ADFSfile("Kept", b"Kept\n", load, exe, 5)
+            ])]
+        
+        f = open(self.path, "wb")
+        try:
+            f.write(builder.build())
+        finally:
+            f.close()
+        
+        self.stdout = sys.stdout
+        sys.stdout = self.output = Output()
+    
+    def tearDown(self):
+    
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+    
+    def extract(self, **kwargs):
+    
+        disc = ADFSlib.ADFSdisc(open(self.path, "rb"))
+        disc.extract_files(self.out_path, manifest = self.manifest,
+                           with_time_stamps = True, **kwargs)
+    
+    def out(self, *elements):
+    
+        return os.path.join(self.out_path, *elements)
+    
+    def test_time_stamps(self):
+    
+        self.extract()
+        
+        for path in (self.out("Dir", "Kept"), self.out("Dir", "Kept,inf"),
+                     self.out("Dir", "Sub", "File")):
+            
+            self.assertEqual(int(os.path.getmtime(path)), 1767225600)
+    
+    def test_unchanged_files(self):
+    
+        self.extract()
+        
+        # Files that are unchanged in the image are not written again.
+        f = open(self.out("Dir", "Kept"), "wb")
+        try:
+            f.write(b"Host\n")
+        finally:
+            f.close()
+        
+        self.extract()
+        
+        f = open(self.out("Dir", "Kept"), "rb")
+        try:
+            self.assertEqual(f.read(), b"Host\n")
+        finally:
+            f.close()
+        
+        # Files that are missing are written again.
+        os.remove(self.out("Dir", "Sub", "File"))
+        self.extract()
+        self.assertTrue(os.path.isfile(self.out("Dir", "Sub", "File")))
+    
+    def test_remove_stale(self):
+    
+        self.extract()
+        
+        journal = ADFSwriter.ADFSjournal(self.path)
+        directory = journal.find(journal.root, "Dir")
+        sub = journal.find(directory, "Sub")
+        old = journal.find(directory, "Old")
+        
+        journal.remove(sub, journal.find(sub, "File"))
+        journal.remove(old, journal.find(old, "File"))
+        journal.remove(directory, old)
+        journal.flush()
+        
+        self.output.lines = []
+        self.extract(remove_stale = True)
+        
+        # Directories that are still in the catalogue are kept, even if
+        # they are now empty, but those that are not are removed.
+        self.assertEqual(os.listdir(self.out("Dir", "Sub")), [])
+        self.assertFalse(os.path.exists(self.out("Dir", "Old")))
+        self.assertEqual(sorted(os.listdir(self.out("Dir"))),
+                         ["Kept", "Kept,inf", "Sub"])
+        self.assertFalse("Couldn't" in "".join(self.output.lines))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+test_fuse.py, tests that make requests to the filesystem provided by
+fuse_adfs.py without mounting it.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno, os, shutil, stat, sys, tempfile, unittest
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ADFSlib
+from test_images import build, contents
+
+try:
+    import fuse_adfs
+except ImportError:
+    fuse_adfs = None
+
+
+@unittest.skipIf(fuse_adfs is None, "the FUSE bindings are not installed")
+class FilesystemTests(unittest.TestCase):
+
+    def setUp(self):
+    
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "image.E")
+        
+        f = open(self.path, "wb")
+        try:
+            f.write(build("E"))
+        finally:
+            f.close()
+        
+        # Prepare the filesystem as main() does, without mounting it.
+        self.main = fuse_adfs.Fuse.main
+        fuse_adfs.Fuse.main = lambda server: 0
+        self.server = self.prepare(image = self.path, writable = True)
+    
+    def tearDown(self):
+    
+        fuse_adfs.Fuse.main = self.main
+        shutil.rmtree(self.directory)
+    
+    def prepare(self, **options):
+    
+        server = fuse_adfs.ADFS()
+        server.suffixes = "auto"
+        server.inf_files = "auto"
+        
+        for name, value in options.items():
+            setattr(server, name, value)
+        
+        server.main()
+        return server
+    
+    def reread(self):
+    
+        # Writes the changes to the image and reads it again.
+        self.server.fsdestroy()
+        return ADFSlib.ADFSdisc(open(self.path, "rb"))
+    
+    def test_create_file(self):
+    
+        # Without a create() method, the kernel's request to create a file
+        # is made as a mknod request followed by an open request.
+        server = self.server
+        self.assertEqual(server.mknod("/New", stat.S_IFREG | 0o644, 0), 0)
+        self.assertEqual(server.open("/New", os.O_WRONLY), 0)
+        self.assertEqual(server.write("/New", b"Written\n", 0), 8)
+        self.assertEqual(server.release("/New", os.O_WRONLY), 0)
+        self.assertEqual(server.getattr("/New").st_size, 8)
+        
+        # The file is listed with a suffix for its filetype.
+        self.assertEqual(server.getattr("/New.ffd").st_size, 8)
+        
+        self.assertEqual(contents(self.reread())["$.New"], b"Written\n")
+    
+    def test_missing(self):
+    
+        # New names are looked up before objects are created with them.
+        server = self.server
+        self.assertEqual(server.getattr("/Missing"), -errno.ENOENT)
+        self.assertEqual(server.getattr("/Sub/Missing/File"), -errno.ENOENT)
+        self.assertEqual(server.chown("/Missing", 0, 0), -errno.ENOENT)
+        self.assertEqual(server.readlink("/Missing"), -errno.ENOENT)
+    
+    def test_rename(self):
+    
+        server = self.server
+        self.assertEqual(server.rename("/Text.fff", "/Sub/Renamed.fff"), 0)
+        self.assertEqual(server.getattr("/Text.fff"), -errno.ENOENT)
+        self.assertEqual(server.getattr("/Sub/Renamed.fff").st_size, 6)
+        
+        self.assertEqual(contents(self.reread())["$.Sub.Renamed"],
+                         b"Hello\n")
+    
+    def test_statfs(self):
+    
+        for server in (self.server, self.prepare(image = self.path)):
+        
+            info = server.statfs()
+            self.assertEqual(info.f_bsize, 1024)
+            self.assertEqual(info.f_blocks * info.f_bsize, 819200)
+            self.assertEqual(info.f_bfree, 0)
+            self.assertEqual(info.f_files, 3)
+        
+        info = self.prepare(images = self.directory).statfs()
+        self.assertEqual((info.f_bsize, info.f_blocks, info.f_files),
+                         (1024, 0, 0))
+    
+    def test_mkdir(self):
+    
+        self.assertEqual(self.server.mkdir("/Dir", 0o755), 0)
+        self.assertEqual(self.server.mknod("/Dir/File.fff",
+                                           stat.S_IFREG | 0o644, 0), 0)
+        
+        disc = self.reread()
+        files = dict(disc.walk())
+        self.assertTrue(isinstance(files["$.Dir"], ADFSlib.ADFSdirectory))
+        self.assertEqual((files["$.Dir.File"].load_address >> 8) & 0xfff,
+                         0xfff)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
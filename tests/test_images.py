@@ -0,0 +1,321 @@
+"""
+test_images.py, tests that build small disc images of each format and check
+that they can be read, changed, defragmented and verified.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import io, os, shutil, struct, sys, tempfile, unittest
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ADFSlib, ADFSwriter
+from ADFSbuilder import ImageBuilder
+from adfs_defrag import Defragmenter
+from adfs_verify import Verifier
+
+old_formats = "SMLD"
+new_formats = "EF"
+
+
+def sample_files():
+
+    """Returns a list of files and directories to store in a new image."""
+    
+    big = bytes(bytearray(range(256))) * 40
+    
+    return [ADFSlib.ADFSfile("Text", b"Hello\n", 0xfffffff0, 0, 6),
+            ADFSlib.ADFSdirectory("Sub", [
+                ADFSlib.ADFSfile("Big", big, 0x1900, 0x1900, len(big)),
+                ADFSlib.ADFSfile("Empty", b"", 0xfffffb00, 0, 0)
+                ])]
+
+
+def build(disc_format):
+
+    """Returns a string containing an image of the given format holding the
+    files returned by sample_files()."""
+    
+    builder = ImageBuilder(disc_format, "Test")
+    builder.files = sample_files()
+    return builder.build()
+
+
+def read(data):
+
+    return ADFSlib.ADFSdisc(io.BytesIO(data))
+
+
+def contents(disc):
+
+    """Returns a dictionary mapping the path of each file on the disc to its
+    data."""
+    
+    files = {}
+    
+    for path, obj in disc.walk():
+    
+        if isinstance(obj, ADFSlib.ADFSfile):
+            files[path] = obj.read()
+    
+    return files
+
+
+def codes(problems):
+
+    return sorted(set([code for code, offset, detail in problems]))
+
+
+class InterruptedStore(ADFSwriter.ImageFile):
+
+    """Stops an update once its journal has been written, as if the process
+    making it had been stopped before the image was changed in place."""
+    
+    def begin(self, writes):
+    
+        ADFSwriter.ImageFile.begin(self, writes)
+        raise KeyboardInterrupt
+
+
+class BuildTests(unittest.TestCase):
+
+    def test_round_trip(self):
+    
+        for disc_format in old_formats + new_formats:
+        
+            disc = read(build(disc_format))
+            files = contents(disc)
+            
+            self.assertEqual(sorted(files.keys()),
+                             ["$.Sub.Big", "$.Sub.Empty", "$.Text"])
+            self.assertEqual(files["$.Text"], b"Hello\n")
+            self.assertEqual(files["$.Sub.Big"],
+                             bytes(bytearray(range(256))) * 40)
+            self.assertEqual(files["$.Sub.Empty"], b"")
+            self.assertEqual(Verifier(disc).check(), [])
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+    
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+    
+        shutil.rmtree(self.directory)
+    
+    def image(self, disc_format):
+    
+        path = os.path.join(self.directory, "image." + disc_format)
+        f = open(path, "wb")
+        try:
+            f.write(build(disc_format))
+        finally:
+            f.close()
+        
+        return path
+    
+    def test_old_formats_refused(self):
+    
+        for disc_format in old_formats:
+        
+            self.assertRaises(ADFSlib.ADFS_exception, ADFSwriter.ADFSjournal,
+                              self.image(disc_format))
+    
+    def test_flush(self):
+    
+        for disc_format in new_formats:
+        
+            path = self.image(disc_format)
+            journal = ADFSwriter.ADFSjournal(path)
+            root = journal.root
+            sub = journal.find(root, "Sub")
+            
+            journal.create_file(root, "New", 0xfff, b"Created\n")
+            journal.write(root, journal.find(root, "Text"), b"J", 0)
+            journal.truncate(sub, journal.find(sub, "Big"), 300)
+            journal.remove(sub, journal.find(sub, "Empty"))
+            journal.rename(root, journal.find(root, "New"),
+                           journal.mkdir(root, "Dir"), "Moved")
+            
+            self.assertTrue(journal.modified())
+            journal.flush()
+            self.assertFalse(journal.modified())
+            self.assertFalse(os.path.exists(path + ".journal"))
+            
+            disc = ADFSlib.ADFSdisc(open(path, "rb"))
+            files = contents(disc)
+            
+            self.assertEqual(sorted(files.keys()),
+                             ["$.Dir.Moved", "$.Sub.Big", "$.Text"])
+            self.assertEqual(files["$.Text"], b"Jello\n")
+            self.assertEqual(files["$.Sub.Big"], bytes(bytearray(range(256))) +
+                                                 bytes(bytearray(range(44))))
+            self.assertEqual(files["$.Dir.Moved"], b"Created\n")
+            self.assertEqual(Verifier(disc).check(), [])
+    
+    def test_interrupted_flush(self):
+    
+        for disc_format in new_formats:
+        
+            path = self.image(disc_format)
+            journal = ADFSwriter.ADFSjournal(path, InterruptedStore(path))
+            journal.create_file(journal.root, "New", 0xfff, b"Created\n")
+            
+            self.assertRaises(KeyboardInterrupt, journal.flush)
+            self.assertTrue(os.path.exists(path + ".journal"))
+            
+            # The image still holds the old catalogue until the journal is
+            # replayed when the image is next opened for writing.
+            self.assertFalse("$.New" in contents(
+                ADFSlib.ADFSdisc(open(path, "rb"))))
+            
+            journal = ADFSwriter.ADFSjournal(path)
+            self.assertFalse(os.path.exists(path + ".journal"))
+            self.assertEqual(journal.find(journal.root, "New").read(),
+                             b"Created\n")
+            
+            disc = ADFSlib.ADFSdisc(open(path, "rb"))
+            self.assertEqual(contents(disc)["$.New"], b"Created\n")
+            self.assertEqual(Verifier(disc).check(), [])
+    
+    def fragmented(self, disc_format):
+    
+        # Returns the path of an image containing a file that is divided
+        # between the spaces left by files removed from the middle of the
+        # disc.
+        path = self.image(disc_format)
+        journal = ADFSwriter.ADFSjournal(path)
+        
+        for i in range(10):
+            journal.create_file(journal.root, "File%i" % i,
+                                data = struct.pack("<B", i) * 3000)
+        journal.flush()
+        
+        for i in range(0, 10, 2):
+            journal.remove(journal.root, journal.find(journal.root,
+                                                      "File%i" % i))
+        journal.flush()
+        
+        journal.create_file(journal.root, "Large", data = b"x" * 12000)
+        journal.flush()
+        
+        return path
+    
+    def test_defragment(self):
+    
+        for disc_format in new_formats:
+        
+            disc = ADFSlib.ADFSdisc(open(self.fragmented(disc_format), "rb"))
+            before = ADFSlib.SpaceAnalyser(disc).analyse()
+            self.assertEqual(before["fragmented objects"], 1)
+            
+            defragmenter = Defragmenter(disc)
+            self.assertTrue(defragmenter.moved() > 0)
+            
+            f = io.BytesIO()
+            defragmenter.write(f)
+            new_disc = read(f.getvalue())
+            after = ADFSlib.SpaceAnalyser(new_disc).analyse()
+            
+            self.assertEqual(after["fragmented objects"], 0)
+            self.assertEqual(after["score"], 0)
+            self.assertEqual(ADFSlib.compare_images(disc, new_disc), [])
+            self.assertEqual(Verifier(new_disc).check(), [])
+            
+            # An image that is already compact is copied unchanged.
+            defragmenter = Defragmenter(new_disc)
+            self.assertEqual(defragmenter.moved(), 0)
+            
+            g = io.BytesIO()
+            defragmenter.write(g)
+            self.assertEqual(g.getvalue(), f.getvalue())
+
+
+class VerifyTests(unittest.TestCase):
+
+    def test_old_map_check_byte(self):
+    
+        for disc_format in old_formats:
+        
+            data = bytearray(build(disc_format))
+            data[0xff] = data[0xff] ^ 1
+            
+            self.assertEqual(codes(Verifier(read(bytes(data))).check()),
+                             ["MAP004"])
+    
+    def test_zone_check_byte(self):
+    
+        for disc_format in new_formats:
+        
+            data = build(disc_format)
+            header = read(data).disc_map.header
+            data = bytearray(data)
+            data[header] = data[header] ^ 1
+            
+            # Only the first copy of the map is changed.
+            self.assertEqual(codes(Verifier(read(bytes(data))).check()),
+                             ["MAP001", "MAP003"])
+    
+    def test_directory_check_byte(self):
+    
+        # The check bytes of directories on D format discs are not checked.
+        for disc_format in new_formats:
+        
+            data = build(disc_format)
+            start, end = read(data).root.extents[0]
+            data = bytearray(data)
+            data[end - 1] = data[end - 1] ^ 0x55
+            
+            self.assertEqual(codes(Verifier(read(bytes(data))).check()),
+                             ["DIR003"])
+    
+    def test_missing_object(self):
+    
+        for disc_format in new_formats:
+        
+            # Replace the root directory with one whose entry for Text refers
+            # to an ID that is not in the map.
+            data = build(disc_format)
+            disc = read(data)
+            start, end = disc.root.extents[0]
+            sin = disc.record["root SIN"]
+            
+            entries = []
+            for obj in disc.root.files:
+            
+                if obj.name == "Text":
+                    addr = 0x7f00
+                else:
+                    addr = obj.addr
+                
+                entries.append((obj.raw_name, obj.load_address,
+                                obj.execution_address, obj.length, addr,
+                                ADFSwriter.object_attributes(obj)))
+            
+            data = bytearray(data)
+            data[start:end] = ADFSwriter.new_directory_block(
+                entries, b"$", sin, b"Test", 0)
+            
+            self.assertEqual(codes(Verifier(read(bytes(data))).check()),
+                             ["MAP020", "OBJ003"])
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+test_index.py, tests that record the catalogues of images in an index and
+search it.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, shutil, sys, tempfile, unittest
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adfs_index import CatalogueIndex, update_index
+from test_images import build
+
+
+def write_file(path, data):
+
+    f = open(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+class IndexTests(unittest.TestCase):
+
+    def setUp(self):
+    
+        self.directory = tempfile.mkdtemp()
+        self.images = os.path.join(self.directory, "images")
+        os.mkdir(self.images)
+        
+        self.s_path = os.path.join(self.images, "image.S")
+        self.e_path = os.path.join(self.images, "image.E")
+        write_file(self.s_path, build("S"))
+        write_file(self.e_path, build("E"))
+        
+        self.index = CatalogueIndex(os.path.join(self.directory, "index.db"))
+    
+    def tearDown(self):
+    
+        self.index.close()
+        shutil.rmtree(self.directory)
+    
+    def found(self, *args, **kwargs):
+    
+        return [(os.path.basename(result[0]), result[1])
+                for result in self.index.query(*args, **kwargs)]
+    
+    def test_query(self):
+    
+        self.assertEqual(update_index(self.index, [self.images], 1), [])
+        
+        self.assertEqual(self.found(prefix = "t"),
+                         [("image.E", "$.Text"), ("image.S", "$.Text")])
+        self.assertEqual(self.found(pattern = "$.SUB.*"),
+                         [("image.E", "$.Sub.Big"), ("image.E", "$.Sub.Empty"),
+                          ("image.S", "$.Sub.Big"), ("image.S", "$.Sub.Empty")])
+        self.assertEqual(self.found(filetype = 0xfff),
+                         [("image.E", "$.Text"), ("image.S", "$.Text")])
+        self.assertEqual(self.found(prefix = "Sub", directories = True),
+                         [("image.E", "$.Sub"), ("image.S", "$.Sub")])
+    
+    def test_changed_images(self):
+    
+        update_index(self.index, [self.images], 1)
+        
+        # Images that have not changed are not read again.
+        self.assertEqual(self.index.stale_images([self.s_path, self.e_path]),
+                         [])
+        
+        # Images that can no longer be read, or that no longer exist, are
+        # removed from the index.
+        write_file(self.s_path, b"\x00" * 1024)
+        os.remove(self.e_path)
+        
+        failed = update_index(self.index, [self.images], 1)
+        self.assertEqual([path for path, message in failed], [self.s_path])
+        self.assertEqual(self.found(prefix = "t"), [])
+        self.assertEqual(self.index.stale_images([self.s_path]),
+                         [self.s_path])
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+test_recover.py, tests that read damaged images with the recover option,
+which places directories that are not in the catalogue in lost+found.
+
+Copyright (c) 2026, David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import io, os, sys, unittest
+
+# The modules and utilities are found in the directory above this one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ADFSlib, ADFSwriter
+from ADFSbuilder import ImageBuilder, old_directory_block
+from test_images import build, read, sample_files, old_formats, new_formats
+
+
+def detach(data, name):
+
+    """Returns a copy of the image in the string, data, whose root directory
+    no longer contains an entry for the object with the given name."""
+    
+    disc = read(data)
+    start, end = disc.root.extents[0]
+    new_map = isinstance(getattr(disc, "disc_map", None), ADFSlib.ADFSnewMap)
+    
+    entries = []
+    for obj in disc.root.files:
+    
+        if obj.name == name:
+            continue
+        elif new_map:
+            addr = obj.addr
+        else:
+            addr = obj.extents[0][0] // 256
+        
+        entries.append((obj.raw_name, obj.load_address,
+                        obj.execution_address, obj.length, addr,
+                        ADFSwriter.object_attributes(obj)))
+    
+    if new_map:
+        block = ADFSwriter.new_directory_block(
+            entries, b"$", disc.record["root SIN"], b"Test", 0)
+    elif disc.disc_type == "adD":
+        block = ADFSwriter.new_directory_block(
+            entries, b"$", start // 256, b"Test", 0, marker = b"Hugo")
+    else:
+        block = old_directory_block(entries, b"$", start // 256, b"Test", 0)
+    
+    data = bytearray(data)
+    data[start:end] = block
+    return bytes(data)
+
+
+def paths(disc):
+
+    return [path for path, obj in disc.walk()]
+
+
+class RecoverTests(unittest.TestCase):
+
+    def test_detached_directory(self):
+    
+        for disc_format in old_formats + new_formats:
+        
+            data = detach(build(disc_format), "Sub")
+            self.assertEqual(paths(read(data)), ["$.Text"])
+            
+            disc = ADFSlib.ADFSdisc(io.BytesIO(data), recover = 1)
+            self.assertEqual(paths(disc),
+                             ["$.Text", "$.lost+found", "$.lost+found.Sub",
+                              "$.lost+found.Sub.Big",
+                              "$.lost+found.Sub.Empty"])
+            self.assertEqual(
+                disc.root.lookup("lost+found").lookup("Sub").lookup(
+                    "Big").read(), bytes(bytearray(range(256))) * 40)
+    
+    def test_directory_in_file(self):
+    
+        # A file that starts with a copy of a directory is not a directory
+        # that has been lost. On S, M and L format discs, objects whose data
+        # starts with a directory are read as directories.
+        for disc_format in "D" + new_formats:
+        
+            disc = read(build(disc_format))
+            start, end = disc.root.lookup("Sub").extents[0]
+            block = disc.sectors[start:end]
+            
+            builder = ImageBuilder(disc_format, "Test")
+            builder.files = sample_files() + [
+                ADFSlib.ADFSfile("Copy", block, 0xfffffd00, 0, len(block))]
+            
+            data = builder.build()
+            disc = ADFSlib.ADFSdisc(io.BytesIO(data), recover = 1)
+            self.assertEqual(disc.root.lookup("lost+found"), None)
+            
+            disc = ADFSlib.ADFSdisc(io.BytesIO(detach(data, "Sub")),
+                                    recover = 1)
+            self.assertEqual(paths(disc),
+                             ["$.Copy", "$.Text", "$.lost+found",
+                              "$.lost+found.Sub", "$.lost+found.Sub.Big",
+                              "$.lost+found.Sub.Empty"])
+
+
+if __name__ == "__main__":
+
+    unittest.main()